@@ -1,3 +1,4 @@
+from functools import lru_cache
 from pydantic_settings import BaseSettings
 from typing import List
 import os
@@ -31,14 +32,75 @@ class Settings(BaseSettings):
     # Configuración de Gemini
     GEMINI_API_KEY: str = os.getenv("GEMINI_API_KEY", "")
     GEMINI_MODEL: str = "gemini-1.5-flash"
+    # Caché de contexto para el prefijo estático del prompt (requiere modelo con soporte)
+    GEMINI_CONTEXT_CACHE: bool = os.getenv("GEMINI_CONTEXT_CACHE", "False").lower() == "true"
+    GEMINI_CONTEXT_CACHE_TTL_SECONDS: int = 60 * 60
+    # Presupuesto de latencia de las llamadas a Gemini
+    GEMINI_TIMEOUT_SECONDS: float = 8.0  # por intento
+    GEMINI_DEADLINE_SECONDS: float = 15.0  # total, incluyendo reintentos
+    GEMINI_MAX_RETRIES: int = 2
+    GEMINI_RETRY_BACKOFF_SECONDS: float = 0.2
+    # Hedging: segunda petición si la primera supera el p95 observado
+    GEMINI_HEDGE_ENABLED: bool = os.getenv("GEMINI_HEDGE_ENABLED", "False").lower() == "true"
+    GEMINI_HEDGE_PERCENTILE: float = 0.95
+    GEMINI_HEDGE_MIN_SAMPLES: int = 50
+    # Circuit breaker: con el circuito abierto se usa solo la extracción local
+    GEMINI_BREAKER_FAILURE_RATE: float = 0.5
+    GEMINI_BREAKER_WINDOW: int = 50
+    GEMINI_BREAKER_MIN_CALLS: int = 10
+    GEMINI_BREAKER_OPEN_SECONDS: float = 30.0
+    
+    # Caché de extracciones (respuestas cortas repetidas no llegan a Gemini)
+    EXTRACTION_CACHE_SIZE: int = 10_000
+    EXTRACTION_CACHE_TTL_SECONDS: int = 24 * 60 * 60
+    # Ruta de un archivo SQLite compartido entre workers; vacío = solo caché en proceso
+    EXTRACTION_CACHE_SHARED_PATH: str = os.getenv("EXTRACTION_CACHE_SHARED_PATH", "")
+    
+    # Lotes de /advice/reply/batch
+    ADVICE_BATCH_MAX_ITEMS: int = 500
+    ADVICE_BATCH_CONCURRENCY: int = 32
+    # Tarifa de cotización (YAML/JSON); se recarga sin reiniciar cuando cambia el archivo
+    TARIFF_PATH: str = os.getenv("TARIFF_PATH", "")  # vacío = app/data/tariff.yaml
+    TARIFF_RELOAD_INTERVAL_SECONDS: float = 5.0
+    # Nomenclátor de ciudades (YAML) para resolver la ciudad en tarifa y extracción; vacío = app/data/ecuador_cities.yaml
+    GAZETTEER_PATH: str = os.getenv("GAZETTEER_PATH", "")
+    # Caché de cotizaciones por perfil tarifario equivalente
+    QUOTE_CACHE_SIZE: int = 10_000
+    # Ofertas por cotización: las k más baratas entre los productos elegibles del catálogo
+    QUOTE_TOP_K: int = 3
+    # Cotización en paralelo con las aseguradoras: timeout por aseguradora y presupuesto total
+    CARRIER_TIMEOUT_SECONDS: float = 2.0
+    QUOTE_BUDGET_SECONDS: float = 3.0
+    # Latencia simulada de los adaptadores locales (pruebas de carga)
+    CARRIER_STUB_LATENCY_SECONDS: float = float(os.getenv("CARRIER_STUB_LATENCY_SECONDS", "0"))
+    # Tarificación por lotes (/quotes/batch)
+    QUOTE_BATCH_MAX_PROFILES: int = 200_000
     
     # Configuración de sesiones
     SESSION_TTL_SECONDS: int = 60 * 60  # 1 hora
+    SESSION_BACKEND: str = os.getenv("SESSION_BACKEND", "memory")  # "memory", "sql" o "token"
+    # URL de SQLAlchemy para el backend "sql"; vacío = usa el engine de DATABASE_URL
+    SESSION_DATABASE_URL: str = os.getenv("SESSION_DATABASE_URL", "")
+    # Tope del backend en memoria; al superarlo se desaloja la sesión menos reciente (0 = sin tope)
+    SESSION_MAX_SESSIONS: int = 500_000
+    SESSION_MAX_BYTES: int = 0
+    SESSION_SHARDS: int = 16
+    SESSION_WRITE_BATCH_SIZE: int = 100
+    SESSION_FLUSH_INTERVAL_SECONDS: float = 0.05
+    # Snapshot en disco del backend en memoria para no perder conversaciones al reiniciar (vacío = deshabilitado)
+    SESSION_SNAPSHOT_PATH: str = os.getenv("SESSION_SNAPSHOT_PATH", "")
+    SESSION_SNAPSHOT_INTERVAL_SECONDS: float = 30.0
+    # Backend "token": el estado viaja firmado en el session_id; las claves anteriores siguen
+    # validando tokens emitidos antes de rotar SECRET_KEY (basta mantenerlas SESSION_TTL_SECONDS)
+    SESSION_TOKEN_ENCRYPT: bool = os.getenv("SESSION_TOKEN_ENCRYPT", "False").lower() == "true"
+    SESSION_TOKEN_PREVIOUS_KEYS: str = os.getenv("SESSION_TOKEN_PREVIOUS_KEYS", "")  # separadas por coma
     
     class Config:
         env_file = ".env"
 
+@lru_cache
 def get_settings() -> Settings:
+    """Settings del proceso, construidos una vez (get_settings.cache_clear() para releer el entorno)"""
     return Settings()
 
 settings = get_settings()
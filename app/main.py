@@ -1,18 +1,131 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager, suppress
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.core.config import get_settings
-from app.routers import advice, health
+from app.routers import advice, health, quotes
+from app.services.gemini_service import GeminiService
+from app.services.metrics import MetricsMiddleware
+from app.services.session_service import SessionService
+from app.services.session_store import SQLSessionStore
+from app.services.carrier_adapters import CarrierRegistry
+from app.services.tariff import TariffService
+from app.utils.responses import FastJSONResponse
+
+logger = logging.getLogger(__name__)
 
 # Configuración
 settings = get_settings()
 
+
+async def flush_sessions_periodically(session_service: SessionService, interval: float) -> None:
+    """Envía las escrituras de sesión agrupadas aunque no lleguen más requests"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(session_service.flush)
+        except Exception as e:
+            logger.warning("No se pudieron persistir las sesiones: %s", e)
+
+
+async def snapshot_sessions_periodically(session_service: SessionService, path: str, interval: float) -> None:
+    """Guarda periódicamente un snapshot de las sesiones para restaurarlas tras un reinicio"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(session_service.save_snapshot, path)
+        except Exception as e:
+            logger.warning("No se pudo guardar el snapshot de sesiones: %s", e)
+
+
+async def reload_tariff_periodically(interval: float) -> None:
+    """Recarga la tarifa cuando cambia el archivo, sin reiniciar ni pausar requests"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(TariffService.reload_if_changed)
+        except Exception as e:
+            logger.warning("No se pudo recargar la tarifa: %s", e)
+
+
+async def refresh_gemini_context_cache_periodically(gemini_service: GeminiService, interval: float) -> None:
+    """Extiende la caché de contexto de Gemini antes de que expire su TTL"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(gemini_service.refresh_context_cache)
+        except Exception as e:
+            logger.warning("No se pudo renovar la caché de contexto de Gemini: %s", e)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Crea los recursos compartidos del proceso al arrancar y los libera al apagar"""
+    if settings.TARIFF_PATH:
+        TariffService.configure(settings.TARIFF_PATH)
+    tariff = TariffService.current()
+    logger.info("Tarifa cargada: versión %s", tariff.version)
+    CarrierRegistry.configure(settings.CARRIER_TIMEOUT_SECONDS, settings.CARRIER_STUB_LATENCY_SECONDS)
+
+    session_service = SessionService(ttl_seconds=settings.SESSION_TTL_SECONDS)
+    snapshot_path = settings.SESSION_SNAPSHOT_PATH
+    if snapshot_path:
+        start = time.perf_counter()
+        try:
+            restored = await asyncio.to_thread(session_service.restore_snapshot, snapshot_path)
+            logger.info("Sesiones restauradas: %d en %.2fs", restored, time.perf_counter() - start)
+        except Exception as e:
+            logger.warning("No se pudo restaurar el snapshot de sesiones: %s", e)
+    background = [asyncio.create_task(reload_tariff_periodically(settings.TARIFF_RELOAD_INTERVAL_SECONDS))]
+    if isinstance(session_service.store, SQLSessionStore):
+        # Solo el backend SQL agrupa escrituras en memoria
+        background.append(asyncio.create_task(
+            flush_sessions_periodically(session_service, settings.SESSION_FLUSH_INTERVAL_SECONDS)
+        ))
+    if snapshot_path:
+        background.append(asyncio.create_task(snapshot_sessions_periodically(
+            session_service, snapshot_path, settings.SESSION_SNAPSHOT_INTERVAL_SECONDS
+        )))
+    try:
+        app.state.gemini_service = GeminiService()
+    except ValueError as e:
+        # La app arranca igual; /advice/reply responderá 503 hasta configurar la clave
+        logger.warning("Gemini deshabilitado: %s", e)
+        app.state.gemini_service = None
+    if app.state.gemini_service is not None and settings.GEMINI_CONTEXT_CACHE:
+        # A mitad del TTL, para renovarla con margen aunque una renovación falle
+        background.append(asyncio.create_task(refresh_gemini_context_cache_periodically(
+            app.state.gemini_service, max(settings.GEMINI_CONTEXT_CACHE_TTL_SECONDS / 2, 1.0)
+        )))
+    yield
+    app.state.gemini_service = None
+    for task in background:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    try:
+        await asyncio.to_thread(session_service.flush)
+    except Exception as e:
+        logger.warning("No se pudieron persistir las sesiones: %s", e)
+    if snapshot_path:
+        try:
+            session_service.save_snapshot(snapshot_path)
+        except Exception as e:
+            logger.warning("No se pudo guardar el snapshot de sesiones: %s", e)
+
+
 # Crear aplicación FastAPI
 app = FastAPI(
     title=settings.PROJECT_NAME,
     version=settings.VERSION,
     description=settings.DESCRIPTION,
-    debug=settings.DEBUG
+    debug=settings.DEBUG,
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
 # Configurar CORS
@@ -23,7 +136,9 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 # Incluir routers
 app.include_router(advice.router)
 app.include_router(health.router)
+app.include_router(quotes.router)
@@ -1,5 +1,5 @@
 # Routers de la aplicación
 
-from . import advice, health
+from . import advice, health, quotes
 
-__all__ = ["advice", "health"]
+__all__ = ["advice", "health", "quotes"]
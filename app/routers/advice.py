@@ -1,14 +1,24 @@
-from fastapi import APIRouter, Depends
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic_core import to_json
 from app.schemas.quote import (
-    StartResponse, ReplyRequest, ReplyResponse, QuoteState
+    StartResponse, ReplyRequest, ReplyResponse, QuoteState,
+    BatchReplyRequest, BatchReplyItem, BatchReplyResponse
 )
 from app.services.session_service import SessionService
 from app.services.gemini_service import GeminiService
-from app.services.quote_service import QuoteService
 from app.services.question_service import QuestionService
+from app.services.conversation_service import ConversationService
+from app.services.metrics import STAGE_LATENCY
 from app.core.config import get_settings
+from app.utils.responses import json_response
 
 router = APIRouter(prefix="/advice", tags=["advice"])
+logger = logging.getLogger(__name__)
 
 
 def get_session_service() -> SessionService:
@@ -17,90 +27,107 @@ def get_session_service() -> SessionService:
     return SessionService(ttl_seconds=settings.SESSION_TTL_SECONDS)
 
 
-def get_gemini_service() -> GeminiService:
-    """Dependency para obtener el servicio de Gemini"""
-    return GeminiService()
+def get_gemini_service(request: Request) -> GeminiService:
+    """Dependency para obtener el cliente de Gemini compartido creado en el lifespan"""
+    service = getattr(request.app.state, "gemini_service", None)
+    if service is None:
+        raise HTTPException(status_code=503, detail="Servicio de extracción no disponible")
+    return service
 
 
 @router.post("/start", response_model=StartResponse)
 def start(session_service: SessionService = Depends(get_session_service)) -> StartResponse:
     """Inicia una nueva sesión de asesoría"""
     session_service.prune_sessions()
-    sid = session_service.new_session_id()
-    session_service.create_session(sid, QuoteState())
+    sid = session_service.create_session(session_service.new_session_id(), QuoteState())
     
     message = QuestionService.get_welcome_message()
-    return StartResponse(session_id=sid, message=message)
+    return json_response(StartResponse(session_id=sid, message=message))
 
 
 @router.post("/reply", response_model=ReplyResponse)
-def reply(
+async def reply(
     req: ReplyRequest,
     session_service: SessionService = Depends(get_session_service),
     gemini_service: GeminiService = Depends(get_gemini_service)
 ) -> ReplyResponse:
-    print(f"BUENAS NOCHES!!: {session_service.sessions}")
     """Procesa la respuesta del usuario y genera la siguiente pregunta o cotización"""
-    session_service.prune_sessions()
-    sid = req.session_id
-    
-    # Verificar si la sesión existe
-    if not session_service.session_exists(sid):
-        sid = session_service.new_session_id()
-        session_service.create_session(sid, QuoteState())
-        # return ReplyResponse(
-        #     session_id=sid,
-        #     message=QuestionService.get_session_expired_message(),
-        #     state=QuoteState(),
-        #     quote=None
-        # )
-
-    # Obtener estado actual
-    session_data = session_service.get_session(sid)
-    state: QuoteState = session_data["state"]
-
-    # 1) Extraer información con Gemini
-    extracted = gemini_service.extract_slots(req.user_text)
-
-    # 2) Mezclar con estado previo (coalesce)
-    def coalesce(old, new):
-        return new if new not in (None, "", []) else old
-
-    updated = QuoteState(
-        vehicle_year=coalesce(state.vehicle_year, extracted.get("vehicle_year")),
-        vehicle_make=coalesce(state.vehicle_make, extracted.get("vehicle_make")),
-        vehicle_model=coalesce(state.vehicle_model, extracted.get("vehicle_model")),
-        vehicle_value_usd=coalesce(state.vehicle_value_usd, extracted.get("vehicle_value_usd")),
-        usage=coalesce(state.usage, extracted.get("usage")),
-        city=coalesce(state.city, extracted.get("city")),
-        driver_age=coalesce(state.driver_age, extracted.get("driver_age")),
-        claims_last3y=coalesce(state.claims_last3y, extracted.get("claims_last3y")),
-        anti_theft=coalesce(state.anti_theft, extracted.get("anti_theft")),
-        garage_overnight=coalesce(state.garage_overnight, extracted.get("garage_overnight")),
-        deductible_pct=coalesce(state.deductible_pct, extracted.get("deductible_pct")),
-        addons=coalesce(state.addons, extracted.get("addons")),
+    await session_service.run(session_service.prune_sessions)
+    response = await ConversationService.handle_turn(
+        session_service, gemini_service, req.session_id, req.user_text
     )
+    return json_response(response)
+
 
-    # 3) Verificar si faltan campos obligatorios
-    missing = updated.missing_fields()
-    if missing:
-        question = QuestionService.FIELD_QUESTIONS[missing[0]]
-        session_service.update_session(sid, updated)
-        return ReplyResponse(session_id=sid, message=question, state=updated, quote=None)
-
-    # 4) Verificar preguntas opcionales
-    next_q = QuestionService.next_question(updated)
-    if next_q:
-        session_service.update_session(sid, updated)
-        return ReplyResponse(session_id=sid, message=next_q, state=updated, quote=None)
-
-    # 5) Generar cotización completa
-    quote_result = QuoteService.generate_quote(updated)
-    message = QuestionService.format_quote_message(
-        quote_result.offers,
-        quote_result.recommendation,
-        quote_result.disclaimer
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Formatea un evento Server-Sent Events"""
+    with STAGE_LATENCY.time("serialization"):
+        return f"event: {event}\ndata: {to_json(data).decode()}\n\n"
+
+
+@router.post("/reply/stream")
+async def reply_stream(
+    req: ReplyRequest,
+    session_service: SessionService = Depends(get_session_service),
+    gemini_service: GeminiService = Depends(get_gemini_service)
+) -> StreamingResponse:
+    """Variante SSE de /reply: ack inmediato, extracción parcial, pregunta u ofertas y respuesta final"""
+    await session_service.run(session_service.prune_sessions)
+
+    async def events() -> AsyncIterator[str]:
+        try:
+            async for event, data in ConversationService.stream_turn(
+                session_service, gemini_service, req.session_id, req.user_text
+            ):
+                yield format_sse(event, data)
+        except Exception:
+            # El detalle (Gemini, sesiones) queda en el log; al cliente solo llega el código
+            logger.exception("Falló el turno en streaming de la sesión %s", req.session_id)
+            yield format_sse("error", {"detail": "error"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
-    session_service.update_session(sid, updated)
-    return ReplyResponse(session_id=sid, message=message, state=updated, quote=quote_result)
+
+@router.post("/reply/batch", response_model=BatchReplyResponse)
+async def reply_batch(
+    req: BatchReplyRequest,
+    session_service: SessionService = Depends(get_session_service),
+    gemini_service: GeminiService = Depends(get_gemini_service)
+) -> BatchReplyResponse:
+    """Procesa varios turnos a la vez; los de una misma sesión se procesan en orden"""
+    settings = get_settings()
+    if len(req.items) > settings.ADVICE_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Máximo {settings.ADVICE_BATCH_MAX_ITEMS} mensajes por lote"
+        )
+
+    await session_service.run(session_service.prune_sessions)
+    semaphore = asyncio.Semaphore(settings.ADVICE_BATCH_CONCURRENCY)
+    results: List[Optional[BatchReplyItem]] = [None] * len(req.items)
+
+    groups: Dict[str, List[int]] = {}
+    for index, item in enumerate(req.items):
+        groups.setdefault(item.session_id, []).append(index)
+
+    async def run_group(indices: List[int]) -> None:
+        # Si la sesión caducó, los mensajes siguientes continúan en la sesión nueva
+        sid = req.items[indices[0]].session_id
+        for index in indices:
+            try:
+                async with semaphore:
+                    response = await ConversationService.handle_turn(
+                        session_service, gemini_service, sid, req.items[index].user_text
+                    )
+                sid = response.session_id
+                results[index] = BatchReplyItem(index=index, response=response)
+            except Exception:
+                logger.exception("Falló el mensaje %d del lote (sesión %s)", index, sid)
+                results[index] = BatchReplyItem(index=index, error="error")
+
+    await asyncio.gather(*(run_group(indices) for indices in groups.values()))
+    return json_response(BatchReplyResponse(results=results))
@@ -1,9 +1,19 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse
 from datetime import datetime
 from typing import Dict, Any
 
+from app.services.metrics import REGISTRY, format_stats
+from app.services.quote_service import QUOTE_CACHE
+from app.services.session_service import SessionService
+
 router = APIRouter(tags=["health"])
 
+async def session_stats() -> Dict[str, Any]:
+    """Stats del backend de sesiones, fuera del event loop si hacen I/O (el conteo SQL consulta la base)"""
+    session_service = SessionService()
+    return await session_service.run(session_service.store.stats)
+
 @router.get("/health")
 async def health_check() -> Dict[str, str]:
     """
@@ -16,13 +26,14 @@ async def health_check() -> Dict[str, str]:
     }
 
 @router.get("/health/detailed")
-async def detailed_health_check() -> Dict[str, Any]:
+async def detailed_health_check(request: Request) -> Dict[str, Any]:
     """
     Endpoint para verificar el estado detallado de la API
     """
     try:
         # Aquí puedes agregar verificaciones adicionales
         # como conexión a base de datos, servicios externos, etc.
+        gemini_service = getattr(request.app.state, "gemini_service", None)
         
         return {
             "status": "healthy",
@@ -32,7 +43,24 @@ async def detailed_health_check() -> Dict[str, Any]:
             "checks": {
                 "database": "ok",
                 "external_services": "ok"
-            }
+            },
+            "extraction": gemini_service.stats() if gemini_service else None,
+            "sessions": await session_stats(),
+            "quote_cache": QUOTE_CACHE.stats()
         }
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"Service unhealthy: {str(e)}")
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics(request: Request) -> PlainTextResponse:
+    """
+    Métricas en formato de texto de Prometheus (latencias por etapa, turnos, caché, upstream)
+    """
+    gemini_service = getattr(request.app.state, "gemini_service", None)
+    extra = format_stats("advice_sessions", await session_stats())
+    extra += format_stats("advice_quote_cache", QUOTE_CACHE.stats())
+    if gemini_service is not None:
+        extra += format_stats("advice_extraction", gemini_service.stats())
+    return PlainTextResponse(
+        REGISTRY.render(extra), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
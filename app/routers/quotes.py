@@ -0,0 +1,110 @@
+import math
+from typing import List, Optional
+
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from app.routers.advice import get_session_service
+from app.schemas.quote import (
+    QuoteBatchRequest, QuoteBatchItem, QuoteBatchResponse, SensitivityCell, SensitivityGridResponse, OfferPage
+)
+from app.services.session_service import SessionService
+from app.services.metrics import STAGE_LATENCY
+from app.services.pricing_engine import PricingEngine
+from app.services.tariff import TariffService
+from app.core.config import get_settings
+from app.utils.responses import json_response
+
+router = APIRouter(prefix="/quotes", tags=["quotes"])
+
+
+def _premium_list(row: np.ndarray) -> List[Optional[float]]:
+    """Primas de una fila; NaN (aseguradora sin productos elegibles) como None"""
+    return [None if math.isnan(p) else p for p in row.tolist()]
+
+
+@router.post("/batch", response_model=QuoteBatchResponse)
+def quote_batch(req: QuoteBatchRequest) -> QuoteBatchResponse:
+    """Tarifica muchos perfiles contra todas las aseguradoras en una sola pasada vectorizada"""
+    settings = get_settings()
+    if len(req.profiles) > settings.QUOTE_BATCH_MAX_PROFILES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Máximo {settings.QUOTE_BATCH_MAX_PROFILES} perfiles por lote"
+        )
+
+    results = [None] * len(req.profiles)
+    complete = []
+    for index, state in enumerate(req.profiles):
+        missing = state.missing_fields()
+        if missing:
+            results[index] = QuoteBatchItem(index=index, error=f"Faltan campos: {', '.join(missing)}")
+        else:
+            complete.append(index)
+
+    states = [req.profiles[i] for i in complete]
+    with STAGE_LATENCY.time("quote_batch"):
+        carriers, premiums, plans, tariff_version = PricingEngine.price_batch(states)
+    for row, index in enumerate(complete):
+        if np.isnan(premiums[row]).all():
+            results[index] = QuoteBatchItem(index=index, error="Sin productos elegibles para el perfil")
+            continue
+        results[index] = QuoteBatchItem(
+            index=index,
+            plan=plans[row],
+            premiums=_premium_list(premiums[row]),
+            best_carrier=carriers[int(np.nanargmin(premiums[row]))],
+        )
+    return json_response(QuoteBatchResponse(carriers=carriers, tariff_version=tariff_version, results=results))
+
+
+def _complete_state(session_service: SessionService, session_id: str):
+    """Estado de la sesión con todos los campos para tarificar (404/422 si no)"""
+    session_data = session_service.get_session(session_id)
+    if session_data is None:
+        raise HTTPException(status_code=404, detail="Sesión no encontrada o expirada")
+    state = session_data["state"]
+    missing = state.missing_fields()
+    if missing:
+        raise HTTPException(status_code=422, detail=f"Faltan campos: {', '.join(missing)}")
+    return state
+
+
+@router.get("/grid/{session_id}", response_model=SensitivityGridResponse)
+def sensitivity_grid(
+    session_id: str,
+    session_service: SessionService = Depends(get_session_service)
+) -> SensitivityGridResponse:
+    """Prima de cada aseguradora para todos los deducibles y combinaciones de add-ons de una sesión"""
+    state = _complete_state(session_service, session_id)
+
+    with STAGE_LATENCY.time("sensitivity_grid"):
+        carriers, deductibles, combos, premiums, tariff_version = PricingEngine.sensitivity_grid(state)
+    cells = [
+        SensitivityCell(deductible_pct=pct, addons=list(combo), premiums=_premium_list(premiums[d, a]))
+        for d, pct in enumerate(deductibles)
+        for a, combo in enumerate(combos)
+    ]
+    return json_response(SensitivityGridResponse(
+        session_id=session_id, carriers=carriers, tariff_version=tariff_version, cells=cells
+    ))
+
+
+@router.get("/offers/{session_id}", response_model=OfferPage)
+def offers_page(
+    session_id: str,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(10, ge=1, le=100),
+    session_service: SessionService = Depends(get_session_service)
+) -> OfferPage:
+    """Productos elegibles del catálogo para una sesión, de la prima más baja a la más alta, paginados"""
+    state = _complete_state(session_service, session_id)
+    tariff = TariffService.current()
+    with STAGE_LATENCY.time("offers_page"):
+        offers, total = tariff.catalog.top_offers(
+            state, tariff, offset=(page - 1) * page_size, limit=page_size
+        )
+    return json_response(OfferPage(
+        session_id=session_id, tariff_version=tariff.version, total=total,
+        page=page, page_size=page_size, offers=offers
+    ))
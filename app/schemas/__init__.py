@@ -6,8 +6,18 @@ from .quote import (
     ReplyRequest,
     ReplyResponse,
     Offer,
+    CarrierFailure,
     QuoteResult,
-    Usage
+    Usage,
+    BatchReplyRequest,
+    BatchReplyItem,
+    BatchReplyResponse,
+    QuoteBatchRequest,
+    QuoteBatchItem,
+    QuoteBatchResponse,
+    SensitivityCell,
+    SensitivityGridResponse,
+    OfferPage
 )
 
 __all__ = [
@@ -16,6 +26,16 @@ __all__ = [
     "ReplyRequest",
     "ReplyResponse",
     "Offer",
+    "CarrierFailure",
     "QuoteResult",
-    "Usage"
+    "Usage",
+    "BatchReplyRequest",
+    "BatchReplyItem",
+    "BatchReplyResponse",
+    "QuoteBatchRequest",
+    "QuoteBatchItem",
+    "QuoteBatchResponse",
+    "SensitivityCell",
+    "SensitivityGridResponse",
+    "OfferPage"
 ]
@@ -3,6 +3,9 @@ from pydantic import BaseModel, Field, validator
 
 
 Usage = Literal["particular", "comercial"]
+# Largo máximo de un mensaje del usuario y de los textos del perfil (marca, modelo, ciudad)
+MAX_USER_TEXT_LENGTH = 2000
+MAX_FIELD_LENGTH = 100
 
 
 class QuoteState(BaseModel):
@@ -20,6 +23,11 @@ class QuoteState(BaseModel):
     deductible_pct: Optional[int] = None  # 5/10/15/20
     addons: Optional[List[Literal["asistencia_vial", "auto_reemplazo", "cobertura_lunas"]]] = None
 
+    @validator("vehicle_make", "vehicle_model", "city", pre=True)
+    def clip_text(cls, v):
+        # Texto extraído de respuestas libres: se acota para que la sesión empaquetada no crezca sin límite
+        return v[:MAX_FIELD_LENGTH] if isinstance(v, str) else v
+
     @validator("deductible_pct")
     def check_deductible(cls, v):
         if v is None:
@@ -43,7 +51,7 @@ class StartResponse(BaseModel):
 
 class ReplyRequest(BaseModel):
     session_id: str
-    user_text: str
+    user_text: str = Field(..., max_length=MAX_USER_TEXT_LENGTH)
 
 
 class Offer(BaseModel):
@@ -53,12 +61,20 @@ class Offer(BaseModel):
     deductible_pct: int
     addons: List[str]
     coverage_notes: str
+    product: Optional[str] = None  # producto del catálogo de la aseguradora
+
+
+class CarrierFailure(BaseModel):
+    carrier: str
+    error: str  # "timeout" o "error"
 
 
 class QuoteResult(BaseModel):
     offers: List[Offer]
     recommendation: str
     disclaimer: str
+    tariff_version: Optional[str] = None  # versión de la tarifa que produjo la cotización
+    failed_carriers: List[CarrierFailure] = []  # aseguradoras que fallaron o no respondieron a tiempo
 
 
 class ReplyResponse(BaseModel):
@@ -66,3 +82,58 @@ class ReplyResponse(BaseModel):
     message: str
     state: QuoteState
     quote: Optional[QuoteResult] = None
+
+
+class BatchReplyRequest(BaseModel):
+    items: List[ReplyRequest]
+
+
+class BatchReplyItem(BaseModel):
+    index: int
+    response: Optional[ReplyResponse] = None
+    error: Optional[str] = None
+
+
+class BatchReplyResponse(BaseModel):
+    results: List[BatchReplyItem]
+
+
+class QuoteBatchRequest(BaseModel):
+    profiles: List[QuoteState]
+
+
+class QuoteBatchItem(BaseModel):
+    index: int
+    plan: Optional[str] = None
+    # En el orden de QuoteBatchResponse.carriers; None si la aseguradora no tiene productos elegibles
+    premiums: Optional[List[Optional[float]]] = None
+    best_carrier: Optional[str] = None
+    error: Optional[str] = None
+
+
+class QuoteBatchResponse(BaseModel):
+    carriers: List[str]
+    tariff_version: Optional[str] = None
+    results: List[QuoteBatchItem]
+
+
+class SensitivityCell(BaseModel):
+    deductible_pct: int
+    addons: List[str]
+    premiums: List[Optional[float]]  # en el orden de SensitivityGridResponse.carriers; None sin productos elegibles
+
+
+class SensitivityGridResponse(BaseModel):
+    session_id: str
+    carriers: List[str]
+    tariff_version: str
+    cells: List[SensitivityCell]
+
+
+class OfferPage(BaseModel):
+    session_id: str
+    tariff_version: str
+    total: int  # productos elegibles para el perfil
+    page: int
+    page_size: int
+    offers: List[Offer]
@@ -0,0 +1,141 @@
+import asyncio
+import heapq
+import logging
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import get_settings
+from app.schemas.quote import CarrierFailure, Offer, QuoteState
+from app.services.metrics import REGISTRY, Counter, Histogram
+from app.services.quote_service import QuoteService
+from app.services.tariff import Tariff
+
+logger = logging.getLogger(__name__)
+
+
+CARRIER_LATENCY = REGISTRY.register(Histogram(
+    "advice_carrier_seconds", "Latencia de cotización por aseguradora", labelnames=("carrier",),
+))
+CARRIER_FAILURES = REGISTRY.register(Counter(
+    "advice_carrier_failures_total", "Cotizaciones de aseguradora fallidas o tardías", labelnames=("carrier", "reason"),
+))
+
+
+class CarrierAdapter:
+    """Adaptador de una aseguradora: cotiza un perfil de forma asíncrona con su propio timeout.
+
+    Devuelve sus mejores ofertas (a lo sumo `limit`) ordenadas por prima.
+    """
+
+    def __init__(self, name: str, timeout_seconds: float = 2.0):
+        self.name = name
+        self.timeout_seconds = timeout_seconds
+
+    async def quote(self, state: QuoteState, tariff: Tariff, limit: int) -> List[Offer]:
+        raise NotImplementedError
+
+
+class LocalCarrierAdapter(CarrierAdapter):
+    """Adaptador local que cotiza con la tarifa; la latencia y fallas configurables simulan una API remota"""
+
+    def __init__(self, name: str, timeout_seconds: float = 2.0,
+                 latency_seconds: float = 0.0, failure_rate: float = 0.0):
+        super().__init__(name, timeout_seconds)
+        self.latency_seconds = latency_seconds
+        self.failure_rate = failure_rate
+
+    async def quote(self, state: QuoteState, tariff: Tariff, limit: int) -> List[Offer]:
+        if self.latency_seconds > 0:
+            await asyncio.sleep(self.latency_seconds)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise RuntimeError(f"{self.name} no disponible")
+        return QuoteService.carrier_offers(state, self.name, tariff, limit)
+
+
+class CarrierRegistry:
+    """Registro de adaptadores de aseguradoras y fan-out concurrente de cotizaciones.
+
+    Las aseguradoras de la tarifa sin adaptador registrado usan LocalCarrierAdapter.
+    """
+
+    _adapters: Dict[str, CarrierAdapter] = {}
+    # Cambia con cada registro: separa en la caché las cotizaciones de cada conjunto de adaptadores
+    _version: int = 0
+    default_timeout_seconds: float = 2.0
+    default_latency_seconds: float = 0.0
+
+    @classmethod
+    def configure(cls, timeout_seconds: float, latency_seconds: float = 0.0) -> None:
+        """Parámetros de los adaptadores locales por defecto"""
+        cls.default_timeout_seconds = timeout_seconds
+        cls.default_latency_seconds = latency_seconds
+
+    @classmethod
+    def register(cls, adapter: CarrierAdapter) -> None:
+        cls._adapters[adapter.name] = adapter
+        cls._version += 1
+
+    @classmethod
+    def unregister(cls, name: str) -> None:
+        if cls._adapters.pop(name, None) is not None:
+            cls._version += 1
+
+    @classmethod
+    def cache_namespace(cls) -> str:
+        """Espacio de la caché de cotizaciones: vacío si solo hay adaptadores locales (mismas ofertas
+        que la tarificación local), o uno propio por conjunto de adaptadores registrados"""
+        return f"adapters:{cls._version}" if cls._adapters else ""
+
+    @classmethod
+    def adapters(cls, tariff: Tariff) -> List[CarrierAdapter]:
+        """Adaptadores a consultar: uno por aseguradora de la tarifa más los registrados aparte"""
+        adapters = [
+            cls._adapters.get(name) or LocalCarrierAdapter(
+                name, cls.default_timeout_seconds, cls.default_latency_seconds
+            )
+            for name in tariff.carriers
+        ]
+        adapters.extend(a for name, a in cls._adapters.items() if name not in tariff.carriers)
+        return adapters
+
+    @staticmethod
+    async def _call(adapter: CarrierAdapter, state: QuoteState, tariff: Tariff, limit: int) -> List[Offer]:
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(adapter.quote(state, tariff, limit), adapter.timeout_seconds)
+        finally:
+            CARRIER_LATENCY.observe(time.perf_counter() - start, adapter.name)
+
+    @classmethod
+    async def fan_out(
+        cls, state: QuoteState, tariff: Tariff, budget_seconds: Optional[float] = None
+    ) -> Tuple[List[Offer], List[CarrierFailure]]:
+        """Cotiza con todas las aseguradoras a la vez; devuelve las mejores ofertas que llegan dentro del presupuesto.
+
+        La latencia queda acotada por el presupuesto (o el mayor timeout), no por la suma de latencias.
+        Cada aseguradora entrega a lo sumo QUOTE_TOP_K ofertas y se conservan las QUOTE_TOP_K más baratas.
+        """
+        limit = get_settings().QUOTE_TOP_K
+        adapters = cls.adapters(tariff)
+        tasks = {asyncio.ensure_future(cls._call(a, state, tariff, limit)): a for a in adapters}
+        done, pending = await asyncio.wait(tasks, timeout=budget_seconds) if tasks else (set(), set())
+
+        offers: List[List[Offer]] = []
+        failures: List[CarrierFailure] = []
+        for task in pending:
+            task.cancel()
+        for task, adapter in tasks.items():
+            # Al cliente solo llega el código ("timeout" o "error"); el detalle queda en el log
+            if task in pending or isinstance(task.exception(), asyncio.TimeoutError):
+                reason = "timeout"
+            elif task.exception() is not None:
+                reason = "error"
+                logger.warning("Aseguradora %s falló al cotizar", adapter.name, exc_info=task.exception())
+            else:
+                offers.append(task.result())
+                continue
+            CARRIER_FAILURES.inc(adapter.name, reason)
+            failures.append(CarrierFailure(carrier=adapter.name, error=reason))
+        best = heapq.nsmallest(limit, (o for carrier in offers for o in carrier), key=lambda o: o.annual_premium_usd)
+        return best, failures
@@ -0,0 +1,220 @@
+import time
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from app.core.config import get_settings
+from app.schemas.quote import QuoteState, ReplyResponse
+from app.services.session_service import SessionService
+from app.services.gemini_service import GeminiService
+from app.services.quote_service import QuoteService
+from app.services.question_service import QuestionService
+from app.services.metrics import QUOTES, STAGE_LATENCY, TURN_ERRORS, TURNS, TURNS_TO_QUOTE
+
+
+# Reintentos de compare-and-set cuando otra petición actualiza la misma sesión en paralelo
+MAX_SAVE_ATTEMPTS = 5
+
+
+class ConversationService:
+    """Servicio que procesa un turno de conversación: extracción, mezcla de estado y cotización"""
+
+    @staticmethod
+    def coalesce(old, new):
+        return new if new not in (None, "", []) else old
+
+    @staticmethod
+    def merge_state(state: QuoteState, extracted: dict, expected_field: Optional[str] = None) -> QuoteState:
+        """Mezcla lo extraído con el estado previo sin sobrescribir datos con vacíos"""
+        coalesce = ConversationService.coalesce
+        return QuoteState(
+            vehicle_year=coalesce(state.vehicle_year, extracted.get("vehicle_year")),
+            vehicle_make=coalesce(state.vehicle_make, extracted.get("vehicle_make")),
+            vehicle_model=coalesce(state.vehicle_model, extracted.get("vehicle_model")),
+            vehicle_value_usd=coalesce(state.vehicle_value_usd, extracted.get("vehicle_value_usd")),
+            usage=coalesce(state.usage, extracted.get("usage")),
+            city=coalesce(state.city, extracted.get("city")),
+            driver_age=coalesce(state.driver_age, extracted.get("driver_age")),
+            claims_last3y=coalesce(state.claims_last3y, extracted.get("claims_last3y")),
+            anti_theft=coalesce(state.anti_theft, extracted.get("anti_theft")),
+            garage_overnight=coalesce(state.garage_overnight, extracted.get("garage_overnight")),
+            deductible_pct=coalesce(state.deductible_pct, extracted.get("deductible_pct")),
+            # "ninguno" ante la pregunta de add-ons es una respuesta válida (lista vacía)
+            addons=(extracted.get("addons") if expected_field == "addons" and extracted.get("addons") == []
+                    else coalesce(state.addons, extracted.get("addons"))),
+        )
+
+    @staticmethod
+    def load_state(session_service: SessionService, session_id: str) -> Tuple[str, QuoteState, int, int]:
+        """Obtiene el estado, su versión y los turnos ya procesados, creando una sesión nueva si no existe o caducó"""
+        sid = session_id
+        with STAGE_LATENCY.time("session_lookup"):
+            session_data = session_service.get_session(sid)
+            if session_data is None:
+                sid = session_service.new_session_id()
+                session_data, _ = session_service.get_or_create_session(sid, QuoteState())
+        return sid, session_data["state"], session_data["version"], session_data["turns"]
+
+    @staticmethod
+    def save_state(
+        session_service: SessionService,
+        sid: str,
+        state: QuoteState,
+        version: int,
+        extracted: dict,
+        expected_field: Optional[str],
+        turns: int = 0
+    ) -> Tuple[QuoteState, int, bool]:
+        """Mezcla y guarda con compare-and-set; si otra petición ganó, vuelve a mezclar sobre su estado.
+
+        Solo se repite la mezcla: la extracción ya hecha se reutiliza sin volver a llamar a Gemini.
+        Devuelve el estado guardado, los turnos de la sesión contando este, y si este turno completó
+        el perfil (la primera cotización de la sesión: la mezcla nunca borra campos).
+        """
+        for _ in range(MAX_SAVE_ATTEMPTS):
+            updated = ConversationService.merge_state(state, extracted, expected_field)
+            if session_service.compare_and_update(sid, updated, version, turns + 1):
+                return updated, turns + 1, ConversationService.completes(state, updated)
+            latest, _ = session_service.get_or_create_session(sid, QuoteState())
+            state, version, turns = latest["state"], latest["version"], latest["turns"]
+
+        # Contención persistente sobre la misma sesión: se escribe el último merge
+        updated = ConversationService.merge_state(state, extracted, expected_field)
+        session_service.update_session(sid, updated, turns + 1)
+        return updated, turns + 1, ConversationService.completes(state, updated)
+
+    @staticmethod
+    def completes(previous: QuoteState, updated: QuoteState) -> bool:
+        """True si `updated` ya se puede cotizar y `previous` todavía no"""
+        return (QuestionService.pending_field(previous) is not None
+                and QuestionService.pending_field(updated) is None)
+
+    @staticmethod
+    def save_and_issue_id(
+        session_service: SessionService,
+        sid: str,
+        state: QuoteState,
+        version: int,
+        extracted: dict,
+        expected_field: Optional[str],
+        turns: int = 0
+    ) -> Tuple[QuoteState, str, int, bool]:
+        """save_state y el session_id para el cliente, en una sola llamada al backend"""
+        updated, turns, first_quote = ConversationService.save_state(
+            session_service, sid, state, version, extracted, expected_field, turns
+        )
+        return updated, session_service.client_session_id(sid, updated, turns), turns, first_quote
+
+    @staticmethod
+    async def finish_turn(
+        session_service: SessionService,
+        sid: str,
+        state: QuoteState,
+        version: int,
+        extracted: dict,
+        expected_field: Optional[str],
+        turns: int = 0
+    ) -> ReplyResponse:
+        """Mezcla lo extraído, guarda la sesión y arma la siguiente pregunta o la cotización"""
+        # 2) Mezclar con estado previo (coalesce) y guardar
+        TURNS.inc()
+        with STAGE_LATENCY.time("state_merge"):
+            updated, sid, turns, first_quote = await session_service.run(
+                ConversationService.save_and_issue_id,
+                session_service, sid, state, version, extracted, expected_field, turns
+            )
+
+        # 3) Verificar si faltan campos obligatorios
+        missing = updated.missing_fields()
+        if missing:
+            question = QuestionService.FIELD_QUESTIONS[missing[0]]
+            return ReplyResponse(session_id=sid, message=question, state=updated, quote=None)
+
+        # 4) Verificar preguntas opcionales
+        next_q = QuestionService.next_question(updated)
+        if next_q:
+            return ReplyResponse(session_id=sid, message=next_q, state=updated, quote=None)
+
+        # 5) Generar cotización completa
+        with STAGE_LATENCY.time("quote"):
+            quote_result = await QuoteService.generate_quote_async(updated, get_settings().QUOTE_BUDGET_SECONDS)
+        QUOTES.inc()
+        if first_quote:
+            # Una observación por sesión: los turnos siguientes recotizan pero ya no miden esto
+            TURNS_TO_QUOTE.observe(turns)
+        message = QuestionService.format_quote_message(
+            quote_result.offers,
+            quote_result.recommendation,
+            quote_result.disclaimer
+        )
+
+        return ReplyResponse(session_id=sid, message=message, state=updated, quote=quote_result)
+
+    @staticmethod
+    async def handle_turn(
+        session_service: SessionService,
+        gemini_service: GeminiService,
+        session_id: str,
+        user_text: str
+    ) -> ReplyResponse:
+        """Procesa la respuesta del usuario y genera la siguiente pregunta o cotización"""
+        sid, state, version, turns = await session_service.run(
+            ConversationService.load_state, session_service, session_id
+        )
+
+        # 1) Extraer información (reglas locales para respuestas cortas, Gemini para texto libre)
+        expected_field = QuestionService.pending_field(state)
+        try:
+            with STAGE_LATENCY.time("extraction"):
+                extracted = await gemini_service.extract_slots(user_text, expected_field=expected_field)
+        except Exception:
+            TURN_ERRORS.inc("extraction")
+            raise
+
+        return await ConversationService.finish_turn(
+            session_service, sid, state, version, extracted, expected_field, turns
+        )
+
+    @staticmethod
+    async def stream_turn(
+        session_service: SessionService,
+        gemini_service: GeminiService,
+        session_id: str,
+        user_text: str
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Igual que handle_turn, pero emite eventos (nombre, datos) a medida que hay resultados"""
+        sid, state, version, turns = await session_service.run(
+            ConversationService.load_state, session_service, session_id
+        )
+        yield "ack", {"session_id": sid}
+
+        expected_field = QuestionService.pending_field(state)
+        extracted: Dict[str, Any] = {}
+        # Solo se mide la extracción, no el tiempo que el cliente tarda en consumir los eventos
+        elapsed = 0.0
+        stream = gemini_service.stream_extract_slots(user_text, expected_field=expected_field)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    kind, data = await stream.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - start
+                if kind == "partial":
+                    yield "partial", data
+                else:
+                    extracted = data
+        except Exception:
+            TURN_ERRORS.inc("extraction")
+            raise
+        STAGE_LATENCY.observe(elapsed, "extraction")
+
+        response = await ConversationService.finish_turn(
+            session_service, sid, state, version, extracted, expected_field, turns
+        )
+        if response.quote is not None:
+            for offer in response.quote.offers:
+                yield "offer", offer.model_dump()
+        else:
+            yield "question", {"message": response.message}
+        yield "final", response.model_dump()
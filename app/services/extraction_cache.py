@@ -0,0 +1,215 @@
+import asyncio
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, Optional
+
+from cachetools import TTLCache
+
+
+# Números escritos en palabras que aparecen en respuestas cortas ("diez", "veintiocho mil")
+_NUMBER_WORDS = {
+    "cero": 0, "un": 1, "uno": 1, "una": 1, "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5,
+    "seis": 6, "siete": 7, "ocho": 8, "nueve": 9, "diez": 10, "once": 11, "doce": 12,
+    "trece": 13, "catorce": 14, "quince": 15, "dieciseis": 16, "diecisiete": 17,
+    "dieciocho": 18, "diecinueve": 19, "veinte": 20, "veintiuno": 21, "veintiun": 21,
+    "veintidos": 22, "veintitres": 23, "veinticuatro": 24, "veinticinco": 25,
+    "veintiseis": 26, "veintisiete": 27, "veintiocho": 28, "veintinueve": 29,
+    "treinta": 30, "cuarenta": 40, "cincuenta": 50, "sesenta": 60, "setenta": 70,
+    "ochenta": 80, "noventa": 90, "cien": 100, "ciento": 100,
+}
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s%.,]")
+_WHITESPACE_RE = re.compile(r"\s+")
+_THOUSANDS_SEP_RE = re.compile(r"(?<=\d)[.,](?=\d{3}\b)")
+_DECIMAL_COMMA_RE = re.compile(r"(?<=\d),(?=\d)")
+_PERCENT_RE = re.compile(r"(\d)\s*%")
+_K_SUFFIX_RE = re.compile(r"\b(\d+(?:\.\d+)?)\s*k\b")
+_MIL_RE = re.compile(r"\b(\d+(?:\.\d+)?)\s+mil\b")
+
+
+def _strip_accents(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+
+def _fold_number_words(text: str) -> str:
+    tokens = text.split(" ")
+    out = []
+    i = 0
+    while i < len(tokens):
+        tok = tokens[i]
+        if tok in _NUMBER_WORDS:
+            value = _NUMBER_WORDS[tok]
+            # "treinta y cinco" -> 35
+            if (value >= 30 and value % 10 == 0 and i + 2 < len(tokens)
+                    and tokens[i + 1] == "y" and tokens[i + 2] in _NUMBER_WORDS
+                    and _NUMBER_WORDS[tokens[i + 2]] < 10):
+                value += _NUMBER_WORDS[tokens[i + 2]]
+                i += 2
+            out.append(str(value))
+        else:
+            out.append(tok)
+        i += 1
+    return " ".join(out)
+
+
+def normalize_text(user_text: str) -> str:
+    """Forma canónica del texto: sin mayúsculas, tildes, puntuación ni números en palabras"""
+    text = _strip_accents((user_text or "").lower())
+    text = _PUNCTUATION_RE.sub(" ", text)
+    text = _WHITESPACE_RE.sub(" ", text).strip(" .,")
+    text = text.replace("por ciento", "%")
+    text = _fold_number_words(text)
+    text = _THOUSANDS_SEP_RE.sub("", text)
+    text = _DECIMAL_COMMA_RE.sub(".", text)
+    text = _PERCENT_RE.sub(r"\1%", text)
+    text = _K_SUFFIX_RE.sub(lambda m: _format_number(float(m.group(1)) * 1000), text)
+    text = _MIL_RE.sub(lambda m: _format_number(float(m.group(1)) * 1000), text)
+    # "mil dolares" sin cifra previa equivale a 1000
+    text = re.sub(r"(?<!\d )\bmil\b", "1000", text)
+    return text
+
+
+class CacheBackend:
+    """Backend compartido opcional para que varios workers reutilicen extracciones"""
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Dict[str, Any], ttl_seconds: int) -> None:
+        raise NotImplementedError
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """Backend compartido en un archivo SQLite (modo WAL) para workers del mismo host.
+
+    Cada `prune_every` escrituras se borran las filas expiradas, para que el archivo no crezca sin límite.
+    """
+
+    def __init__(self, path: str, prune_every: int = 500):
+        self.path = path
+        self.prune_every = prune_every
+        self._writes = 0
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS extraction_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS extraction_cache_expires ON extraction_cache (expires_at)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT value FROM extraction_cache WHERE key = ? AND expires_at > ?",
+            (key, time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Dict[str, Any], ttl_seconds: int) -> None:
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO extraction_cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), time.time() + ttl_seconds),
+        )
+        conn.commit()
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune()
+
+    def prune(self) -> int:
+        """Borra las filas expiradas; devuelve cuántas"""
+        conn = self._conn()
+        deleted = conn.execute("DELETE FROM extraction_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+        conn.commit()
+        return deleted
+
+
+class _CountingTTLCache(TTLCache):
+    """TTLCache (LRU + TTL) que cuenta desalojos por tamaño y expiraciones"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.evictions = 0
+        self.expirations = 0
+
+    def popitem(self):
+        item = super().popitem()
+        self.evictions += 1
+        return item
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        self.expirations += len(expired)
+        return expired
+
+
+class ExtractionCache:
+    """Caché LRU+TTL en proceso para resultados de extract_slots"""
+
+    def __init__(self, maxsize: int = 10_000, ttl_seconds: int = 24 * 60 * 60,
+                 backend: Optional[CacheBackend] = None, namespace: str = ""):
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+        self.namespace = namespace
+        self._local = _CountingTTLCache(maxsize=maxsize, ttl=ttl_seconds)
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def key(self, user_text: str, scope: str = "") -> str:
+        """Clave de caché a partir de la forma canónica del texto (y del campo pedido, si aplica)"""
+        return f"{self.namespace}:{scope}:{normalize_text(user_text)}"
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self._local.get(key)
+        if value is not None:
+            self.hits += 1
+            return dict(value)
+        if self.backend is not None:
+            try:
+                value = await asyncio.to_thread(self.backend.get, key)
+            except Exception:
+                value = None
+            if value is not None:
+                self.shared_hits += 1
+                self._local[key] = value
+                return dict(value)
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        self._local[key] = dict(value)
+        if self.backend is not None:
+            try:
+                await asyncio.to_thread(self.backend.set, key, value, self.ttl_seconds)
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._local),
+            "maxsize": int(self._local.maxsize),
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "evictions": self._local.evictions,
+            "expirations": self._local.expirations,
+        }
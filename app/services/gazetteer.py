@@ -0,0 +1,209 @@
+import os
+import re
+import threading
+import unicodedata
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import yaml
+
+from app.services.metrics import REGISTRY, Counter
+
+DEFAULT_GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "ecuador_cities.yaml")
+
+# Largo mínimo (sin espacios) para intentar coincidencias aproximadas: evita "hola" -> "Loja"
+FUZZY_MIN_LENGTH = 5
+# Las coincidencias aproximadas solo se buscan en un resto de hasta estas palabras
+FUZZY_MAX_WORDS = 3
+# Palabras iniciales que se descartan antes de la búsqueda aproximada ("vivo en riobanba" -> "riobanba")
+_LEADING_FILLERS = frozenset((
+    "vivo", "vive", "vivimos", "resido", "soy", "estoy", "estamos", "es", "desde", "por", "aqui", "aca",
+    "en", "de", "del", "la", "el", "los", "las", "mi", "ciudad", "canton", "sector",
+))
+# Tope de la memoización LRU de texto -> lugar (texto libre del usuario o de Gemini)
+_RESOLVE_CACHE_SIZE = 4096
+
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9]+")
+
+CITY_LOOKUPS = REGISTRY.register(Counter(
+    "advice_city_lookups_total", "Resoluciones de ciudad por resultado", labelnames=("result",),
+))
+
+
+def fold(text: Optional[str]) -> str:
+    """Forma comparable de un nombre: sin tildes, mayúsculas, puntuación ni espacios sobrantes"""
+    decomposed = unicodedata.normalize("NFKD", (text or "").lower())
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return _NON_ALNUM_RE.sub(" ", stripped).strip()
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    """True si a y b difieren en a lo sumo una inserción, borrado, sustitución o trasposición"""
+    la, lb = len(a), len(b)
+    if abs(la - lb) > 1:
+        return False
+    if la == lb:
+        diff = [i for i in range(la) if a[i] != b[i]]
+        if len(diff) <= 1:
+            return True
+        i, j = diff[0], diff[-1]
+        return len(diff) == 2 and j == i + 1 and a[i] == b[j] and a[j] == b[i]
+    if la > lb:
+        a, b = b, a
+    # b es un carácter más largo: saltar el primer carácter distinto debe igualarlas
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i:] == b[i + 1:]
+
+
+class Place:
+    """Ciudad o cantón del nomenclátor"""
+
+    __slots__ = ("name", "province", "common", "order")
+
+    def __init__(self, name: str, province: str, common: bool = False, order: int = 0):
+        self.name = name
+        self.province = province
+        self.common = common
+        self.order = order
+
+    def __repr__(self) -> str:
+        return f"Place({self.name!r}, {self.province!r})"
+
+
+class Gazetteer:
+    """Nomenclátor compilado: índice hash de nombres y alias normalizados, más un índice de borrados
+    (estilo SymSpell) para errores de tipeo de una letra.
+
+    find() recorre el texto por n-gramas de palabras, del más largo al más corto, así que
+    "Guayaquil, Samborondón" resuelve a la primera ciudad mencionada y "Nueva Loja" no se
+    confunde con Loja. Cada consulta son unas pocas búsquedas en dicts.
+    """
+
+    _default: Optional["Gazetteer"] = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, places: List[Tuple[Place, List[str]]]):
+        self.places: List[Place] = [place for place, _ in places]
+        self._exact: Dict[str, Place] = {}
+        for place, aliases in places:
+            for alias in (place.name, *aliases):
+                # Ante alias repetidos gana el lugar listado primero
+                self._exact.setdefault(fold(alias), place)
+        self._exact.pop("", None)
+        # Primera palabra -> cantidades de palabras de las claves que empiezan con ella, de mayor a menor
+        lengths: Dict[str, set] = {}
+        for key in self._exact:
+            words = key.split()
+            lengths.setdefault(words[0], set()).add(len(words))
+        self._lengths = {word: sorted(ns, reverse=True) for word, ns in lengths.items()}
+
+        # Cada clave y sus variantes con una letra borrada -> claves originales
+        self._deletes: Dict[str, List[str]] = {}
+        for key in self._exact:
+            if len(key.replace(" ", "")) < FUZZY_MIN_LENGTH - 1:
+                continue
+            for variant in {key, *(key[:i] + key[i + 1:] for i in range(len(key)))}:
+                self._deletes.setdefault(variant, []).append(key)
+        # LRU: las grafías frecuentes nuevas desplazan a las viejas en lugar de quedar sin memoizar
+        self._resolve_cached = lru_cache(maxsize=_RESOLVE_CACHE_SIZE)(self._resolve)
+
+    @classmethod
+    def from_config(cls, data: Dict) -> "Gazetteer":
+        try:
+            places = [
+                (Place(str(item["name"]), str(item.get("province", "")), bool(item.get("common", False)), order),
+                 [str(a) for a in item.get("aliases") or ()])
+                for order, item in enumerate(data["places"])
+            ]
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Nomenclátor inválido: {e!r}") from e
+        if not places:
+            raise ValueError("Nomenclátor inválido: sin lugares")
+        return cls(places)
+
+    @classmethod
+    def default(cls) -> "Gazetteer":
+        """Nomenclátor del proceso (GAZETTEER_PATH o app/data/ecuador_cities.yaml), cargado una vez"""
+        gazetteer = cls._default
+        if gazetteer is None:
+            with cls._default_lock:
+                if cls._default is None:
+                    from app.core.config import get_settings
+
+                    cls._default = load_gazetteer(get_settings().GAZETTEER_PATH or DEFAULT_GAZETTEER_PATH)
+                gazetteer = cls._default
+        return gazetteer
+
+    def lookup(self, name: Optional[str]) -> Optional[Place]:
+        """Coincidencia exacta del texto completo (tras normalizar)"""
+        return self._exact.get(fold(name))
+
+    def _fuzzy(self, phrase: str) -> Optional[Place]:
+        best: Optional[Place] = None
+        for variant in {phrase, *(phrase[:i] + phrase[i + 1:] for i in range(len(phrase)))}:
+            for key in self._deletes.get(variant, ()):
+                if _within_one_edit(phrase, key):
+                    place = self._exact[key]
+                    if best is None or place.order < best.order:
+                        best = place
+        return best
+
+    def find(self, text: Optional[str], fuzzy: bool = False, strict: bool = False) -> Optional[Place]:
+        """Primer lugar mencionado en el texto.
+
+        strict ignora los nombres que también son palabras corrientes salvo que sean todo el texto;
+        fuzzy admite una letra de diferencia cuando todo el texto, quitando el relleno inicial, es
+        el nombre (al menos FUZZY_MIN_LENGTH letras).
+        """
+        words = fold(text).split()
+        if not words:
+            return None
+        place = self._exact.get(" ".join(words))
+        if place is not None:
+            return place
+
+        for i, word in enumerate(words):
+            for n in self._lengths.get(word, ()):
+                if i + n <= len(words):
+                    place = self._exact.get(" ".join(words[i:i + n]))
+                    if place is not None and not (strict and place.common):
+                        return place
+        if fuzzy:
+            # Solo el texto entero (sin las palabras de relleno iniciales): una palabra suelta de un
+            # nombre más largo ("Santa Cruz") no debe parecerse a otra ciudad ("Manta")
+            start = 0
+            while start < len(words) - 1 and words[start] in _LEADING_FILLERS:
+                start += 1
+            rest = words[start:]
+            phrase = " ".join(rest)
+            if len(rest) <= FUZZY_MAX_WORDS and len(phrase) - (len(rest) - 1) >= FUZZY_MIN_LENGTH:
+                place = self._fuzzy(phrase)
+                if place is not None and not (strict and place.common):
+                    return place
+        return None
+
+    def resolve(self, city: Optional[str]) -> Optional[Place]:
+        """Lugar de un campo de ciudad (del usuario o de Gemini), con tolerancia a typos; memoizado"""
+        key = city or ""
+        place = self._resolve_cached(key)
+        CITY_LOOKUPS.inc("resolved" if place is not None else ("empty" if not key.strip() else "unresolved"))
+        return place
+
+    def _resolve(self, key: str) -> Optional[Place]:
+        return self.find(key, fuzzy=True)
+
+    def canonical(self, city: Optional[str]) -> Optional[str]:
+        """Nombre canónico de la ciudad, o el texto tal cual si no está en el nomenclátor"""
+        place = self.resolve(city)
+        return place.name if place is not None else city
+
+
+def load_gazetteer(path: str) -> Gazetteer:
+    """Lee y compila un nomenclátor YAML"""
+    with open(path, "rb") as f:
+        data = yaml.safe_load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f"Nomenclátor inválido: {path}")
+    return Gazetteer.from_config(data)
@@ -1,16 +1,122 @@
+import asyncio
+import datetime
 import json
+import logging
 import os
-from typing import Dict, Any
+import re
+import time
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
 import google.generativeai as genai
+from google.generativeai import caching
+from google.api_core import exceptions as google_exceptions
 from dotenv import load_dotenv
 
 from app.core.config import get_settings
+from app.services.extraction_cache import ExtractionCache, SQLiteCacheBackend
+from app.services.gazetteer import Gazetteer
+from app.services.local_extractor import LocalSlotExtractor
+from app.services.single_flight import SingleFlight
+from app.services.resilience import CircuitBreaker, LatencyTracker, backoff_delay, hedged_call
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+
+SLOT_SCHEMA = {
+    "vehicle_year": "int|null",
+    "vehicle_make": "string|null",
+    "vehicle_model": "string|null",
+    "vehicle_value_usd": "float|null",
+    "usage": '"particular"|"comercial"|null',
+    "city": "string|null",
+    "driver_age": "int|null",
+    "claims_last3y": "int|null",
+    "anti_theft": "true|false|null",
+    "garage_overnight": "true|false|null",
+    "deductible_pct": "5|10|15|20|null",
+    "addons": '["asistencia_vial"|"auto_reemplazo"|"cobertura_lunas"]|null',
+}
+
+_VALUE_RULE = '- "vehicle_value_usd" en dólares; si no es claro, null.\n'
+_ADDONS_RULE = "- Mapea sinónimos: asistencia_vial~grúa~auxilio; auto_reemplazo~vehículo sustituto; cobertura_lunas~parabrisas~vidrios.\n"
+_STRICT_RULE = "- NO expliques, NO comentes, NO inventes. SOLO JSON.\n"
+
+# Prefijo estático del prompt: se arma una sola vez al importar el módulo
+SYSTEM_PROMPT = (
+    "\nEres un extractor ESTRICTO de datos para pre-cotización vehicular.\n"
+    "Devuelve SIEMPRE JSON con el SIGUIENTE ESQUEMA EXACTO (sin texto adicional):\n\n"
+    "{\n" + ",\n".join(f'  "{f}": {t}' for f, t in SLOT_SCHEMA.items()) + "\n}\n\n"
+    "- Usa null si no estás seguro.\n" + _VALUE_RULE + _ADDONS_RULE + _STRICT_RULE
+)
+
+EXAMPLES = [
+    ("Kia Rio 2018, uso particular, Guayaquil, vale 12 mil dólares. Conductor 28 años, sin siniestros. Deducible 10%, quiero asistencia vial.",
+     {
+        "vehicle_year": 2018, "vehicle_make": "Kia", "vehicle_model": "Rio",
+        "vehicle_value_usd": 12000.0, "usage": "particular", "city": "Guayaquil",
+        "driver_age": 28, "claims_last3y": 0, "anti_theft": None, "garage_overnight": None,
+        "deductible_pct": 10, "addons": ["asistencia_vial"]
+     }),
+    ("Trabajo con una Hilux 2021 en Quito. Vale 28k, tiene alarma y duerme en garaje. Tengo 45 y un choque hace dos años.",
+     {
+        "vehicle_year": 2021, "vehicle_make": "Toyota", "vehicle_model": "Hilux",
+        "vehicle_value_usd": 28000.0, "usage": "comercial", "city": "Quito",
+        "driver_age": 45, "claims_last3y": 1, "anti_theft": True, "garage_overnight": True,
+        "deductible_pct": None, "addons": None
+     })
+]
+
+
+_COMPLETE_PAIR_RE = re.compile(
+    r'"(\w+)"\s*:\s*(null|true|false|-?\d+(?:\.\d+)?|"(?:[^"\\]|\\.)*"|\[[^\]]*\])\s*(?=[,}])'
+)
+
+
+def parse_partial_json(text: str) -> Dict[str, Any]:
+    """Pares clave/valor ya completos dentro de un JSON que todavía se está recibiendo"""
+    out = {}
+    for key, raw in _COMPLETE_PAIR_RE.findall(text):
+        if key in SLOT_SCHEMA:
+            try:
+                out[key] = json.loads(raw)
+            except ValueError:
+                continue
+    return out
+
+
+def user_part(user_text: str) -> str:
+    return f"Usuario:\n{user_text}\n\nJSON:"
+
+
+FEW_SHOT_PARTS = [
+    f"{user_part(text)}\n{json.dumps(example, ensure_ascii=False)}" for text, example in EXAMPLES
+]
+
+_FIELD_RULES = {
+    "vehicle_value_usd": _VALUE_RULE,
+    "addons": _ADDONS_RULE + '- "ninguno" o "nada" equivale a [].\n',
+    "claims_last3y": '- "ninguno" o "sin siniestros" equivale a 0.\n',
+    "usage": "- Taxi, trabajo o negocio es comercial; personal o familiar es particular.\n",
+}
+
+
+def _field_prompt(field: str) -> str:
+    """Prompt compacto cuando la sesión solo espera un campo"""
+    return (
+        "Extrae UN dato para pre-cotización vehicular.\n"
+        f'Devuelve SIEMPRE JSON {{"{field}": {SLOT_SCHEMA[field]}}} (sin texto adicional).\n'
+        "- Usa null si no estás seguro.\n" + _FIELD_RULES.get(field, "") + _STRICT_RULE
+    )
+
+
+FIELD_PROMPTS = {field: _field_prompt(field) for field in SLOT_SCHEMA}
+
 
 class GeminiService:
-    def __init__(self):
+    """Cliente de Gemini compartido por todo el proceso (se crea una vez en el lifespan de la app)"""
+
+    def __init__(self, cache: Optional[ExtractionCache] = None):
         settings = get_settings()
         self.api_key = settings.GEMINI_API_KEY
         self.model_name = settings.GEMINI_MODEL
@@ -19,67 +125,320 @@ class GeminiService:
             raise ValueError("GEMINI_API_KEY no está configurada en las variables de entorno")
         
         genai.configure(api_key=self.api_key)
+        generation_config = genai.GenerationConfig(
+            temperature=0,
+            response_mime_type="application/json"
+        )
         self.model = genai.GenerativeModel(
             self.model_name,
-            generation_config=genai.GenerationConfig(
-                temperature=0,
-                response_mime_type="application/json"
+            generation_config=generation_config,
+            system_instruction=SYSTEM_PROMPT
+        )
+        # Los ejemplos few-shot van en cada llamada salvo que el prefijo quede en la caché de contexto
+        self._full_model = self.model
+        self._prefix_parts = list(FEW_SHOT_PARTS)
+        self._generation_config = generation_config
+        self.context_cache_ttl_seconds = settings.GEMINI_CONTEXT_CACHE_TTL_SECONDS
+        self._context_cache = None
+        if settings.GEMINI_CONTEXT_CACHE:
+            self._use_context_cache()
+
+        self.field_models = {
+            field: genai.GenerativeModel(
+                self.model_name,
+                generation_config=generation_config,
+                system_instruction=prompt
+            )
+            for field, prompt in FIELD_PROMPTS.items()
+        }
+
+        if cache is None:
+            backend = None
+            if settings.EXTRACTION_CACHE_SHARED_PATH:
+                backend = SQLiteCacheBackend(settings.EXTRACTION_CACHE_SHARED_PATH)
+            cache = ExtractionCache(
+                maxsize=settings.EXTRACTION_CACHE_SIZE,
+                ttl_seconds=settings.EXTRACTION_CACHE_TTL_SECONDS,
+                backend=backend,
+                namespace=self.model_name,
             )
+        self.cache = cache
+        self.single_flight = SingleFlight()
+        self.local_hits = 0
+
+        self.timeout_seconds = settings.GEMINI_TIMEOUT_SECONDS
+        self.deadline_seconds = settings.GEMINI_DEADLINE_SECONDS
+        self.max_retries = settings.GEMINI_MAX_RETRIES
+        self.retry_backoff_seconds = settings.GEMINI_RETRY_BACKOFF_SECONDS
+        self.hedge_enabled = settings.GEMINI_HEDGE_ENABLED
+        self.hedge_percentile = settings.GEMINI_HEDGE_PERCENTILE
+        self.hedge_min_samples = settings.GEMINI_HEDGE_MIN_SAMPLES
+        self.breaker = CircuitBreaker(
+            failure_rate=settings.GEMINI_BREAKER_FAILURE_RATE,
+            window_size=settings.GEMINI_BREAKER_WINDOW,
+            min_calls=settings.GEMINI_BREAKER_MIN_CALLS,
+            open_seconds=settings.GEMINI_BREAKER_OPEN_SECONDS,
         )
+        self.latency = LatencyTracker()
+        self.timeouts = 0
+        self.errors = 0
+        self.retries = 0
+        self.hedges = 0
+        self.degraded = 0
 
-    def extract_slots(self, user_text: str) -> Dict[str, Any]:
-        """Extrae información del texto del usuario usando Gemini"""
-        system_prompt = """
-Eres un extractor ESTRICTO de datos para pre-cotización vehicular.
-Devuelve SIEMPRE JSON con el SIGUIENTE ESQUEMA EXACTO (sin texto adicional):
-
-{
-  "vehicle_year": int|null,
-  "vehicle_make": string|null,
-  "vehicle_model": string|null,
-  "vehicle_value_usd": float|null,
-  "usage": "particular"|"comercial"|null,
-  "city": string|null,
-  "driver_age": int|null,
-  "claims_last3y": int|null,
-  "anti_theft": true|false|null,
-  "garage_overnight": true|false|null,
-  "deductible_pct": 5|10|15|20|null,
-  "addons": ["asistencia_vial"|"auto_reemplazo"|"cobertura_lunas"]|null
-}
+    def _use_context_cache(self) -> bool:
+        """Sube el prefijo estático a la caché de contexto de Gemini, si el modelo lo soporta"""
+        try:
+            cached = caching.CachedContent.create(
+                model=self.model_name,
+                display_name="extract-slots-prefix",
+                system_instruction=SYSTEM_PROMPT,
+                contents=FEW_SHOT_PARTS,
+                ttl=datetime.timedelta(seconds=self.context_cache_ttl_seconds),
+            )
+            self.model = genai.GenerativeModel.from_cached_content(
+                cached, generation_config=self._generation_config
+            )
+        except Exception as e:
+            # Modelos sin soporte o prefijos por debajo del mínimo de tokens: se envía el prefijo completo
+            logger.info("Caché de contexto de Gemini no disponible: %s", e)
+            self._drop_context_cache()
+            return False
+        self._context_cache = cached
+        self._prefix_parts = []
+        return True
 
-- Usa null si no estás seguro.
-- "vehicle_value_usd" en dólares; si no es claro, null.
-- Mapea sinónimos: asistencia_vial~grúa~auxilio; auto_reemplazo~vehículo sustituto; cobertura_lunas~parabrisas~vidrios.
-- NO expliques, NO comentes, NO inventes. SOLO JSON.
-"""
-
-        examples = [
-            ("Kia Rio 2018, uso particular, Guayaquil, vale 12 mil dólares. Conductor 28 años, sin siniestros. Deducible 10%, quiero asistencia vial.",
-             {
-                "vehicle_year": 2018, "vehicle_make": "Kia", "vehicle_model": "Rio",
-                "vehicle_value_usd": 12000.0, "usage": "particular", "city": "Guayaquil",
-                "driver_age": 28, "claims_last3y": 0, "anti_theft": None, "garage_overnight": None,
-                "deductible_pct": 10, "addons": ["asistencia_vial"]
-             }),
-            ("Trabajo con una Hilux 2021 en Quito. Vale 28k, tiene alarma y duerme en garaje. Tengo 45 y un choque hace dos años.",
-             {
-                "vehicle_year": 2021, "vehicle_make": "Toyota", "vehicle_model": "Hilux",
-                "vehicle_value_usd": 28000.0, "usage": "comercial", "city": "Quito",
-                "driver_age": 45, "claims_last3y": 1, "anti_theft": True, "garage_overnight": True,
-                "deductible_pct": None, "addons": None
-             })
-        ]
-
-        parts = [system_prompt]
-        # few-shot examples
-        for user_text_example, json_example in examples:
-            parts.append(f"Usuario:\n{user_text_example}\n\nJSON:\n{json.dumps(json_example, ensure_ascii=False)}")
-        parts.append(f"Usuario:\n{user_text}\n\nJSON:")
-        
+    def _drop_context_cache(self) -> None:
+        """Vuelve al modelo sin caché de contexto, con el prefijo completo en cada llamada"""
+        self._context_cache = None
+        self.model = self._full_model
+        self._prefix_parts = list(FEW_SHOT_PARTS)
+
+    def refresh_context_cache(self) -> None:
+        """Extiende el TTL de la caché de contexto antes de que expire; si ya no existe la vuelve a
+        crear, y si tampoco se puede sigue con el prefijo completo (la llama el lifespan)"""
+        cached = self._context_cache
+        if cached is None:
+            self._use_context_cache()
+            return
         try:
-            resp = self.model.generate_content(parts)
-            text = (resp.text or "").strip()
-            return json.loads(text)
+            cached.update(ttl=datetime.timedelta(seconds=self.context_cache_ttl_seconds))
+        except Exception as e:
+            logger.warning("No se pudo extender la caché de contexto de Gemini: %s", e)
+            self._use_context_cache()
+
+    @staticmethod
+    def _scope(user_text: str, expected_field: Optional[str]) -> Optional[str]:
+        # Si se espera un solo campo y la respuesta es corta, basta el prompt compacto de ese campo
+        return expected_field if expected_field and not LocalSlotExtractor.is_free_form(user_text) else None
+
+    @staticmethod
+    def _merge_local(
+        local: Dict[str, Any], extracted: Dict[str, Any], expected_field: Optional[str] = None
+    ) -> Dict[str, Any]:
+        # Un null de Gemini solo se completa con las reglas locales en el campo preguntado; los campos
+        # que Gemini no devolvió (prompt de un campo, o sin respuesta) quedan con lo local
+        merged = {
+            k: extracted[k] if extracted.get(k) is not None
+            else (v if k == expected_field or k not in extracted else None)
+            for k, v in local.items()
+        }
+        if isinstance(merged.get("city"), str):
+            # La ciudad de Gemini queda con el nombre canónico del nomenclátor ("GYE" -> "Guayaquil")
+            merged["city"] = Gazetteer.default().canonical(merged["city"])
+        return merged
+
+    async def extract_slots(self, user_text: str, expected_field: Optional[str] = None) -> Dict[str, Any]:
+        """Extrae información del texto del usuario; primero por reglas locales y, si no alcanza, con Gemini"""
+        local = LocalSlotExtractor.extract(user_text, expected_field)
+        if LocalSlotExtractor.resolves(local, user_text, expected_field):
+            self.local_hits += 1
+            return local
+
+        extracted = await self._extract_remote(user_text, self._scope(user_text, expected_field))
+        return self._merge_local(local, extracted, expected_field)
+
+    async def stream_extract_slots(
+        self, user_text: str, expected_field: Optional[str] = None
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Como extract_slots, pero emite ("partial", campos nuevos) a medida que se conocen
+        y termina con ("final", resultado completo)"""
+        local = LocalSlotExtractor.extract(user_text, expected_field)
+        found = {k: v for k, v in local.items() if v is not None}
+        if found:
+            yield "partial", dict(found)
+        if LocalSlotExtractor.resolves(local, user_text, expected_field):
+            self.local_hits += 1
+            yield "final", local
+            return
+
+        field = self._scope(user_text, expected_field)
+        cache_key = self.cache.key(user_text, scope=field or "")
+        extracted = await self.cache.get(cache_key)
+        if extracted is None:
+            extracted = {}
+            async for kind, data in self._stream_remote(user_text, field, cache_key):
+                if kind == "final":
+                    extracted = data
+                    break
+                new = {k: v for k, v in data.items() if v is not None and found.get(k) != v}
+                if new:
+                    found.update(new)
+                    yield "partial", new
+        yield "final", self._merge_local(local, extracted, expected_field)
+
+    async def _stream_remote(
+        self, user_text: str, field: Optional[str], cache_key: str
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Streaming de Gemini con deadline; si falla, cae a la ruta sin streaming (con reintentos)"""
+        if self.breaker.allow():
+            model, parts = self._request(user_text, field)
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + min(self.timeout_seconds, self.deadline_seconds)
+            started = time.perf_counter()
+            text = ""
+            try:
+                resp = await asyncio.wait_for(
+                    model.generate_content_async(parts, stream=True), max(0.0, deadline - loop.time())
+                )
+                chunks = resp.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), max(0.0, deadline - loop.time()))
+                    except StopAsyncIteration:
+                        break
+                    text += chunk.text or ""
+                    partial = parse_partial_json(text)
+                    if field is not None:
+                        partial = {field: partial[field]} if field in partial else {}
+                    if partial:
+                        yield "partial", partial
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                self.breaker.record_failure()
+            except Exception:
+                self.errors += 1
+                self.breaker.record_failure()
+            else:
+                self.latency.record(time.perf_counter() - started)
+                self.breaker.record_success()
+                yield "final", await self._parse_and_cache(text, field, cache_key)
+                return
+
+        yield "final", await self._extract_remote(user_text, field)
+
+    async def _extract_remote(self, user_text: str, field: Optional[str] = None) -> Dict[str, Any]:
+        """Extracción con Gemini (esquema completo o de un solo campo), detrás de la caché"""
+        cache_key = self.cache.key(user_text, scope=field or "")
+        cached = await self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        # Llamadas concurrentes con el mismo prompt canónico comparten una sola petición a Gemini
+        extracted = await self.single_flight.do(cache_key, lambda: self._generate(user_text, field, cache_key))
+        return dict(extracted)
+
+    def _request(self, user_text: str, field: Optional[str]):
+        """Modelo y partes del prompt: esquema completo con few-shot, o prompt compacto de un campo"""
+        if field is None:
+            return self.model, self._prefix_parts + [user_part(user_text)]
+        return self.field_models[field], [user_part(user_text)]
+
+    async def _generate(self, user_text: str, field: Optional[str], cache_key: str) -> Dict[str, Any]:
+        model, parts = self._request(user_text, field)
+        resp = await self._call_upstream(model, parts)
+        if resp is None:
+            # Sin respuesta de Gemini: extract_slots cae a lo que encontró el extractor local
+            self.degraded += 1
+            return {}
+        try:
+            text = resp.text or ""
+        except Exception:
+            return {}
+        return await self._parse_and_cache(text, field, cache_key)
+
+    async def _parse_and_cache(self, text: str, field: Optional[str], cache_key: str) -> Dict[str, Any]:
+        try:
+            extracted = json.loads(text.strip())
         except Exception:
             return {}
+        if not isinstance(extracted, dict):
+            return {}
+        if field is not None:
+            extracted = {field: extracted.get(field)}
+
+        # Solo se cachean respuestas válidas; los errores se reintentan en el siguiente turno
+        await self.cache.set(cache_key, extracted)
+        return extracted
+
+    async def _call_upstream(self, model, parts):
+        """Llamada a Gemini con deadline, reintentos con backoff, hedging y circuit breaker.
+
+        Devuelve None si el circuito está abierto o se agotaron los intentos.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline_seconds
+        attempt = 0
+        while attempt <= self.max_retries:
+            remaining = deadline - loop.time()
+            if remaining <= 0 or not self.breaker.allow():
+                return None
+            started = time.perf_counter()
+            try:
+                resp, hedged = await hedged_call(
+                    lambda: model.generate_content_async(parts),
+                    timeout=min(self.timeout_seconds, remaining),
+                    hedge_delay=self._hedge_delay(),
+                )
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                self.breaker.record_failure()
+            except (google_exceptions.NotFound, google_exceptions.PermissionDenied) as e:
+                if self._context_cache is None or model is not self.model:
+                    self.errors += 1
+                    self.breaker.record_failure()
+                else:
+                    # La caché de contexto expiró o se borró: se repite el intento con el prefijo completo
+                    logger.warning("Caché de contexto de Gemini no disponible: %s", e)
+                    self._drop_context_cache()
+                    model, parts = self.model, self._prefix_parts + parts
+                    continue
+            except Exception:
+                self.errors += 1
+                self.breaker.record_failure()
+            else:
+                self.hedges += int(hedged)
+                self.latency.record(time.perf_counter() - started)
+                self.breaker.record_success()
+                return resp
+
+            if attempt < self.max_retries:
+                self.retries += 1
+                await asyncio.sleep(min(
+                    backoff_delay(attempt, self.retry_backoff_seconds),
+                    max(0.0, deadline - loop.time())
+                ))
+            attempt += 1
+        return None
+
+    def _hedge_delay(self):
+        if not self.hedge_enabled or len(self.latency) < self.hedge_min_samples:
+            return None
+        return self.latency.percentile(self.hedge_percentile)
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de la ruta de extracción"""
+        return {
+            "local_hits": self.local_hits,
+            "cache": self.cache.stats(),
+            "single_flight": self.single_flight.stats(),
+            "upstream": {
+                "breaker": self.breaker.stats(),
+                "timeouts": self.timeouts,
+                "errors": self.errors,
+                "retries": self.retries,
+                "hedges": self.hedges,
+                "degraded": self.degraded,
+                "p95_seconds": self.latency.percentile(0.95),
+            },
+        }
@@ -0,0 +1,201 @@
+import re
+from typing import Any, Dict, List, Optional
+
+from app.services.extraction_cache import normalize_text
+from app.services.gazetteer import Gazetteer
+
+
+SLOT_FIELDS = [
+    "vehicle_year", "vehicle_make", "vehicle_model", "vehicle_value_usd", "usage", "city",
+    "driver_age", "claims_last3y", "anti_theft", "garage_overnight", "deductible_pct", "addons",
+]
+
+# Respuestas con más palabras que esto se consideran texto libre y van a Gemini
+MAX_SHORT_ANSWER_WORDS = 6
+
+_YES = {"si", "sip", "claro", "correcto", "afirmativo", "obvio", "por supuesto", "tiene", "tengo"}
+_NO = {"no", "nop", "nel", "negativo", "tampoco", "no tiene", "no tengo"}
+_NONE = {"ninguno", "ninguna", "ningun", "nada", "no", "cero", "0", "no gracias", "ninguno gracias"}
+
+_USAGE_SYNONYMS = {
+    "particular": "particular", "personal": "particular", "privado": "particular",
+    "familiar": "particular", "comercial": "comercial", "trabajo": "comercial",
+    "taxi": "comercial", "uber": "comercial", "negocio": "comercial", "carga": "comercial",
+}
+
+_ADDON_SYNONYMS = [
+    ("asistencia_vial", ("asistencia vial", "asistencia", "grua", "auxilio")),
+    ("auto_reemplazo", ("auto de reemplazo", "auto sustituto", "vehiculo sustituto",
+                        "carro de reemplazo", "reemplazo", "sustituto")),
+    ("cobertura_lunas", ("cobertura de lunas", "lunas", "parabrisas", "vidrios")),
+]
+
+_MAKES = {
+    "chevrolet": "Chevrolet", "kia": "Kia", "toyota": "Toyota", "hyundai": "Hyundai",
+    "nissan": "Nissan", "mazda": "Mazda", "ford": "Ford", "renault": "Renault",
+    "suzuki": "Suzuki", "volkswagen": "Volkswagen", "vw": "Volkswagen", "great wall": "Great Wall",
+    "chery": "Chery", "jac": "JAC", "mitsubishi": "Mitsubishi", "honda": "Honda",
+    "peugeot": "Peugeot", "jeep": "Jeep", "dfsk": "DFSK", "byd": "BYD", "changan": "Changan",
+}
+
+# Modelos frecuentes con su marca, para inferir la marca cuando solo se dice el modelo
+_MODEL_MAKES = {
+    "sail": ("Sail", "Chevrolet"), "aveo": ("Aveo", "Chevrolet"), "spark": ("Spark", "Chevrolet"),
+    "dmax": ("D-Max", "Chevrolet"), "d max": ("D-Max", "Chevrolet"), "onix": ("Onix", "Chevrolet"),
+    "rio": ("Rio", "Kia"), "picanto": ("Picanto", "Kia"), "sportage": ("Sportage", "Kia"),
+    "soluto": ("Soluto", "Kia"), "hilux": ("Hilux", "Toyota"), "yaris": ("Yaris", "Toyota"),
+    "corolla": ("Corolla", "Toyota"), "fortuner": ("Fortuner", "Toyota"),
+    "accent": ("Accent", "Hyundai"), "tucson": ("Tucson", "Hyundai"),
+    "sentra": ("Sentra", "Nissan"), "frontier": ("Frontier", "Nissan"),
+    "cx5": ("CX-5", "Mazda"), "cx 5": ("CX-5", "Mazda"), "vitara": ("Vitara", "Suzuki"),
+}
+
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_YEAR_RE = re.compile(r"\b(19[89]\d|20[0-3]\d)\b(?!\s*(?:dolares|usd|\$))")
+_VALUE_RE = re.compile(r"\b(\d+(?:\.\d+)?)\s*(?:dolares|usd|\$)")
+_AGE_RE = re.compile(r"\b(\d{2})\s*anos\b")
+_CLAIMS_RE = re.compile(r"\b(\d+)\s*(?:siniestros?|choques?|accidentes?|reclamos?)\b")
+_NO_CLAIMS_RE = re.compile(r"\b(?:sin|ningun|ninguno|cero)\s+(?:siniestros?|choques?|accidentes?|reclamos?)\b")
+_PERCENT_RE = re.compile(r"\b(5|10|15|20)%")
+# Negación pegada a la palabra clave ("sin alarma", "no tengo garaje"), con a lo sumo tres palabras de relleno
+_NEGATION_FILLERS = r"(?:(?:tengo|tiene|tenemos|cuenta|cuento|hay|duerme|duermo|guardo|guarda|lo|la|se|en|el|1|ni)\s+){0,3}"
+_NO_ALARM_RE = re.compile(rf"\b(?:no|sin|ni)\s+{_NEGATION_FILLERS}(?:alarma|antirrobo)\b")
+_NO_GARAGE_RE = re.compile(rf"\b(?:no|sin|ni)\s+{_NEGATION_FILLERS}(?:garaje|garage)\b")
+_BARE_NUMBER_RE = re.compile(r"\d+")
+# Respuestas dudosas ("no sé", "creo que sí"): no son un sí ni un no, las resuelve Gemini
+_HEDGE_RE = re.compile(r"\b(?:no se|no estoy segur[oa]|ni idea|creo que|creo|tal vez|quizas|capaz)\b")
+
+
+def _contains(text: str, phrase: str) -> bool:
+    return re.search(rf"\b{re.escape(phrase)}\b", text) is not None
+
+
+class LocalSlotExtractor:
+    """Extractor determinístico por reglas para respuestas cortas (no usa red)"""
+
+    @staticmethod
+    def empty() -> Dict[str, Any]:
+        return {field: None for field in SLOT_FIELDS}
+
+    @staticmethod
+    def is_free_form(user_text: str) -> bool:
+        """True si el texto es lo bastante largo como para requerir el LLM"""
+        return len(normalize_text(user_text).split()) > MAX_SHORT_ANSWER_WORDS
+
+    @staticmethod
+    def _yes_no(text: str) -> Optional[bool]:
+        if _HEDGE_RE.search(text):
+            return None
+        if text in _YES or text.startswith("si "):
+            return True
+        if text in _NO or text.startswith("no "):
+            return False
+        return None
+
+    @staticmethod
+    def _numbers(text: str) -> List[float]:
+        return [float(n) for n in _NUMBER_RE.findall(text)]
+
+    @staticmethod
+    def _addons(text: str, expected: bool) -> Optional[List[str]]:
+        found = []
+        for addon, synonyms in _ADDON_SYNONYMS:
+            if any(_contains(text, s) for s in synonyms):
+                found.append(addon)
+        if found:
+            return found
+        if expected and text in _NONE:
+            return []
+        return None
+
+    @staticmethod
+    def extract(user_text: str, expected_field: Optional[str] = None) -> Dict[str, Any]:
+        """Extrae campos con el mismo esquema que GeminiService.extract_slots"""
+        text = normalize_text(user_text)
+        out = LocalSlotExtractor.empty()
+        numbers = LocalSlotExtractor._numbers(text)
+        bare_number = numbers[0] if len(numbers) == 1 else None
+
+        # Valor del vehículo: cifra con moneda, o cifra sola si es lo que se preguntó
+        m = _VALUE_RE.search(text)
+        if m:
+            out["vehicle_value_usd"] = float(m.group(1))
+        elif expected_field == "vehicle_value_usd" and bare_number is not None and bare_number >= 100:
+            out["vehicle_value_usd"] = bare_number
+
+        m = _AGE_RE.search(text)
+        if m and 16 <= int(m.group(1)) <= 90:
+            out["driver_age"] = int(m.group(1))
+        elif expected_field == "driver_age" and bare_number is not None and 16 <= bare_number <= 90:
+            out["driver_age"] = int(bare_number)
+
+        m = _CLAIMS_RE.search(text)
+        if m and int(m.group(1)) <= 10:
+            out["claims_last3y"] = int(m.group(1))
+        elif _NO_CLAIMS_RE.search(text):
+            out["claims_last3y"] = 0
+        elif expected_field == "claims_last3y":
+            if text in _NONE:
+                out["claims_last3y"] = 0
+            elif _BARE_NUMBER_RE.fullmatch(text) and int(text) <= 10:
+                # Solo la cifra como respuesta completa: "tengo un toyota" no es un siniestro
+                out["claims_last3y"] = int(text)
+
+        m = _PERCENT_RE.search(text)
+        if m:
+            out["deductible_pct"] = int(m.group(1))
+        elif expected_field == "deductible_pct" and bare_number in (5, 10, 15, 20):
+            out["deductible_pct"] = int(bare_number)
+
+        usages = {u for word, u in _USAGE_SYNONYMS.items() if _contains(text, word)}
+        if len(usages) == 1:
+            out["usage"] = usages.pop()
+
+        # Con la ciudad como pregunta se aceptan typos y nombres que también son palabras corrientes
+        place = Gazetteer.default().find(
+            text, fuzzy=expected_field == "city", strict=expected_field != "city"
+        )
+        if place is not None:
+            out["city"] = place.name
+
+        for key, make in _MAKES.items():
+            if _contains(text, key):
+                out["vehicle_make"] = make
+                break
+        for key, (model, make) in _MODEL_MAKES.items():
+            if _contains(text, key):
+                out["vehicle_model"] = model
+                out["vehicle_make"] = out["vehicle_make"] or make
+                break
+
+        # Un año suelto solo es del vehículo si se preguntó el año o la respuesta nombra marca o modelo
+        # ("un choque en 2021" o "nací en 1990" no son el año del auto)
+        m = _YEAR_RE.search(text)
+        if m and (expected_field == "vehicle_year" or (
+                expected_field != "vehicle_value_usd" and (out["vehicle_make"] or out["vehicle_model"]))):
+            out["vehicle_year"] = int(m.group(1))
+
+        if expected_field in ("anti_theft", "garage_overnight"):
+            out[expected_field] = LocalSlotExtractor._yes_no(text)
+        if not _HEDGE_RE.search(text):
+            if _contains(text, "alarma") or _contains(text, "antirrobo"):
+                out["anti_theft"] = _NO_ALARM_RE.search(text) is None
+            if _contains(text, "garaje") or _contains(text, "garage"):
+                out["garage_overnight"] = _NO_GARAGE_RE.search(text) is None
+
+        out["addons"] = LocalSlotExtractor._addons(text, expected_field == "addons")
+
+        # Modelo libre solo si la respuesta corta no dijo ninguna otra cosa ("uso particular" no es un modelo)
+        if (expected_field == "vehicle_model" and out["vehicle_model"] is None
+                and not numbers and 0 < len(text.split()) <= 2
+                and text not in _YES and text not in _NO and not text.startswith("no ")
+                and all(v is None for k, v in out.items() if k != "vehicle_make")):
+            out["vehicle_model"] = user_text.strip().strip(".!").title()
+        return out
+
+    @staticmethod
+    def resolves(extracted: Dict[str, Any], user_text: str, expected_field: Optional[str]) -> bool:
+        """True si el resultado local basta y se puede omitir la llamada a Gemini"""
+        if expected_field is None or extracted.get(expected_field) is None:
+            return False
+        return not LocalSlotExtractor.is_free_form(user_text)
@@ -0,0 +1,198 @@
+from itertools import combinations
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.schemas.quote import QuoteState
+from app.services.tariff import MAX_AGE, Tariff, TariffService
+from app.utils.money import round_cents
+
+
+class PricingEngine:
+    """Tarificación vectorizada de N perfiles × M aseguradoras con NumPy.
+
+    Usa las mismas tablas compiladas de la tarifa y multiplica los factores en el mismo orden
+    que QuoteService.price_formula, así que las operaciones en float64 dan los mismos bits;
+    el redondeo a centavos replica round(). Si la tarifa configura `products`, la prima de cada
+    aseguradora es la de su producto elegible más barato del catálogo (NaN si no tiene ninguno),
+    igual que generate_quote.
+    """
+
+    @staticmethod
+    def profile_arrays(states: Sequence[QuoteState], tariff: Tariff) -> Dict[str, np.ndarray]:
+        """Columnas por perfil (los perfiles deben tener los campos obligatorios)"""
+        n = len(states)
+        value = np.empty(n)
+        base_rate = np.empty(n)
+        age = np.empty(n, dtype=np.intp)
+        claims = np.empty(n, dtype=np.intp)
+        anti = np.empty(n, dtype=np.intp)
+        garage = np.empty(n, dtype=np.intp)
+        deductible = np.empty(n)
+        addons = np.empty(n)
+        location = np.empty(n)
+
+        # Combinaciones de add-ons repetidas se suman una sola vez (las ciudades ya las memoiza la tarifa)
+        addons_cache: Dict[Tuple[str, ...], float] = {}
+        for i, s in enumerate(states):
+            value[i] = s.vehicle_value_usd
+            base_rate[i] = tariff.base_rate(s.usage)
+            age[i] = s.driver_age
+            claims[i] = s.claims_last3y
+            anti[i] = bool(s.anti_theft)
+            garage[i] = bool(s.garage_overnight)
+            deductible[i] = tariff.deductible_factor(s.deductible_pct)
+            location[i] = tariff.location_factor(s.city or "")
+            key = tuple(s.addons or ())
+            if key not in addons_cache:
+                addons_cache[key] = tariff.addons_cost(list(key))
+            addons[i] = addons_cache[key]
+
+        return {
+            "value": value, "base_rate": base_rate, "age": age, "claims": claims, "anti_theft": anti,
+            "garage": garage, "deductible": deductible, "addons": addons, "location": location,
+        }
+
+    @staticmethod
+    def round_cents(x: np.ndarray) -> np.ndarray:
+        """Igual que round(x, 2) de Python elemento a elemento"""
+        return round_cents(x)
+
+    @staticmethod
+    def premiums(states: Sequence[QuoteState], biases: Sequence[float], tariff: Tariff) -> np.ndarray:
+        """Matriz (N, M) de primas anuales, idéntica a price_formula por perfil y aseguradora"""
+        cols = PricingEngine.profile_arrays(states, tariff)
+        pure = cols["value"] * cols["base_rate"]
+        age_factor = tariff.age_table[np.clip(cols["age"], 0, MAX_AGE)]
+        claims_factor = tariff.claims_table[np.clip(cols["claims"], 0, len(tariff.claims_table) - 1)]
+        security = tariff.security_table[cols["anti_theft"], cols["garage"]]
+
+        factors = cols["location"] * age_factor * claims_factor * security * cols["deductible"]
+        raw = (pure * factors)[:, None] * np.asarray(biases, dtype=float)[None, :] + cols["addons"][:, None]
+        return PricingEngine.round_cents(raw)
+
+    @staticmethod
+    def plans(states: Sequence[QuoteState], tariff: Tariff) -> List[str]:
+        """Plan por valor del vehículo (igual que Tariff.plan_for_value)"""
+        value = np.array([s.vehicle_value_usd or 0 for s in states], dtype=float)
+        names = np.array([plan for _, plan in tariff.plans], dtype=object)
+        bounds = np.array([b if b is not None else np.inf for b, _ in tariff.plans])
+        # Primer tramo con value < below; si ninguno, el último
+        index = np.searchsorted(bounds, value, side="right")
+        return list(names[np.minimum(index, len(names) - 1)])
+
+    @staticmethod
+    def price_batch(
+        states: Sequence[QuoteState], tariff: Optional[Tariff] = None
+    ) -> Tuple[List[str], np.ndarray, List[str], str]:
+        """Tarifica los perfiles contra todas las aseguradoras: (aseguradoras, primas, planes, versión)"""
+        t = tariff or TariffService.current()
+        carriers = list(t.carriers)
+        if t.has_products:
+            premiums, plans = PricingEngine.catalog_batch(states, t)
+            return carriers, premiums, plans, t.version
+        biases = [t.carriers[c][0] for c in carriers]
+        return carriers, PricingEngine.premiums(states, biases, t), PricingEngine.plans(states, t), t.version
+
+    @staticmethod
+    def carrier_minimums(carrier_of: np.ndarray, premiums: np.ndarray, n_carriers: int) -> np.ndarray:
+        """Prima más baja de cada aseguradora sobre la última dimensión de `premiums` (un producto por
+        columna, de la aseguradora `carrier_of`); NaN para las aseguradoras sin productos"""
+        out = np.full(premiums.shape[:-1] + (n_carriers,), np.nan)
+        for c in range(n_carriers):
+            mask = carrier_of == c
+            if mask.any():
+                out[..., c] = premiums[..., mask].min(axis=-1)
+        return out
+
+    @staticmethod
+    def catalog_batch(states: Sequence[QuoteState], tariff: Tariff) -> Tuple[np.ndarray, List[Optional[str]]]:
+        """Primas (N, M) del producto elegible más barato de cada aseguradora y el plan de ese producto
+        en la mejor aseguradora (None si el perfil no tiene productos elegibles)"""
+        catalog = tariff.catalog
+        n_carriers = len(tariff.carriers)
+        premiums = np.full((len(states), n_carriers), np.nan)
+        plans: List[Optional[str]] = []
+        for row, state in enumerate(states):
+            idx = catalog.eligible(state)
+            if not len(idx):
+                plans.append(None)
+                continue
+            prices = catalog.price(state, tariff, idx)
+            premiums[row] = PricingEngine.carrier_minimums(catalog.carrier_of[idx], prices, n_carriers)
+            # Plan del producto más barato de la mejor aseguradora (la que el router marca como best_carrier)
+            own = np.flatnonzero(catalog.carrier_of[idx] == int(np.nanargmin(premiums[row])))
+            best = own[np.lexsort((idx[own], prices[own]))[0]]
+            plans.append(catalog.products[idx[best]].plan)
+        return premiums, plans
+
+    @staticmethod
+    def addon_combinations(tariff: Tariff) -> List[Tuple[str, ...]]:
+        """Todas las combinaciones de add-ons de la tarifa, de menos a más, en el orden del archivo"""
+        addons = list(tariff.addon_prices)
+        return [combo for r in range(len(addons) + 1) for combo in combinations(addons, r)]
+
+    @staticmethod
+    def sensitivity_grid(
+        state: QuoteState, tariff: Optional[Tariff] = None
+    ) -> Tuple[List[str], List[int], List[Tuple[str, ...]], np.ndarray, str]:
+        """Primas para cada deducible × combinación de add-ons × aseguradora.
+
+        La parte invariante (valor × tasa × ubicación × edad × siniestros × seguridad) se calcula una
+        vez y sobre ella se difunden el deducible, el sesgo de cada aseguradora y el costo de add-ons,
+        en el mismo orden de operaciones que price_formula. Devuelve
+        (aseguradoras, deducibles, combinaciones, primas[D, A, C], versión de tarifa).
+        """
+        t = tariff or TariffService.current()
+        carriers = list(t.carriers)
+        deductibles = sorted(t.deductible_factors)
+        combos = PricingEngine.addon_combinations(t)
+        if t.has_products:
+            premiums = PricingEngine.catalog_grid(state, t, deductibles, combos)
+            return carriers, deductibles, combos, premiums, t.version
+
+        pure = float(state.vehicle_value_usd) * t.base_rate(state.usage)
+        invariant = (
+            t.location_factor(state.city or "") *
+            t.age_factor(int(state.driver_age)) *
+            t.claims_factor(int(state.claims_last3y)) *
+            t.security_factor(state.anti_theft, state.garage_overnight)
+        )
+        factors = invariant * np.array([t.deductible_factor(d) for d in deductibles])
+        biases = np.array([t.carriers[c][0] for c in carriers])
+        addon_costs = np.array([t.addons_cost(list(combo)) for combo in combos])
+
+        raw = (pure * factors)[:, None, None] * biases[None, None, :] + addon_costs[None, :, None]
+        return carriers, deductibles, combos, PricingEngine.round_cents(raw), t.version
+
+    @staticmethod
+    def catalog_grid(
+        state: QuoteState, tariff: Tariff, deductibles: List[int], combos: List[Tuple[str, ...]]
+    ) -> np.ndarray:
+        """Primas[D, A, C] del producto elegible más barato de cada aseguradora; los productos con
+        deducible o add-ons fijos no cambian con la celda (como ProductCatalog.price)"""
+        catalog = tariff.catalog
+        idx = catalog.eligible(state)
+        pure = float(state.vehicle_value_usd) * tariff.base_rate(state.usage)
+        invariant = (
+            tariff.location_factor(state.city or "") *
+            tariff.age_factor(int(state.driver_age)) *
+            tariff.claims_factor(int(state.claims_last3y)) *
+            tariff.security_factor(state.anti_theft, state.garage_overnight)
+        )
+        fixed_deductible = catalog.fixed_deductible[idx]
+        deductible = np.where(
+            np.isnan(fixed_deductible)[None, :],
+            np.array([tariff.deductible_factor(d) for d in deductibles])[:, None],
+            fixed_deductible[None, :],
+        )
+        fixed_addons = catalog.fixed_addons[idx]
+        addons = np.where(
+            np.isnan(fixed_addons)[None, :],
+            np.array([tariff.addons_cost(list(combo)) for combo in combos])[:, None],
+            fixed_addons[None, :],
+        )
+        raw = (pure * (invariant * deductible))[:, None, :] * catalog.bias[idx][None, None, :] + addons[None, :, :]
+        return PricingEngine.carrier_minimums(
+            catalog.carrier_of[idx], PricingEngine.round_cents(raw), len(tariff.carriers)
+        )
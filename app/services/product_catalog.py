@@ -0,0 +1,197 @@
+import bisect
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.schemas.quote import Offer, QuoteState
+from app.services.gazetteer import fold
+from app.utils.money import round_cents
+
+
+USAGES = ("particular", "comercial")
+# Tope de la memoización LRU de ciudad -> ciudad del catálogo (texto libre del usuario)
+_CITY_CACHE_SIZE = 4096
+
+
+def city_key(city: Optional[str]) -> str:
+    """Nombre de ciudad comparable: sin tildes, mayúsculas, puntuación ni espacios sobrantes"""
+    return fold(city)
+
+
+class Product:
+    """Producto de una aseguradora: plan con reglas de elegibilidad y, opcionalmente, deducible y add-ons fijos"""
+
+    __slots__ = ("carrier", "plan", "name", "min_value", "max_value", "usages", "cities",
+                 "deductible_pct", "addons", "factor", "notes")
+
+    def __init__(self, carrier: str, plan: str, name: str, min_value: float = 0.0,
+                 max_value: Optional[float] = None, usages: Optional[List[str]] = None,
+                 cities: Optional[List[str]] = None, deductible_pct: Optional[int] = None,
+                 addons: Optional[List[str]] = None, factor: float = 1.0, notes: str = ""):
+        self.carrier = carrier
+        self.plan = plan
+        self.name = name
+        self.min_value = min_value
+        self.max_value = max_value  # exclusivo; None = sin tope
+        self.usages = tuple(usages) if usages else USAGES
+        self.cities = tuple(city_key(c) for c in cities) if cities else None
+        # None = se usa lo que eligió el cliente
+        self.deductible_pct = deductible_pct
+        self.addons = addons
+        self.factor = factor
+        self.notes = notes
+
+
+class ProductCatalog:
+    """Catálogo de productos indexado por tramo de valor, uso y ciudad.
+
+    Los límites de valor de todos los productos parten el eje en tramos; el índice guarda, por
+    (tramo, uso), los productos sin restricción de ciudad y los de cada ciudad. Una cotización
+    solo tarifica los elegibles, con arrays precompilados, y elige los k mejores con selección
+    parcial: el costo depende de los productos elegibles y de k, no del tamaño del catálogo.
+    """
+
+    def __init__(self, products: List[Product], tariff: Any):
+        if not products:
+            raise ValueError("Tarifa inválida: catálogo sin productos")
+        self.products = products
+        for p in products:
+            if p.carrier not in tariff.carriers:
+                raise ValueError(f"Tarifa inválida: producto {p.name!r} de aseguradora desconocida {p.carrier!r}")
+
+        self.carrier_ids: Dict[str, int] = {name: i for i, name in enumerate(tariff.carriers)}
+        self.carrier_of = np.array([self.carrier_ids[p.carrier] for p in products], dtype=np.intp)
+        self.bias = np.array([tariff.carriers[p.carrier][0] * p.factor for p in products])
+        nan = float("nan")
+        self.fixed_deductible = np.array([
+            tariff.deductible_factor(p.deductible_pct) if p.deductible_pct is not None else nan for p in products
+        ])
+        self.fixed_addons = np.array([
+            tariff.addons_cost(p.addons) if p.addons is not None else nan for p in products
+        ])
+
+        bounds = {p.min_value for p in products} | {p.max_value for p in products if p.max_value is not None}
+        self.breakpoints = sorted(bounds)
+        index: Dict[Tuple[int, str], Dict[str, List[int]]] = {}
+        for i, p in enumerate(products):
+            first = bisect.bisect_right(self.breakpoints, p.min_value)
+            last = (bisect.bisect_left(self.breakpoints, p.max_value) if p.max_value is not None
+                    else len(self.breakpoints))
+            for band in range(first, last + 1):
+                for usage in p.usages:
+                    by_city = index.setdefault((band, usage), {})
+                    for key in p.cities or ("*",):
+                        by_city.setdefault(key, []).append(i)
+        self.index = {k: {c: np.array(v, dtype=np.intp) for c, v in by_city.items()} for k, by_city in index.items()}
+        self.cities = sorted({key for p in products for key in (p.cities or ())})
+        self._city_set = frozenset(self.cities)
+        self.gazetteer = tariff.gazetteer
+        self._city_scope_cached = lru_cache(maxsize=_CITY_CACHE_SIZE)(self._city_scope)
+
+    @classmethod
+    def from_plans(cls, tariff: Any) -> "ProductCatalog":
+        """Catálogo por defecto: un producto por aseguradora y tramo de plan (el comportamiento clásico)"""
+        products = []
+        for carrier, (_, notes) in tariff.carriers.items():
+            lower = 0.0
+            for i, (below, plan) in enumerate(tariff.plans):
+                # El último plan cubre todo lo que queda, como plan_for_value
+                upper = below if i < len(tariff.plans) - 1 else None
+                products.append(Product(carrier, plan, f"{carrier} {plan}", min_value=lower,
+                                        max_value=upper, notes=notes))
+                lower = below
+        return cls(products, tariff)
+
+    @classmethod
+    def from_config(cls, items: List[Dict[str, Any]], tariff: Any) -> "ProductCatalog":
+        """Catálogo de la sección `products` de la tarifa"""
+        products = [
+            Product(
+                carrier=str(item["carrier"]),
+                plan=str(item["plan"]),
+                name=str(item.get("name") or f"{item['carrier']} {item['plan']}"),
+                min_value=float(item.get("min_value") or 0.0),
+                max_value=float(item["max_value"]) if item.get("max_value") is not None else None,
+                usages=item.get("usages"),
+                cities=item.get("cities"),
+                deductible_pct=item.get("deductible_pct"),
+                addons=item.get("addons"),
+                factor=float(item.get("factor", 1.0)),
+                notes=str(item.get("notes") or tariff.carriers.get(item["carrier"], (0, ""))[1]),
+            )
+            for item in items
+        ]
+        return cls(products, tariff)
+
+    def city_scope(self, city: Optional[str]) -> str:
+        """Ciudad del catálogo para el texto: la canónica del nomenclátor si el catálogo la usa; si no,
+        por subcadena como la tarifa; "*" si ninguna"""
+        return self._city_scope_cached(city or "")
+
+    def _city_scope(self, raw: str) -> str:
+        place = self.gazetteer.resolve(raw)
+        key = city_key(place.name) if place is not None else ""
+        if key in self._city_set:
+            return key
+        key = city_key(raw)
+        return next((c for c in self.cities if c in key), "*") if key else "*"
+
+    def eligible(self, state: QuoteState, carrier: Optional[str] = None) -> np.ndarray:
+        """Índices de productos elegibles para el perfil"""
+        value = float(state.vehicle_value_usd or 0)
+        band = bisect.bisect_right(self.breakpoints, value)
+        by_city = self.index.get((band, state.usage))
+        if not by_city:
+            return np.empty(0, dtype=np.intp)
+        scope = self.city_scope(state.city)
+        idx = by_city.get("*", np.empty(0, dtype=np.intp))
+        if scope in by_city and scope != "*":
+            idx = np.concatenate((idx, by_city[scope]))
+        if carrier is not None:
+            idx = idx[self.carrier_of[idx] == self.carrier_ids.get(carrier, -1)]
+        return idx
+
+    def price(self, state: QuoteState, tariff: Any, idx: np.ndarray) -> np.ndarray:
+        """Primas de los productos `idx`, con el mismo orden de operaciones que price_formula"""
+        pure = float(state.vehicle_value_usd) * tariff.base_rate(state.usage)
+        invariant = (
+            tariff.location_factor(state.city or "") *
+            tariff.age_factor(int(state.driver_age)) *
+            tariff.claims_factor(int(state.claims_last3y)) *
+            tariff.security_factor(state.anti_theft, state.garage_overnight)
+        )
+        deductible = self.fixed_deductible[idx]
+        deductible = np.where(np.isnan(deductible), tariff.deductible_factor(state.deductible_pct), deductible)
+        addons = self.fixed_addons[idx]
+        addons = np.where(np.isnan(addons), tariff.addons_cost(state.addons), addons)
+        return round_cents((pure * (invariant * deductible)) * self.bias[idx] + addons)
+
+    def top_offers(self, state: QuoteState, tariff: Any, offset: int = 0, limit: Optional[int] = None,
+                   carrier: Optional[str] = None) -> Tuple[List[Offer], int]:
+        """Ofertas más baratas en [offset, offset + limit) y el total de elegibles"""
+        idx = self.eligible(state, carrier)
+        total = len(idx)
+        if total == 0 or offset >= total:
+            return [], total
+        premiums = self.price(state, tariff, idx)
+        k = total if limit is None else min(total, offset + limit)
+        if k < total:
+            # Selección parcial O(n) de los k más baratos; solo esos se ordenan
+            part = np.argpartition(premiums, k - 1)[:k]
+        else:
+            part = np.arange(total)
+        order = part[np.lexsort((idx[part], premiums[part]))][offset:k]
+        return [self._offer(state, self.products[idx[j]], float(premiums[j])) for j in order], total
+
+    @staticmethod
+    def _offer(state: QuoteState, product: Product, premium: float) -> Offer:
+        return Offer(
+            carrier=product.carrier,
+            plan=product.plan,
+            product=product.name,
+            annual_premium_usd=premium,
+            deductible_pct=product.deductible_pct or state.deductible_pct or 10,
+            addons=product.addons if product.addons is not None else (state.addons or []),
+            coverage_notes=product.notes,
+        )
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 from app.schemas.quote import QuoteState
 
 
@@ -24,17 +24,25 @@ class QuestionService:
     }
 
     @staticmethod
-    def next_question(state: QuoteState) -> str:
-        """Determina la siguiente pregunta basada en el estado actual"""
+    def pending_field(state: QuoteState) -> Optional[str]:
+        """Campo por el que se está preguntando (el siguiente que falta), o None si está completo"""
         missing = state.missing_fields()
         if missing:
-            return QuestionService.FIELD_QUESTIONS[missing[0]]
-        
-        for field, question in QuestionService.OPTIONAL_QUESTIONS.items():
+            return missing[0]
+
+        for field in QuestionService.OPTIONAL_QUESTIONS:
             if getattr(state, field) is None:
-                return question
-        
-        return ""
+                return field
+
+        return None
+
+    @staticmethod
+    def next_question(state: QuoteState) -> str:
+        """Determina la siguiente pregunta basada en el estado actual"""
+        field = QuestionService.pending_field(state)
+        if field is None:
+            return ""
+        return QuestionService.FIELD_QUESTIONS.get(field) or QuestionService.OPTIONAL_QUESTIONS[field]
 
     @staticmethod
     def get_welcome_message() -> str:
@@ -55,10 +63,12 @@ class QuestionService:
     @staticmethod
     def format_quote_message(offers: List, recommendation: str, disclaimer: str) -> str:
         """Formatea el mensaje de cotización"""
+        # Tantas líneas como aseguradoras tenga la tarifa vigente
+        lines = "".join(
+            f"{i}) {o.carrier} - {o.plan}: {o.annual_premium_usd}\n" for i, o in enumerate(offers, 1)
+        )
         return (
             f"Estas son tus mejores opciones (anual, USD):\n"
-            f"1) {offers[0].carrier} - {offers[0].plan}: {offers[0].annual_premium_usd}\n"
-            f"2) {offers[1].carrier} - {offers[1].plan}: {offers[1].annual_premium_usd}\n"
-            f"3) {offers[2].carrier} - {offers[2].plan}: {offers[2].annual_premium_usd}\n\n"
+            f"{lines}\n"
             f"{recommendation}\n\n{disclaimer}"
         )
@@ -0,0 +1,75 @@
+import threading
+from typing import Any, Dict, Optional
+
+from cachetools import LRUCache
+
+from app.schemas.quote import QuoteResult, QuoteState
+from app.services.single_flight import SingleFlight
+from app.services.tariff import Tariff
+
+
+class QuoteCache:
+    """Caché LRU de QuoteResult por perfil tarifario equivalente.
+
+    La clave usa solo lo que cambia el precio o el texto de la cotización, ya reducido a los
+    factores de la tarifa (dos ciudades o edades con el mismo factor comparten entrada), más
+    la compilación de tarifa (`generation`, no la versión declarada, que puede no cambiar):
+    recargar la tarifa invalida todo sin recorrer la caché. `namespace` separa las cotizaciones
+    de adaptadores de aseguradoras registrados de las locales.
+    Los resultados se comparten entre solicitantes y no deben modificarse.
+    """
+
+    def __init__(self, maxsize: int = 10_000):
+        self._cache: LRUCache = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self.single_flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(state: QuoteState, tariff: Tariff, namespace: str = "") -> str:
+        """Clave canónica del perfil tarifario"""
+        return "|".join((
+            namespace,
+            str(tariff.generation),
+            repr(float(state.vehicle_value_usd)),
+            repr(tariff.base_rate(state.usage)),
+            repr(tariff.location_factor(state.city or "")),
+            repr(tariff.age_factor(int(state.driver_age))),
+            repr(tariff.claims_factor(int(state.claims_last3y))),
+            repr(tariff.security_factor(state.anti_theft, state.garage_overnight)),
+            str(state.deductible_pct),
+            # Lo que decide qué productos del catálogo son elegibles
+            str(state.usage),
+            tariff.catalog.city_scope(state.city),
+            # El orden de los add-ons se conserva: se muestra tal cual en las ofertas
+            ",".join(state.addons or ()),
+        ))
+
+    def get(self, key: str) -> Optional[QuoteResult]:
+        with self._lock:
+            result = self._cache.get(key)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return result
+
+    def set(self, key: str, result: QuoteResult) -> None:
+        with self._lock:
+            self._cache[key] = result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "maxsize": int(self._cache.maxsize),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "single_flight": self.single_flight.stats(),
+        }
@@ -1,162 +1,183 @@
-from typing import List, Optional, Literal
-from app.schemas.quote import QuoteState, Offer, QuoteResult
+from typing import List, Optional
+from app.schemas.quote import QuoteState, Offer, QuoteResult, CarrierFailure
+from app.services.quote_cache import QuoteCache
+from app.services.tariff import Tariff, TariffService
+from app.core.config import get_settings
+
+
+QUOTE_CACHE = QuoteCache(maxsize=get_settings().QUOTE_CACHE_SIZE)
 
 
 class QuoteService:
-    """Servicio para generar cotizaciones de seguros vehiculares"""
+    """Servicio para generar cotizaciones de seguros vehiculares.
+
+    Los factores salen de la tarifa vigente (ver TariffService); cada método acepta una
+    tarifa explícita para que una cotización completa use una sola versión aunque se recargue.
+    """
 
     @staticmethod
-    def location_factor(city: str) -> float:
+    def location_factor(city: str, tariff: Optional[Tariff] = None) -> float:
         """Factor de ubicación geográfica"""
-        c = (city or "").lower()
-        if "guayaquil" in c: return 1.12
-        if "quito" in c: return 1.10
-        if "cuenca" in c: return 1.02
-        return 0.98
+        return (tariff or TariffService.current()).location_factor(city)
 
     @staticmethod
-    def age_factor(age: int) -> float:
+    def age_factor(age: int, tariff: Optional[Tariff] = None) -> float:
         """Factor por edad del conductor"""
-        if age < 25: return 1.20
-        if age > 60: return 1.10
-        return 1.00
+        return (tariff or TariffService.current()).age_factor(age)
 
     @staticmethod
-    def claims_factor(n: int) -> float:
+    def claims_factor(n: int, tariff: Optional[Tariff] = None) -> float:
         """Factor por siniestros previos"""
-        if n == 0: return 0.90
-        if n == 1: return 1.10
-        return 1.25
+        return (tariff or TariffService.current()).claims_factor(n)
 
     @staticmethod
-    def security_factor(anti: Optional[bool], garage: Optional[bool]) -> float:
+    def security_factor(anti: Optional[bool], garage: Optional[bool], tariff: Optional[Tariff] = None) -> float:
         """Factor por medidas de seguridad"""
-        f = 1.0
-        if anti: f *= 0.95
-        if garage: f *= 0.95
-        return f
+        return (tariff or TariffService.current()).security_factor(anti, garage)
 
     @staticmethod
-    def deductible_factor(pct: Optional[int]) -> float:
+    def deductible_factor(pct: Optional[int], tariff: Optional[Tariff] = None) -> float:
         """Factor por deducible"""
-        if pct is None or pct == 10: return 1.00
-        if pct == 5: return 1.10
-        if pct == 15: return 0.95
-        if pct == 20: return 0.90
-        return 1.00
+        return (tariff or TariffService.current()).deductible_factor(pct)
 
     @staticmethod
-    def base_rate(usage: str) -> float:
+    def base_rate(usage: str, tariff: Optional[Tariff] = None) -> float:
         """Tasa base según uso"""
-        return 0.025 if usage == "particular" else 0.032
+        return (tariff or TariffService.current()).base_rate(usage)
 
     @staticmethod
-    def plan_for_value(value: float) -> Literal["Básica","Media","Full"]:
+    def plan_for_value(value: float, tariff: Optional[Tariff] = None) -> str:
         """Determina el plan según el valor del vehículo"""
-        if value < 12000: return "Básica"
-        if value < 25000: return "Media"
-        return "Full"
+        return (tariff or TariffService.current()).plan_for_value(value)
 
     @staticmethod
-    def addons_cost(addons: Optional[List[str]]) -> float:
+    def addons_cost(addons: Optional[List[str]], tariff: Optional[Tariff] = None) -> float:
         """Calcula el costo de add-ons"""
-        if not addons: return 0.0
-        cost = 0.0
-        for a in addons:
-            if a == "asistencia_vial": cost += 20
-            elif a == "auto_reemplazo": cost += 35
-            elif a == "cobertura_lunas": cost += 15
-        return cost
+        return (tariff or TariffService.current()).addons_cost(addons)
 
     @staticmethod
-    def price_formula(state: QuoteState, carrier_bias: float) -> float:
+    def price_formula(state: QuoteState, carrier_bias: float, tariff: Optional[Tariff] = None) -> float:
         """Fórmula de cálculo de prima estimada NO vinculante"""
-        pure = float(state.vehicle_value_usd) * QuoteService.base_rate(state.usage)
+        t = tariff or TariffService.current()
+        pure = float(state.vehicle_value_usd) * t.base_rate(state.usage)
         factors = (
-            QuoteService.location_factor(state.city or "") *
-            QuoteService.age_factor(int(state.driver_age)) *
-            QuoteService.claims_factor(int(state.claims_last3y)) *
-            QuoteService.security_factor(state.anti_theft, state.garage_overnight) *
-            QuoteService.deductible_factor(state.deductible_pct)
+            t.location_factor(state.city or "") *
+            t.age_factor(int(state.driver_age)) *
+            t.claims_factor(int(state.claims_last3y)) *
+            t.security_factor(state.anti_theft, state.garage_overnight) *
+            t.deductible_factor(state.deductible_pct)
         )
-        return round((pure * factors * carrier_bias) + QuoteService.addons_cost(state.addons), 2)
+        return round((pure * factors * carrier_bias) + t.addons_cost(state.addons), 2)
 
     @staticmethod
-    def carrier_andes(state: QuoteState) -> Offer:
-        """Cotización de Aseguradora Andes"""
-        premium = QuoteService.price_formula(state, carrier_bias=0.98)
+    def carrier_offer(state: QuoteState, carrier: str, tariff: Optional[Tariff] = None) -> Offer:
+        """Cotización de una aseguradora con su plan por valor del vehículo (sin catálogo de productos)"""
+        t = tariff or TariffService.current()
+        bias, notes = t.carriers[carrier]
+        premium = QuoteService.price_formula(state, carrier_bias=bias, tariff=t)
         return Offer(
-            carrier="Aseguradora Andes",
-            plan=QuoteService.plan_for_value(state.vehicle_value_usd or 0),
+            carrier=carrier,
+            plan=t.plan_for_value(state.vehicle_value_usd or 0),
             annual_premium_usd=premium,
             deductible_pct=state.deductible_pct or 10,
             addons=state.addons or [],
-            coverage_notes="Cobertura completa para daños materiales, RC, robo. Red amplia de talleres urbanos."
+            coverage_notes=notes
         )
 
     @staticmethod
-    def carrier_pacifica(state: QuoteState) -> Offer:
-        """Cotización de Pacífica Seguros"""
-        premium = QuoteService.price_formula(state, carrier_bias=1.02)
-        return Offer(
-            carrier="Pacífica Seguros",
-            plan=QuoteService.plan_for_value(state.vehicle_value_usd or 0),
-            annual_premium_usd=premium,
-            deductible_pct=state.deductible_pct or 10,
-            addons=state.addons or [],
-            coverage_notes="Fuerte en lunas y asistencia 24/7. Mejores SLA en costa."
-        )
+    def carrier_offers(
+        state: QuoteState, carrier: str, tariff: Optional[Tariff] = None, limit: Optional[int] = None
+    ) -> List[Offer]:
+        """Mejores ofertas de los productos elegibles de una aseguradora, por prima"""
+        t = tariff or TariffService.current()
+        k = limit if limit is not None else get_settings().QUOTE_TOP_K
+        return t.catalog.top_offers(state, t, limit=k, carrier=carrier)[0]
 
     @staticmethod
-    def carrier_equinoccial(state: QuoteState) -> Offer:
-        """Cotización de Equinoccial"""
-        premium = QuoteService.price_formula(state, carrier_bias=1.00)
-        return Offer(
-            carrier="Equinoccial",
-            plan=QuoteService.plan_for_value(state.vehicle_value_usd or 0),
-            annual_premium_usd=premium,
-            deductible_pct=state.deductible_pct or 10,
-            addons=state.addons or [],
-            coverage_notes="Buen balance precio/beneficio. Talleres certificados y auto sustituto opcional."
-        )
+    def aggregate_offers(
+        state: QuoteState, tariff: Optional[Tariff] = None, limit: Optional[int] = None
+    ) -> List[Offer]:
+        """Las `limit` (QUOTE_TOP_K) ofertas más baratas entre todos los productos elegibles del catálogo"""
+        t = tariff or TariffService.current()
+        k = limit if limit is not None else get_settings().QUOTE_TOP_K
+        return t.catalog.top_offers(state, t, limit=k)[0]
 
     @staticmethod
-    def aggregate_offers(state: QuoteState) -> List[Offer]:
-        """Agrega ofertas de todas las aseguradoras"""
-        offers = [
-            QuoteService.carrier_andes(state),
-            QuoteService.carrier_pacifica(state),
-            QuoteService.carrier_equinoccial(state)
-        ]
-        offers.sort(key=lambda o: o.annual_premium_usd)
-        return offers
-
-    @staticmethod
-    def recommend_text(state: QuoteState, offers: List[Offer]) -> str:
-        """Genera texto de recomendación"""
+    def recommend_text(state: QuoteState, offers: List[Offer], tariff: Optional[Tariff] = None) -> str:
+        """Genera texto de recomendación; sugiere la aseguradora que destaca en los add-ons pedidos (ver tarifa)"""
+        if not offers:
+            return "Ninguna aseguradora respondió a tiempo. Intenta de nuevo en unos minutos."
+        t = tariff or TariffService.current()
         best = offers[0]
         reasons = []
         reasons.append(f"mejor precio estimado (USD {best.annual_premium_usd})")
-        if (state.addons or []) and "cobertura_lunas" in (state.addons or []):
-            if best.carrier != "Pacífica Seguros":
-                reasons.append("considera Pacífica si priorizas lunas y asistencia 24/7")
+        requested = state.addons or []
+        specialist = next((
+            (carrier, hint) for carrier, (addons, hint) in t.carrier_strengths.items()
+            if carrier != best.carrier and any(a in requested for a in addons)
+        ), None)
+        if specialist is not None:
+            reasons.append(f"considera {specialist[0]} si priorizas {specialist[1]}")
+        alternatives = " y ".join(o.carrier for o in offers[1:3])
         msg = (
             f"Recomiendo **{best.carrier} - Plan {best.plan}** por {', '.join(reasons)}. "
-            f"Alternativas: {offers[1].carrier} y {offers[2].carrier}. "
-            "Podemos emitir en línea validando documentos y pago."
+            + (f"Alternativas: {alternatives}. " if alternatives else "")
+            + "Podemos emitir en línea validando documentos y pago."
         )
         return msg
 
     @staticmethod
-    def generate_quote(state: QuoteState) -> QuoteResult:
-        """Genera cotización completa"""
-        offers = QuoteService.aggregate_offers(state)
-        recommendation = QuoteService.recommend_text(state, offers)
+    def build_result(
+        state: QuoteState,
+        offers: List[Offer],
+        tariff: Tariff,
+        failed_carriers: Optional[List[CarrierFailure]] = None
+    ) -> QuoteResult:
+        """Arma la cotización a partir de las ofertas ya ordenadas por prima"""
         return QuoteResult(
             offers=offers,
-            recommendation=recommendation,
+            recommendation=QuoteService.recommend_text(state, offers, tariff),
+            tariff_version=tariff.version,
+            failed_carriers=failed_carriers or [],
             disclaimer=(
                 "Estimado NO vinculante. Precio final sujeto a inspección, verificación de datos "
                 "y políticas de la aseguradora. Sin intermediarios: contratación directa con la aseguradora."
             ),
         )
+
+    @staticmethod
+    def generate_quote(state: QuoteState) -> QuoteResult:
+        """Genera cotización completa (memoizada por perfil tarifario equivalente)"""
+        # Una sola versión de tarifa por cotización, aunque se recargue mientras tanto
+        tariff = TariffService.current()
+        key = QuoteCache.key(state, tariff)
+        result = QUOTE_CACHE.get(key)
+        if result is None:
+            offers = QuoteService.aggregate_offers(state, tariff)
+            result = QuoteService.build_result(state, offers, tariff)
+            QUOTE_CACHE.set(key, result)
+        return result
+
+    @staticmethod
+    async def generate_quote_async(state: QuoteState, budget_seconds: Optional[float] = None) -> QuoteResult:
+        """Genera la cotización consultando a todas las aseguradoras en paralelo (ver CarrierRegistry).
+
+        Perfiles equivalentes reutilizan la cotización completa en caché, y los que llegan a la vez
+        comparten un solo fan-out; las cotizaciones con aseguradoras caídas no se guardan.
+        """
+        from app.services.carrier_adapters import CarrierRegistry
+
+        tariff = TariffService.current()
+        key = QuoteCache.key(state, tariff, CarrierRegistry.cache_namespace())
+        result = QUOTE_CACHE.get(key)
+        if result is not None:
+            return result
+
+        async def fan_out() -> QuoteResult:
+            offers, failures = await CarrierRegistry.fan_out(state, tariff, budget_seconds)
+            quote = QuoteService.build_result(state, offers, tariff, failures)
+            if not failures:
+                QUOTE_CACHE.set(key, quote)
+            return quote
+
+        return await QUOTE_CACHE.single_flight.do(key, fan_out)
@@ -0,0 +1,219 @@
+import csv
+import io
+import json
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from pydantic import TypeAdapter, ValidationError
+
+from app.schemas.quote import QuoteState
+from app.services.quote_service import QuoteService
+from app.services.tariff import TariffService
+
+# Columnas del CSV de salida: una fila por oferta
+OUTPUT_COLUMNS = ("row", "rank", "carrier", "product", "plan", "annual_premium_usd",
+                  "deductible_pct", "addons", "tariff_version")
+
+_STATES = TypeAdapter(List[QuoteState])
+_ADDONS_SEPARATOR = re.compile(r"[;|,]")
+
+# (número de fila, fila leída o None si no se pudo leer, error de lectura)
+Row = Tuple[int, Optional[Dict[str, Any]], Optional[str]]
+# (salida serializada, rechazos serializados, filas cotizadas, filas rechazadas)
+ChunkResult = Tuple[str, str, int, int]
+
+
+def file_format(path: str, fmt: Optional[str] = None) -> str:
+    """Formato explícito o deducido de la extensión ("csv"; cualquier otra cosa es "jsonl")"""
+    if fmt:
+        return fmt
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+class RepricingService:
+    """Recotización masiva de carteras (renovaciones) con la misma lógica que QuoteService.generate_quote.
+
+    Lee el archivo por bloques, valida y tarifica cada bloque en un pool de procesos y escribe
+    los resultados en el orden de entrada a medida que llegan. Solo hay unos pocos bloques en
+    vuelo a la vez, así que la memoria no depende del tamaño del archivo.
+    """
+
+    @staticmethod
+    def normalize_csv_row(row: Dict[str, Any]) -> Dict[str, Any]:
+        """Celdas vacías como None y add-ons separados por ';', '|' o ','"""
+        out = {k: (v if v != "" else None) for k, v in row.items() if k}
+        addons = out.get("addons")
+        if isinstance(addons, str):
+            out["addons"] = [a.strip() for a in _ADDONS_SEPARATOR.split(addons) if a.strip()]
+        return out
+
+    @staticmethod
+    def read_rows(path: str, fmt: Optional[str] = None) -> Iterator[Row]:
+        """Lee las pólizas fila por fila (CSV con encabezado o JSONL), sin cargar el archivo entero"""
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            if file_format(path, fmt) == "csv":
+                for number, row in enumerate(csv.DictReader(f), start=1):
+                    yield number, RepricingService.normalize_csv_row(row), None
+                return
+            for number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield number, None, f"JSON inválido: {e}"
+                    continue
+                if isinstance(row, dict):
+                    yield number, row, None
+                else:
+                    yield number, None, "JSON inválido: se esperaba un objeto"
+
+    @staticmethod
+    def chunks(rows: Iterator[Row], size: int) -> Iterator[List[Row]]:
+        while True:
+            chunk = list(islice(rows, size))
+            if not chunk:
+                return
+            yield chunk
+
+    @staticmethod
+    def _error_text(e: ValidationError) -> str:
+        return "; ".join(
+            f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" if err["loc"] else err["msg"]
+            for err in e.errors()
+        )
+
+    @staticmethod
+    def validate(rows: List[Row]) -> List[Tuple[int, Optional[QuoteState], Optional[str]]]:
+        """Valida el bloque en una sola llamada; si algo falla, fila por fila para aislar los errores"""
+        readable = [(n, raw) for n, raw, error in rows if error is None]
+        try:
+            states = _STATES.validate_python([raw for _, raw in readable])
+            valid = {n: (state, None) for (n, _), state in zip(readable, states)}
+        except ValidationError:
+            valid = {}
+            for n, raw in readable:
+                try:
+                    valid[n] = (QuoteState.model_validate(raw), None)
+                except ValidationError as e:
+                    valid[n] = (None, RepricingService._error_text(e))
+
+        result = []
+        for n, _, read_error in rows:
+            state, error = valid.get(n, (None, read_error))
+            if state is not None:
+                missing = state.missing_fields()
+                if missing:
+                    state, error = None, f"Faltan campos: {', '.join(missing)}"
+            result.append((n, state, error))
+        return result
+
+    @staticmethod
+    def price_chunk(rows: List[Row], output_format: str = "jsonl") -> ChunkResult:
+        """Valida y tarifica un bloque; la serialización también ocurre en el proceso del pool"""
+        out = io.StringIO()
+        writer = csv.writer(out) if output_format == "csv" else None
+        rejects = io.StringIO()
+        priced = rejected = 0
+        for n, state, error in RepricingService.validate(rows):
+            if state is None:
+                rejected += 1
+                rejects.write(json.dumps({"row": n, "error": error}, ensure_ascii=False) + "\n")
+                continue
+            quote = QuoteService.generate_quote(state)
+            priced += 1
+            if writer is not None:
+                writer.writerows(
+                    (n, rank, o.carrier, o.product or "", o.plan, o.annual_premium_usd,
+                     o.deductible_pct, ";".join(o.addons), quote.tariff_version or "")
+                    for rank, o in enumerate(quote.offers, start=1)
+                )
+            else:
+                out.write(json.dumps({
+                    "row": n,
+                    "tariff_version": quote.tariff_version,
+                    "offers": [o.model_dump() for o in quote.offers],
+                }, ensure_ascii=False) + "\n")
+        return out.getvalue(), rejects.getvalue(), priced, rejected
+
+    @staticmethod
+    def init_worker(tariff_path: Optional[str]) -> None:
+        """Carga en cada proceso del pool la misma tarifa que usa el proceso principal"""
+        if tariff_path:
+            TariffService.configure(tariff_path)
+
+    @staticmethod
+    def run(
+        input_path: str,
+        output_path: str,
+        rejects_path: Optional[str] = None,
+        workers: Optional[int] = None,
+        chunk_size: int = 2000,
+        input_format: Optional[str] = None,
+        tariff_path: Optional[str] = None,
+        progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+        progress_interval_seconds: float = 2.0,
+    ) -> Dict[str, Any]:
+        """Recotiza `input_path` y escribe las ofertas en `output_path` (CSV o JSONL según la extensión).
+
+        workers=0 tarifica en el proceso actual y None usa todos los núcleos. Devuelve el resumen:
+        filas leídas, cotizadas, rechazadas, segundos y filas por segundo.
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        output_format = file_format(output_path)
+        stats: Dict[str, Any] = {"rows": 0, "priced": 0, "rejected": 0, "seconds": 0.0, "rows_per_second": 0.0}
+        start = last_report = time.perf_counter()
+
+        def record(result: ChunkResult) -> None:
+            nonlocal last_report
+            out, rejects, priced, rejected = result
+            out_file.write(out)
+            if rejects_file is not None:
+                rejects_file.write(rejects)
+            stats["rows"] += priced + rejected
+            stats["priced"] += priced
+            stats["rejected"] += rejected
+            now = time.perf_counter()
+            stats["seconds"] = round(now - start, 3)
+            stats["rows_per_second"] = round(stats["rows"] / (now - start), 1)
+            if progress is not None and now - last_report >= progress_interval_seconds:
+                last_report = now
+                progress(dict(stats))
+
+        chunks = RepricingService.chunks(RepricingService.read_rows(input_path, input_format), chunk_size)
+        rejects_file = open(rejects_path, "w", encoding="utf-8") if rejects_path else None
+        try:
+            with open(output_path, "w", newline="", encoding="utf-8") as out_file:
+                if output_format == "csv":
+                    csv.writer(out_file).writerow(OUTPUT_COLUMNS)
+                if workers <= 0:
+                    RepricingService.init_worker(tariff_path)
+                    for chunk in chunks:
+                        record(RepricingService.price_chunk(chunk, output_format))
+                else:
+                    with ProcessPoolExecutor(
+                        max_workers=workers,
+                        initializer=RepricingService.init_worker,
+                        initargs=(tariff_path,),
+                    ) as pool:
+                        # Dos bloques por proceso en vuelo como máximo; se escriben en el orden de entrada
+                        in_flight: Deque[Future] = deque()
+                        for chunk in chunks:
+                            if len(in_flight) >= 2 * workers:
+                                record(in_flight.popleft().result())
+                            in_flight.append(pool.submit(RepricingService.price_chunk, chunk, output_format))
+                        while in_flight:
+                            record(in_flight.popleft().result())
+        finally:
+            if rejects_file is not None:
+                rejects_file.close()
+
+        if progress is not None:
+            progress(dict(stats))
+        return stats
@@ -0,0 +1,152 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+
+class CircuitBreaker:
+    """Circuit breaker por tasa de error sobre una ventana de las últimas llamadas"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_rate: float = 0.5, window_size: int = 50,
+                 min_calls: int = 10, open_seconds: float = 30.0):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self._window: Deque[bool] = deque(maxlen=window_size)
+        self._failures = 0
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started = 0.0
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            return self.HALF_OPEN
+        return self._state
+
+    def allow(self) -> bool:
+        """True si se puede llamar al upstream; en half-open deja pasar una sola llamada de prueba"""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN:
+            # Una prueba que nunca reportó resultado (p. ej. cancelada) no bloquea el circuito para siempre
+            now = time.monotonic()
+            if not self._probe_in_flight or now - self._probe_started >= self.open_seconds:
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = True
+                self._probe_started = now
+                return True
+        return False
+
+    def record_success(self) -> None:
+        if self._state == self.HALF_OPEN:
+            self._reset()
+            return
+        self._record(False)
+
+    def record_failure(self) -> None:
+        if self._state == self.HALF_OPEN:
+            self._open()
+            return
+        self._record(True)
+        if (len(self._window) >= self.min_calls
+                and self._failures / len(self._window) >= self.failure_rate):
+            self._open()
+
+    def _record(self, failed: bool) -> None:
+        if len(self._window) == self._window.maxlen and self._window[0]:
+            self._failures -= 1
+        self._window.append(failed)
+        if failed:
+            self._failures += 1
+
+    def _open(self) -> None:
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+        self.times_opened += 1
+
+    def _reset(self) -> None:
+        self._state = self.CLOSED
+        self._window.clear()
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "times_opened": self.times_opened,
+            "window_calls": len(self._window),
+            "window_failures": self._failures,
+        }
+
+
+class LatencyTracker:
+    """Latencias recientes de llamadas exitosas, para estimar percentiles"""
+
+    def __init__(self, window_size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=window_size)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def backoff_delay(attempt: int, base_seconds: float, max_seconds: float = 5.0) -> float:
+    """Backoff exponencial con jitter completo"""
+    return random.uniform(0, min(max_seconds, base_seconds * (2 ** attempt)))
+
+
+async def hedged_call(
+    factory: Callable[[], Awaitable[Any]],
+    timeout: float,
+    hedge_delay: Optional[float] = None
+) -> Tuple[Any, bool]:
+    """Ejecuta factory() con deadline; si no responde tras hedge_delay, lanza una segunda copia.
+
+    Devuelve el primer resultado exitoso y si se llegó a lanzar la copia.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    hedge_at = loop.time() + hedge_delay if hedge_delay is not None and hedge_delay < timeout else None
+    pending = {asyncio.ensure_future(factory())}
+    hedged = False
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            wake = min(deadline, hedge_at) if hedge_at is not None else deadline
+            done, pending = await asyncio.wait(
+                pending, timeout=max(0.0, wake - loop.time()), return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    return task.result(), hedged
+                error = task.exception()
+            if not pending:
+                break
+            if hedge_at is not None and loop.time() >= hedge_at:
+                hedge_at = None
+                hedged = True
+                pending.add(asyncio.ensure_future(factory()))
+            elif loop.time() >= deadline:
+                raise asyncio.TimeoutError()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
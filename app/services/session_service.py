@@ -1,26 +1,53 @@
+import asyncio
+import gc
 import time
 import uuid
-from typing import Dict, Any
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+from app.core.config import get_settings
+from app.services.session_snapshot import read_snapshot, write_snapshot
+from app.services.session_store import SessionStore, build_session_store
+
+T = TypeVar("T")
 
 
 class SessionService:
     _instance = None
-    _sessions: Dict[str, Dict[str, Any]] = {}
+    _store: Optional[SessionStore] = None
     _ttl_seconds: int = 60 * 60
 
-    def __new__(cls, ttl_seconds: int = 60 * 60):
+    def __new__(cls, ttl_seconds: int = 60 * 60, store: Optional[SessionStore] = None):
         if cls._instance is None:
             cls._instance = super(SessionService, cls).__new__(cls)
             cls._ttl_seconds = ttl_seconds
+            cls._store = store or build_session_store(get_settings())
         return cls._instance
 
-    def __init__(self, ttl_seconds: int = 60 * 60):
+    def __init__(self, ttl_seconds: int = 60 * 60, store: Optional[SessionStore] = None):
         # No hacer nada en __init__ para mantener el singleton
         pass
 
+    @classmethod
+    def use_store(cls, store: SessionStore) -> None:
+        """Reemplaza el backend de sesiones (p. ej. en tests o al reconfigurar)"""
+        if cls._store is not None:
+            cls._store.close()
+        cls._store = store
+        cls._ttl_seconds = store.ttl_seconds
+
+    @property
+    def store(self) -> SessionStore:
+        return self._store
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        """Ejecuta operaciones de sesión; en un hilo si el backend hace I/O bloqueante (SQL)"""
+        if self._store.blocking_io:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
     @property
     def sessions(self) -> Dict[str, Dict[str, Any]]:
-        return self._sessions
+        return self._store.sessions
 
     @property
     def ttl_seconds(self) -> int:
@@ -34,29 +61,55 @@ class SessionService:
 
     def prune_sessions(self):
         """Elimina sesiones expiradas"""
-        now = self._now()
-        for sid in list(self._sessions.keys()):
-            if now - self._sessions[sid].get("updated_at", now) > self._ttl_seconds:
-                self._sessions.pop(sid, None)
+        self._store.prune(self._now())
 
     def get_session(self, session_id: str) -> Dict[str, Any]:
         """Obtiene una sesión por ID"""
-        return self._sessions.get(session_id)
+        return self._store.get(session_id, self._now())
 
-    def create_session(self, session_id: str, state: Any) -> None:
-        """Crea una nueva sesión"""
-        self._sessions[session_id] = {
-            "state": state,
-            "updated_at": self._now()
-        }
-        print(f"Session created: {self._sessions}")
+    def create_session(self, session_id: str, state: Any) -> str:
+        """Crea una nueva sesión; devuelve el session_id para el cliente"""
+        now = self._now()
+        self._store.put(session_id, state, now)
+        return self._store.client_session_id(session_id, state, now)
+
+    def client_session_id(self, session_id: str, state: Any, turns: int = 0) -> str:
+        """session_id que se devuelve al cliente tras guardar `state` (un token en el backend sin estado)"""
+        return self._store.client_session_id(session_id, state, self._now(), turns)
+
+    def get_or_create_session(self, session_id: str, state: Any) -> Tuple[Dict[str, Any], bool]:
+        """Obtiene la sesión o la crea con `state` de forma atómica; indica si se creó"""
+        return self._store.get_or_create(session_id, state, self._now())
+
+    def compare_and_update(self, session_id: str, state: Any, version: int, turns: int = 0) -> bool:
+        """Actualiza la sesión solo si sigue en `version`; False si otra petición la modificó"""
+        return self._store.compare_and_set(session_id, state, version, self._now(), turns)
 
-    def update_session(self, session_id: str, state: Any) -> None:
+    def update_session(self, session_id: str, state: Any, turns: int = 0) -> None:
         """Actualiza una sesión existente"""
-        if session_id in self._sessions:
-            self._sessions[session_id]["state"] = state
-            self._sessions[session_id]["updated_at"] = self._now()
+        if self._store.get(session_id, self._now()) is not None:
+            self._store.put(session_id, state, self._now(), turns)
 
     def session_exists(self, session_id: str) -> bool:
         """Verifica si una sesión existe"""
-        return session_id in self._sessions
+        return self._store.get(session_id, self._now()) is not None
+
+    def save_snapshot(self, path: str) -> int:
+        """Escribe un snapshot de las sesiones vivas en `path`; devuelve cuántas se guardaron"""
+        return write_snapshot(path, self._store.snapshot_items())
+
+    def restore_snapshot(self, path: str) -> int:
+        """Restaura las sesiones aún vigentes de un snapshot previo; devuelve cuántas"""
+        # Se crean ~1M de objetos de larga vida de una vez: sin pausar el GC, sus
+        # recolecciones repetidas duplican el tiempo de arranque
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self._store.restore(read_snapshot(path), self._now())
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def flush(self) -> None:
+        """Persiste escrituras pendientes del backend"""
+        self._store.flush()
@@ -0,0 +1,67 @@
+import logging
+import mmap
+import os
+import struct
+from typing import Iterable, Iterator, Tuple
+
+
+# Formato: cabecera (magia, versión, cantidad) y registros (len sid, updated_at, len estado, sid, estado).
+# El estado va tal cual lo guarda el backend en memoria (state_codec.pack_session), así que restaurar no
+# decodifica nada. Versión 2: el estado empaquetado lleva delante el contador de turnos de la sesión.
+_MAGIC = b"ISNP"
+_FORMAT_VERSION = 2
+_HEADER = struct.Struct("<4sBI")
+_RECORD = struct.Struct("<HdH")
+
+SnapshotItem = Tuple[str, bytes, float]
+
+logger = logging.getLogger(__name__)
+
+
+def write_snapshot(path: str, items: Iterable[SnapshotItem]) -> int:
+    """Escribe (session_id, estado empaquetado, updated_at) en `path` de forma atómica; devuelve cuántas"""
+    tmp_path = f"{path}.tmp"
+    count = 0
+    with open(tmp_path, "wb", buffering=1 << 20) as f:
+        f.write(_HEADER.pack(_MAGIC, _FORMAT_VERSION, 0))
+        for session_id, packed, updated_at in items:
+            sid = session_id.encode("utf-8")
+            f.write(_RECORD.pack(len(sid), updated_at, len(packed)))
+            f.write(sid)
+            f.write(packed)
+            count += 1
+        f.seek(0)
+        f.write(_HEADER.pack(_MAGIC, _FORMAT_VERSION, count))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+
+def read_snapshot(path: str) -> Iterator[SnapshotItem]:
+    """Recorre un snapshot con mmap, en el orden en que se escribió; vacío si no existe o no es válido"""
+    if not os.path.exists(path) or os.path.getsize(path) < _HEADER.size:
+        return
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        magic, version, count = _HEADER.unpack_from(buf, 0)
+        if magic != _MAGIC or version != _FORMAT_VERSION:
+            return
+        pos = _HEADER.size
+        size = len(buf)
+        record_size = _RECORD.size
+        unpack_record = _RECORD.unpack_from
+        for i in range(count):
+            try:
+                sid_len, updated_at, packed_len = unpack_record(buf, pos)
+                pos += record_size
+                end = pos + sid_len + packed_len
+                if end > size:
+                    raise ValueError("registro incompleto")
+                session_id = buf[pos:pos + sid_len].decode("utf-8")
+            except (struct.error, ValueError):
+                # Archivo truncado o corrupto: se restaura lo que se pudo leer
+                logger.warning("Snapshot de sesiones corrupto en %s: %d de %d registros leídos", path, i, count)
+                return
+            pos += sid_len
+            yield session_id, buf[pos:end], updated_at
+            pos = end
@@ -0,0 +1,676 @@
+import heapq
+import logging
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import (
+    BigInteger, Column, Float, Integer, MetaData, String, Table, Text, create_engine, delete, event, func, select, update
+)
+from sqlalchemy.engine import Engine
+
+from app.schemas.quote import QuoteState
+from app.services.session_snapshot import SnapshotItem
+from app.services.state_codec import pack_session, unpack_session
+from app.utils.security import create_session_token, verify_session_token
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """Interfaz de almacenamiento de sesiones de asesoría"""
+
+    # True si las operaciones hacen I/O bloqueante y deben ejecutarse fuera del event loop
+    blocking_io = False
+
+    def __init__(self, ttl_seconds: int):
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, session_id: str, now: float) -> Optional[Dict[str, Any]]:
+        """Sesión como {"state": QuoteState, "updated_at": float, "version": int, "turns": int};
+        None si no existe o expiró.
+
+        `version` es un valor opaco que cambia con cada escritura; `turns` son los turnos de
+        conversación procesados (metadato de la sesión, para métricas).
+        """
+        raise NotImplementedError
+
+    def put(self, session_id: str, state: QuoteState, now: float, turns: int = 0) -> None:
+        raise NotImplementedError
+
+    def get_or_create(self, session_id: str, state: QuoteState, now: float) -> Tuple[Dict[str, Any], bool]:
+        """Devuelve la sesión existente o la crea con `state`, de forma atómica; indica si se creó"""
+        raise NotImplementedError
+
+    def compare_and_set(self, session_id: str, state: QuoteState, expected_version: int, now: float,
+                        turns: int = 0) -> bool:
+        """Escribe `state` solo si la sesión sigue en `expected_version`; False si otro la actualizó"""
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    def client_session_id(self, session_id: str, state: QuoteState, now: float, turns: int = 0) -> str:
+        """session_id que se devuelve al cliente tras guardar `state` (en backends con estado, el mismo)"""
+        return session_id
+
+    def prune(self, now: float) -> int:
+        """Elimina sesiones expiradas; devuelve cuántas se eliminaron"""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    @property
+    def sessions(self) -> Dict[str, Dict[str, Any]]:
+        """Sesiones visibles en este proceso (para depuración)"""
+        return {}
+
+    def stats(self) -> Dict[str, Any]:
+        return {"count": len(self)}
+
+    def snapshot_items(self) -> Iterable[SnapshotItem]:
+        """Sesiones para un snapshot local, ordenadas por updated_at (vacío si el backend ya persiste)"""
+        return []
+
+    def restore(self, items: Iterable[SnapshotItem], now: float) -> int:
+        """Carga sesiones de un snapshot (al arrancar, con el store vacío); devuelve cuántas seguían vivas"""
+        return 0
+
+    def flush(self) -> None:
+        """Persiste escrituras pendientes, si el backend las agrupa"""
+
+    def close(self) -> None:
+        self.flush()
+
+
+class SessionRecord:
+    """Sesión compacta: QuoteState y turnos empaquetados (ver state_codec.pack_session) + hora de actualización"""
+
+    __slots__ = ("packed", "updated_at", "version")
+
+    def __init__(self, packed: bytes, updated_at: float, version: int = 0):
+        self.packed = packed
+        self.updated_at = updated_at
+        self.version = version
+
+    @property
+    def nbytes(self) -> int:
+        return _RECORD_OVERHEAD + sys.getsizeof(self.packed)
+
+    def __repr__(self) -> str:
+        return f"SessionRecord({len(self.packed)}B, updated_at={self.updated_at:.0f})"
+
+
+# Registro con __slots__ + float + versión + entrada del dict + clave uuid de 36 caracteres
+_RECORD_OVERHEAD = (
+    sys.getsizeof(SessionRecord(b"", 0.0)) + sys.getsizeof(0.0) + sys.getsizeof(2 ** 40)
+    + 104 + sys.getsizeof("0" * 36)
+)
+
+
+class InMemorySessionStore(SessionStore):
+    """Sesiones en un dict del proceso (un solo worker).
+
+    El dict se mantiene ordenado por última actualización (cada escritura mueve la sesión
+    al final), así que las expiradas están siempre al principio y la limpieza solo recorre
+    esas: O(expiradas) en lugar de O(total). El mismo orden sirve para desalojar la sesión
+    menos usada recientemente cuando se supera `max_sessions` o `max_bytes`.
+
+    Cada sesión se guarda empaquetada (~40 bytes) y el QuoteState se materializa al leerla.
+    No es thread-safe por sí solo: ShardedSessionStore lo usa detrás de un lock por shard.
+    """
+
+    def __init__(self, ttl_seconds: int, prune_batch: int = 1000,
+                 max_sessions: int = 0, max_bytes: int = 0):
+        super().__init__(ttl_seconds)
+        self._sessions: "OrderedDict[str, SessionRecord]" = OrderedDict()
+        # Máximo de sesiones eliminadas por llamada, para acotar la latencia de un request
+        self.prune_batch = prune_batch
+        # 0 = sin límite
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._bytes = 0
+        self.evictions = 0
+
+    @property
+    def sessions(self) -> Dict[str, SessionRecord]:
+        return self._sessions
+
+    @property
+    def memory_bytes(self) -> int:
+        """Memoria aproximada ocupada por las sesiones"""
+        return self._bytes
+
+    def get(self, session_id: str, now: float) -> Optional[Dict[str, Any]]:
+        record = self._live(session_id, now)
+        if record is None:
+            return None
+        state, turns = unpack_session(record.packed)
+        return {"state": state, "updated_at": record.updated_at, "version": record.version, "turns": turns}
+
+    def _live(self, session_id: str, now: float) -> Optional[SessionRecord]:
+        record = self._sessions.get(session_id)
+        if record is None or now - record.updated_at > self.ttl_seconds:
+            return None
+        return record
+
+    def get_or_create(self, session_id: str, state: QuoteState, now: float) -> Tuple[Dict[str, Any], bool]:
+        data = self.get(session_id, now)
+        if data is not None:
+            return data, False
+        self.put(session_id, state, now)
+        return self.get(session_id, now), True
+
+    def compare_and_set(self, session_id: str, state: QuoteState, expected_version: int, now: float,
+                        turns: int = 0) -> bool:
+        record = self._live(session_id, now)
+        if record is None or record.version != expected_version:
+            return False
+        self.put(session_id, state, now, turns)
+        return True
+
+    def put(self, session_id: str, state: QuoteState, now: float, turns: int = 0) -> None:
+        old = self._sessions.get(session_id)
+        record = SessionRecord(pack_session(state, turns), now, old.version + 1 if old is not None else 0)
+        if old is not None:
+            self._bytes -= old.nbytes
+        self._sessions[session_id] = record
+        self._sessions.move_to_end(session_id)
+        self._bytes += record.nbytes
+        self._evict()
+
+    def _evict(self) -> None:
+        while self._sessions and (
+            (self.max_sessions and len(self._sessions) > self.max_sessions)
+            or (self.max_bytes and self._bytes > self.max_bytes)
+        ):
+            _, record = self._sessions.popitem(last=False)
+            self._bytes -= record.nbytes
+            self.evictions += 1
+
+    def delete(self, session_id: str) -> None:
+        record = self._sessions.pop(session_id, None)
+        if record is not None:
+            self._bytes -= record.nbytes
+
+    def prune(self, now: float) -> int:
+        removed = 0
+        while self._sessions and removed < self.prune_batch:
+            sid, record = next(iter(self._sessions.items()))
+            if now - record.updated_at <= self.ttl_seconds:
+                break
+            del self._sessions[sid]
+            self._bytes -= record.nbytes
+            removed += 1
+        return removed
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def snapshot_items(self) -> List[SnapshotItem]:
+        return [(sid, record.packed, record.updated_at) for sid, record in self._sessions.items()]
+
+    def restore(self, items: Iterable[SnapshotItem], now: float) -> int:
+        restored = 0
+        added_bytes = 0
+        sessions = self._sessions
+        oldest = now - self.ttl_seconds
+        getsizeof = sys.getsizeof
+        for sid, packed, updated_at in items:
+            # Las sesiones escritas desde el arranque son más nuevas que las del snapshot
+            if updated_at < oldest or sid in sessions:
+                continue
+            sessions[sid] = SessionRecord(packed, updated_at)
+            added_bytes += _RECORD_OVERHEAD + getsizeof(packed)
+            restored += 1
+        self._bytes += added_bytes
+        self._evict()
+        return restored
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "count": len(self._sessions),
+            "memory_bytes": self._bytes,
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+        }
+
+
+class ShardedSessionStore(SessionStore):
+    """Backend en memoria dividido en N shards, cada uno con su propio lock.
+
+    Los endpoints sync corren en el threadpool y los async en el event loop: sin locks,
+    `prune` podía recorrer el dict mientras otro hilo lo modificaba. Con un lock por shard
+    las operaciones sobre sesiones distintas no se bloquean entre sí, y get_or_create /
+    compare_and_set son atómicas por sesión.
+    """
+
+    def __init__(self, ttl_seconds: int, shards: int = 16, prune_batch: int = 1000,
+                 max_sessions: int = 0, max_bytes: int = 0):
+        super().__init__(ttl_seconds)
+        per_shard_sessions = -(-max_sessions // shards) if max_sessions else 0
+        per_shard_bytes = -(-max_bytes // shards) if max_bytes else 0
+        self._shards = [
+            InMemorySessionStore(ttl_seconds, prune_batch=prune_batch,
+                                 max_sessions=per_shard_sessions, max_bytes=per_shard_bytes)
+            for _ in range(shards)
+        ]
+        self._locks = [threading.Lock() for _ in range(shards)]
+
+    def _shard(self, session_id: str) -> Tuple[InMemorySessionStore, threading.Lock]:
+        i = hash(session_id) % len(self._shards)
+        return self._shards[i], self._locks[i]
+
+    @property
+    def sessions(self) -> Dict[str, SessionRecord]:
+        merged: Dict[str, SessionRecord] = {}
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                merged.update(shard.sessions)
+        return merged
+
+    @property
+    def memory_bytes(self) -> int:
+        return sum(shard.memory_bytes for shard in self._shards)
+
+    def get(self, session_id: str, now: float) -> Optional[Dict[str, Any]]:
+        shard, lock = self._shard(session_id)
+        with lock:
+            return shard.get(session_id, now)
+
+    def put(self, session_id: str, state: QuoteState, now: float, turns: int = 0) -> None:
+        shard, lock = self._shard(session_id)
+        with lock:
+            shard.put(session_id, state, now, turns)
+
+    def get_or_create(self, session_id: str, state: QuoteState, now: float) -> Tuple[Dict[str, Any], bool]:
+        shard, lock = self._shard(session_id)
+        with lock:
+            return shard.get_or_create(session_id, state, now)
+
+    def compare_and_set(self, session_id: str, state: QuoteState, expected_version: int, now: float,
+                        turns: int = 0) -> bool:
+        shard, lock = self._shard(session_id)
+        with lock:
+            return shard.compare_and_set(session_id, state, expected_version, now, turns)
+
+    def delete(self, session_id: str) -> None:
+        shard, lock = self._shard(session_id)
+        with lock:
+            shard.delete(session_id)
+
+    def prune(self, now: float) -> int:
+        removed = 0
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                removed += shard.prune(now)
+        return removed
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._shards)
+
+    def snapshot_items(self) -> Iterable[SnapshotItem]:
+        per_shard = []
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                per_shard.append(shard.snapshot_items())
+        # El hash de str cambia entre procesos: el orden global por updated_at permite que,
+        # al restaurar con otro reparto, cada shard reciba sus sesiones todavía ordenadas
+        return heapq.merge(*per_shard, key=lambda item: item[2])
+
+    def restore(self, items: Iterable[SnapshotItem], now: float) -> int:
+        groups: List[List[SnapshotItem]] = [[] for _ in self._shards]
+        n = len(self._shards)
+        for item in items:
+            groups[hash(item[0]) % n].append(item)
+        restored = 0
+        for shard, lock, group in zip(self._shards, self._locks, groups):
+            with lock:
+                restored += shard.restore(group, now)
+        return restored
+
+    def stats(self) -> Dict[str, Any]:
+        per_shard = [shard.stats() for shard in self._shards]
+        return {
+            "count": sum(s["count"] for s in per_shard),
+            "memory_bytes": sum(s["memory_bytes"] for s in per_shard),
+            "max_sessions": sum(s["max_sessions"] for s in per_shard),
+            "max_bytes": sum(s["max_bytes"] for s in per_shard),
+            "evictions": sum(s["evictions"] for s in per_shard),
+            "shards": len(self._shards),
+        }
+
+
+class TokenSessionStore(SessionStore):
+    """Backend sin estado: el QuoteState viaja empaquetado y firmado (opcionalmente cifrado) en el session_id.
+
+    Cualquier réplica atiende cualquier turno sin buscar la sesión ni guardar nada en memoria;
+    la expiración va en el propio token. No hay compare-and-set posible: dos turnos en paralelo
+    con el mismo token producen dos tokens independientes.
+    """
+
+    def __init__(self, ttl_seconds: int, encrypt: bool = False, keys: Optional[List[str]] = None):
+        super().__init__(ttl_seconds)
+        self.encrypt = encrypt
+        self.keys = keys
+        self.issued = 0
+        self.rejected = 0
+
+    def get(self, session_id: str, now: float) -> Optional[Dict[str, Any]]:
+        payload = verify_session_token(session_id, now=now, keys=self.keys)
+        if payload is None:
+            self.rejected += 1
+            return None
+        state, turns = unpack_session(payload)
+        return {"state": state, "updated_at": now, "version": 0, "turns": turns}
+
+    def put(self, session_id: str, state: QuoteState, now: float, turns: int = 0) -> None:
+        """No hay nada que guardar: el estado se emite en client_session_id"""
+
+    def get_or_create(self, session_id: str, state: QuoteState, now: float) -> Tuple[Dict[str, Any], bool]:
+        data = self.get(session_id, now)
+        if data is not None:
+            return data, False
+        return {"state": state, "updated_at": now, "version": 0, "turns": 0}, True
+
+    def compare_and_set(self, session_id: str, state: QuoteState, expected_version: int, now: float,
+                        turns: int = 0) -> bool:
+        return True
+
+    def client_session_id(self, session_id: str, state: QuoteState, now: float, turns: int = 0) -> str:
+        self.issued += 1
+        return create_session_token(
+            pack_session(state, turns), now + self.ttl_seconds, encrypt=self.encrypt, keys=self.keys
+        )
+
+    def delete(self, session_id: str) -> None:
+        pass
+
+    def prune(self, now: float) -> int:
+        return 0
+
+    def __len__(self) -> int:
+        return 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "count": 0,
+            "stateless": True,
+            "encrypted": self.encrypt,
+            "issued": self.issued,
+            "rejected": self.rejected,
+        }
+
+
+metadata = MetaData()
+
+sessions_table = Table(
+    "advice_sessions",
+    metadata,
+    Column("session_id", String(64), primary_key=True),
+    Column("state", Text, nullable=False),
+    Column("updated_at", Float, nullable=False),
+    Column("expires_at", Float, nullable=False, index=True),
+    Column("version", BigInteger, nullable=False),
+    Column("turns", Integer, nullable=False, default=0),
+)
+
+
+def _new_version() -> int:
+    return random.getrandbits(62)
+
+
+def _enable_sqlite_wal(engine: Engine) -> None:
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
+
+class SQLSessionStore(SessionStore):
+    """Sesiones en una base SQL (SQLite en modo WAL para varios workers, o cualquier URL de SQLAlchemy).
+
+    Las escrituras se agrupan en memoria y se envían en lote cada `batch_size` escrituras
+    o `flush_interval` segundos; las lecturas del mismo proceso ven las escrituras pendientes.
+    compare_and_set no se agrupa: escribe lo pendiente de esa sesión y hace un UPDATE
+    condicionado a la versión en la base, así dos workers nunca se pisan.
+    """
+
+    blocking_io = True
+
+    def __init__(self, ttl_seconds: int, engine: Optional[Engine] = None, url: Optional[str] = None,
+                 batch_size: int = 100, flush_interval: float = 0.05, prune_interval: float = 1.0):
+        super().__init__(ttl_seconds)
+        if engine is None:
+            engine = create_engine(
+                url,
+                connect_args={"check_same_thread": False} if url.startswith("sqlite") else {}
+            )
+        self.engine = engine
+        if engine.dialect.name == "sqlite":
+            _enable_sqlite_wal(engine)
+        metadata.create_all(engine, tables=[sessions_table])
+
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.prune_interval = prune_interval
+        # session_id -> (estado, updated_at, versión, turnos)
+        self._pending: Dict[str, Tuple[QuoteState, float, int, int]] = {}
+        # Lote que se está escribiendo: sigue visible para lecturas hasta que se confirma
+        self._flushing: Dict[str, Tuple[QuoteState, float, int, int]] = {}
+        self._lock = threading.Lock()
+        # Locks por franja de session_id para las operaciones de lectura-escritura de una sesión
+        self._stripes = [threading.Lock() for _ in range(64)]
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._last_prune = 0.0
+
+    @property
+    def sessions(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                sid: {"state": s, "updated_at": t, "version": v, "turns": n}
+                for sid, (s, t, v, n) in self._pending.items()
+            }
+
+    def get(self, session_id: str, now: float) -> Optional[Dict[str, Any]]:
+        self._maybe_flush()
+        with self._lock:
+            pending = self._pending.get(session_id) or self._flushing.get(session_id)
+        if pending is not None:
+            state, updated_at, version, turns = pending
+            if now - updated_at > self.ttl_seconds:
+                return None
+            return {"state": state, "updated_at": updated_at, "version": version, "turns": turns}
+
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(
+                    sessions_table.c.state, sessions_table.c.updated_at, sessions_table.c.version,
+                    sessions_table.c.turns,
+                ).where(
+                    sessions_table.c.session_id == session_id,
+                    sessions_table.c.expires_at > now,
+                )
+            ).first()
+        if row is None:
+            return None
+        return {
+            "state": QuoteState.model_validate_json(row.state),
+            "updated_at": row.updated_at,
+            "version": row.version,
+            "turns": row.turns,
+        }
+
+    def _stripe(self, session_id: str) -> threading.Lock:
+        return self._stripes[hash(session_id) % len(self._stripes)]
+
+    def put(self, session_id: str, state: QuoteState, now: float, turns: int = 0) -> None:
+        with self._stripe(session_id):
+            self._buffer(session_id, state, now, turns)
+        self._maybe_flush()
+
+    def _buffer(self, session_id: str, state: QuoteState, now: float, turns: int = 0) -> None:
+        with self._lock:
+            self._pending[session_id] = (state, now, _new_version(), turns)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._flush_quietly()
+
+    def get_or_create(self, session_id: str, state: QuoteState, now: float) -> Tuple[Dict[str, Any], bool]:
+        with self._stripe(session_id):
+            data = self.get(session_id, now)
+            if data is not None:
+                return data, False
+            self._buffer(session_id, state, now)
+            return self.get(session_id, now), True
+
+    def compare_and_set(self, session_id: str, state: QuoteState, expected_version: int, now: float,
+                        turns: int = 0) -> bool:
+        with self._stripe(session_id):
+            with self._lock:
+                current = self._pending.get(session_id) or self._flushing.get(session_id)
+            if current is not None:
+                if current[2] != expected_version or now - current[1] > self.ttl_seconds:
+                    return False
+                # Lo pendiente de la sesión se escribe primero para que el UPDATE condicional lo vea
+                self._write_through(session_id)
+
+            # El CAS no pasa por el buffer: un lote posterior nunca pisa lo que otro worker escribió
+            with self.engine.begin() as conn:
+                result = conn.execute(
+                    update(sessions_table)
+                    .where(
+                        sessions_table.c.session_id == session_id,
+                        sessions_table.c.version == expected_version,
+                        sessions_table.c.expires_at > now,
+                    )
+                    .values(
+                        state=state.model_dump_json(),
+                        updated_at=now,
+                        expires_at=now + self.ttl_seconds,
+                        version=_new_version(),
+                        turns=turns,
+                    )
+                )
+            return result.rowcount == 1
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._pending.pop(session_id, None)
+        with self.engine.begin() as conn:
+            conn.execute(delete(sessions_table).where(sessions_table.c.session_id == session_id))
+
+    def prune(self, now: float) -> int:
+        # El índice sobre expires_at hace la limpieza proporcional a lo expirado; se limita su frecuencia
+        if now - self._last_prune < self.prune_interval:
+            return 0
+        self._last_prune = now
+        self._maybe_flush()
+        with self.engine.begin() as conn:
+            result = conn.execute(delete(sessions_table).where(sessions_table.c.expires_at <= now))
+        return result.rowcount or 0
+
+    def __len__(self) -> int:
+        self.flush()
+        with self.engine.connect() as conn:
+            return conn.execute(
+                select(func.count()).select_from(sessions_table).where(
+                    sessions_table.c.expires_at > time.time()
+                )
+            ).scalar_one()
+
+    def _maybe_flush(self) -> None:
+        if self._pending and time.monotonic() - self._last_flush >= self.flush_interval:
+            self._flush_quietly()
+
+    def _flush_quietly(self) -> None:
+        # En el camino de una request: un lote fallido queda pendiente y no rompe la request de otro usuario
+        try:
+            self.flush()
+        except Exception as e:
+            logger.warning("No se pudo escribir el lote de sesiones; se reintentará: %s", e)
+
+    def flush(self) -> None:
+        # Un lote a la vez, para que un lote viejo nunca pise a uno más nuevo
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._flushing = batch
+                self._last_flush = time.monotonic()
+            if batch:
+                self._write_batch(batch)
+
+    def _write_through(self, session_id: str) -> None:
+        # El lock de flush espera a un lote en curso que quizá ya incluye la sesión
+        with self._flush_lock:
+            with self._lock:
+                entry = self._pending.pop(session_id, None)
+                if entry is None:
+                    return
+                self._flushing = {session_id: entry}
+            self._write_batch({session_id: entry})
+
+    def _write_batch(self, batch: Dict[str, Tuple[QuoteState, float, int, int]]) -> None:
+        rows = [
+            {
+                "session_id": sid,
+                "state": state.model_dump_json(),
+                "updated_at": updated_at,
+                "expires_at": updated_at + self.ttl_seconds,
+                "version": version,
+                "turns": turns,
+            }
+            for sid, (state, updated_at, version, turns) in batch.items()
+        ]
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(delete(sessions_table).where(sessions_table.c.session_id.in_(list(batch))))
+                conn.execute(sessions_table.insert(), rows)
+        except Exception:
+            # Si la escritura falla, el lote vuelve a quedar pendiente sin pisar escrituras más nuevas
+            with self._lock:
+                for sid, value in batch.items():
+                    self._pending.setdefault(sid, value)
+            raise
+        finally:
+            with self._lock:
+                self._flushing = {}
+
+
+def build_session_store(settings) -> SessionStore:
+    """Crea el backend de sesiones configurado en SESSION_BACKEND"""
+    ttl_seconds = settings.SESSION_TTL_SECONDS
+    if settings.SESSION_BACKEND == "memory":
+        return ShardedSessionStore(
+            ttl_seconds,
+            shards=settings.SESSION_SHARDS,
+            max_sessions=settings.SESSION_MAX_SESSIONS,
+            max_bytes=settings.SESSION_MAX_BYTES,
+        )
+    if settings.SESSION_BACKEND == "sql":
+        if settings.SESSION_DATABASE_URL:
+            return SQLSessionStore(
+                ttl_seconds,
+                url=settings.SESSION_DATABASE_URL,
+                batch_size=settings.SESSION_WRITE_BATCH_SIZE,
+                flush_interval=settings.SESSION_FLUSH_INTERVAL_SECONDS,
+            )
+        from app.database.database import engine
+        return SQLSessionStore(
+            ttl_seconds,
+            engine=engine,
+            batch_size=settings.SESSION_WRITE_BATCH_SIZE,
+            flush_interval=settings.SESSION_FLUSH_INTERVAL_SECONDS,
+        )
+    if settings.SESSION_BACKEND == "token":
+        return TokenSessionStore(ttl_seconds, encrypt=settings.SESSION_TOKEN_ENCRYPT)
+    raise ValueError(f"SESSION_BACKEND desconocido: {settings.SESSION_BACKEND}")
@@ -0,0 +1,108 @@
+import struct
+from typing import Any, Dict, List, Tuple
+
+from app.schemas.quote import QuoteState
+
+
+# Orden fijo de los campos de QuoteState en la codificación binaria
+FIELDS = [
+    "vehicle_year", "vehicle_make", "vehicle_model", "vehicle_value_usd", "usage", "city",
+    "driver_age", "claims_last3y", "anti_theft", "garage_overnight", "deductible_pct", "addons",
+]
+
+USAGES = ["particular", "comercial"]
+ADDONS = ["asistencia_vial", "auto_reemplazo", "cobertura_lunas"]
+
+_MASK = struct.Struct("<H")
+_U16 = struct.Struct("<H")
+_F64 = struct.Struct("<d")
+
+
+def _pack_str(value: str) -> bytes:
+    raw = value.encode("utf-8")
+    if len(raw) > 0xFFFF:
+        raise ValueError(f"Texto de {len(raw)} bytes: el máximo empaquetable es {0xFFFF}")
+    return _U16.pack(len(raw)) + raw
+
+
+def _pack_addons(addons: List[str]) -> int:
+    bits = 0
+    for addon in addons:
+        bits |= 1 << ADDONS.index(addon)
+    return bits
+
+
+def pack_state(state: QuoteState) -> bytes:
+    """Codifica un QuoteState en bytes: máscara de campos presentes + valores en orden fijo"""
+    mask = 0
+    out = []
+    for i, field in enumerate(FIELDS):
+        value = getattr(state, field)
+        if value is None:
+            continue
+        mask |= 1 << i
+        if field == "vehicle_year":
+            out.append(_U16.pack(value))
+        elif field in ("vehicle_make", "vehicle_model", "city"):
+            out.append(_pack_str(value))
+        elif field == "vehicle_value_usd":
+            out.append(_F64.pack(value))
+        elif field == "usage":
+            out.append(bytes((USAGES.index(value),)))
+        elif field in ("anti_theft", "garage_overnight"):
+            out.append(b"\x01" if value else b"\x00")
+        elif field == "addons":
+            out.append(bytes((_pack_addons(value),)))
+        else:  # driver_age, claims_last3y, deductible_pct
+            out.append(bytes((value,)))
+    return _MASK.pack(mask) + b"".join(out)
+
+
+def unpack_fields(data: bytes) -> Dict[str, Any]:
+    """Decodifica los bytes de pack_state a un dict de campos presentes"""
+    view = memoryview(data)
+    (mask,) = _MASK.unpack_from(view, 0)
+    pos = _MASK.size
+    fields: Dict[str, Any] = {}
+    for i, field in enumerate(FIELDS):
+        if not mask & (1 << i):
+            continue
+        if field == "vehicle_year":
+            (fields[field],) = _U16.unpack_from(view, pos)
+            pos += _U16.size
+        elif field in ("vehicle_make", "vehicle_model", "city"):
+            (length,) = _U16.unpack_from(view, pos)
+            pos += _U16.size
+            fields[field] = bytes(view[pos:pos + length]).decode("utf-8")
+            pos += length
+        elif field == "vehicle_value_usd":
+            (fields[field],) = _F64.unpack_from(view, pos)
+            pos += _F64.size
+        else:
+            byte = view[pos]
+            pos += 1
+            if field == "usage":
+                fields[field] = USAGES[byte]
+            elif field in ("anti_theft", "garage_overnight"):
+                fields[field] = bool(byte)
+            elif field == "addons":
+                fields[field] = [a for j, a in enumerate(ADDONS) if byte & (1 << j)]
+            else:
+                fields[field] = byte
+    return fields
+
+
+def unpack_state(data: bytes) -> QuoteState:
+    """Materializa el QuoteState sin volver a validar (los datos se validaron al empaquetar)"""
+    return QuoteState.model_construct(**unpack_fields(data))
+
+
+def pack_session(state: QuoteState, turns: int = 0) -> bytes:
+    """Sesión empaquetada: turnos procesados (metadato de la sesión, no del perfil) + pack_state"""
+    return _U16.pack(min(turns, 0xFFFF)) + pack_state(state)
+
+
+def unpack_session(data: bytes) -> Tuple[QuoteState, int]:
+    """Decodifica pack_session en (QuoteState, turnos)"""
+    (turns,) = _U16.unpack_from(data, 0)
+    return unpack_state(data[_U16.size:]), turns
@@ -0,0 +1,249 @@
+import hashlib
+import itertools
+import logging
+import os
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import yaml
+
+from app.services.gazetteer import Gazetteer, fold
+from app.services.product_catalog import ProductCatalog
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TARIFF_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "tariff.yaml")
+
+# Edad máxima representada en la tabla compilada de factores por edad
+MAX_AGE = 120
+# Planes que acepta Offer.plan
+PLAN_NAMES = ("Básica", "Media", "Full")
+# Tope de la memoización LRU de factores por ciudad (texto libre del usuario)
+_LOCATION_CACHE_SIZE = 4096
+# Número de compilación de cada Tariff: distingue dos tarifas con la misma versión declarada
+_GENERATIONS = itertools.count(1)
+
+
+class Tariff:
+    """Tarifa compilada: tablas y dicts de acceso O(1) construidos una vez al cargar.
+
+    Es inmutable después de construirse; una recarga crea otra instancia y la publica de una vez.
+    `generation` identifica la instancia: las cachés se indexan con ella y no con `version`,
+    que puede quedar igual aunque el contenido del archivo cambie.
+    """
+
+    def __init__(self, data: Dict[str, Any], version: str, gazetteer: Optional[Gazetteer] = None):
+        self.generation = next(_GENERATIONS)
+        self.gazetteer = gazetteer or Gazetteer.default()
+        try:
+            self.version = version
+            self.base_rates: Dict[str, float] = {k: float(v) for k, v in data["base_rate"].items()}
+            # Cualquier uso distinto de "particular" paga la tasa comercial
+            self.fallback_rate = self.base_rates["comercial"]
+
+            location = data["location"]
+            self.location_default = float(location["default"])
+            self.location_rules: List[Tuple[str, float]] = [
+                (str(rule["match"]).lower(), float(rule["factor"])) for rule in location.get("cities", [])
+            ]
+            # Ciudad o provincia canónica del nomenclátor -> factor; la primera regla de cada nombre gana
+            self.city_factors: Dict[str, float] = {}
+            for match, factor in self.location_rules:
+                self.city_factors.setdefault(fold(match), factor)
+            self.province_factors: Dict[str, float] = {}
+            for rule in location.get("provinces", []):
+                self.province_factors.setdefault(fold(str(rule["match"])), float(rule["factor"]))
+            self._location_cached = lru_cache(maxsize=_LOCATION_CACHE_SIZE)(self._location_factor)
+
+            # age_table[edad] -> factor, para 0..MAX_AGE
+            self.age_table = np.empty(MAX_AGE + 1)
+            for age in range(MAX_AGE + 1):
+                band = next((b for b in data["age_bands"] if age <= b["max_age"]), data["age_bands"][-1])
+                self.age_table[age] = float(band["factor"])
+            self._age_list: List[float] = self.age_table.tolist()
+
+            self.claims_table = np.array([float(f) for f in data["claims"]])
+            self._claims_list: List[float] = self.claims_table.tolist()
+
+            # security_table[anti_theft][garage], con las mismas multiplicaciones que el cálculo original
+            anti = float(data["security"]["anti_theft"])
+            garage = float(data["security"]["garage_overnight"])
+            self.security_table = np.array([[1.0, 1.0 * garage], [1.0 * anti, 1.0 * anti * garage]])
+            self._security_list: List[List[float]] = self.security_table.tolist()
+
+            deductible = data["deductible"]
+            self.deductible_default = float(deductible["default"])
+            self.deductible_factors: Dict[int, float] = {
+                int(k): float(v) for k, v in deductible["factors"].items()
+            }
+
+            self.plans: List[Tuple[Optional[float], str]] = [
+                (float(p["below"]) if "below" in p else None, str(p["plan"])) for p in data["plans"]
+            ]
+            self.addon_prices: Dict[str, float] = {k: float(v) for k, v in data["addons"].items()}
+            self.carriers: Dict[str, Tuple[float, str]] = {
+                str(c["name"]): (float(c["bias"]), str(c.get("notes", ""))) for c in data["carriers"]
+            }
+            # Aseguradora -> (add-ons en los que destaca, texto para la recomendación)
+            self.carrier_strengths: Dict[str, Tuple[List[str], str]] = {
+                str(c["name"]): ([str(a) for a in c["strengths"]],
+                                 str(c.get("hint") or ", ".join(c["strengths"])))
+                for c in data["carriers"] if c.get("strengths")
+            }
+        except (KeyError, TypeError, ValueError, StopIteration) as e:
+            raise ValueError(f"Tarifa inválida: {e!r}") from e
+        if not self.carriers:
+            raise ValueError("Tarifa inválida: sin aseguradoras")
+        unknown = sorted({a for addons, _ in self.carrier_strengths.values() for a in addons
+                          if a not in self.addon_prices})
+        if unknown:
+            raise ValueError(f"Tarifa inválida: add-ons de aseguradoras {unknown}")
+        unknown = [plan for _, plan in self.plans if plan not in PLAN_NAMES]
+        if unknown or not self.plans:
+            raise ValueError(f"Tarifa inválida: planes {unknown or 'vacíos'}")
+        bounds = [below for below, _ in self.plans]
+        if None in bounds[:-1] or bounds[:-1] != sorted(bounds[:-1]) or (
+                bounds[-1] is not None and len(bounds) > 1 and bounds[-1] < bounds[-2]):
+            raise ValueError("Tarifa inválida: los tramos de planes deben ser crecientes y solo el último sin tope")
+
+        # Sin sección `products`, un producto por aseguradora y plan (precios idénticos a la fórmula clásica)
+        try:
+            products = data.get("products")
+            # Con productos configurados, la tarificación vectorizada pasa por el catálogo (ver PricingEngine)
+            self.has_products = bool(products)
+            self.catalog = (ProductCatalog.from_config(products, self) if products
+                            else ProductCatalog.from_plans(self))
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f"Tarifa inválida: productos {e!r}") from e
+        unknown = sorted({p.plan for p in self.catalog.products if p.plan not in PLAN_NAMES})
+        if unknown:
+            raise ValueError(f"Tarifa inválida: planes de productos {unknown}")
+
+    def base_rate(self, usage: Optional[str]) -> float:
+        return self.base_rates.get(usage, self.fallback_rate)
+
+    def location_factor(self, city: Optional[str]) -> float:
+        """Factor de la ciudad resuelta con el nomenclátor (alias, tildes y typos incluidos), luego de
+        su provincia; un texto que no está en el nomenclátor se compara por subcadena con las reglas"""
+        return self._location_cached(city or "")
+
+    def _location_factor(self, key: str) -> float:
+        place = self.gazetteer.resolve(key)
+        if place is not None:
+            factor = self.city_factors.get(fold(place.name))
+            return factor if factor is not None else self.province_factors.get(
+                fold(place.province), self.location_default
+            )
+        c = key.lower()
+        return next((f for match, f in self.location_rules if match in c), self.location_default)
+
+    def age_factor(self, age: int) -> float:
+        return self._age_list[min(max(age, 0), MAX_AGE)]
+
+    def claims_factor(self, n: int) -> float:
+        return self._claims_list[min(max(n, 0), len(self._claims_list) - 1)]
+
+    def security_factor(self, anti: Optional[bool], garage: Optional[bool]) -> float:
+        return self._security_list[bool(anti)][bool(garage)]
+
+    def deductible_factor(self, pct: Optional[int]) -> float:
+        return self.deductible_factors.get(pct, self.deductible_default) if pct is not None else self.deductible_default
+
+    def plan_for_value(self, value: float) -> str:
+        for below, plan in self.plans:
+            if below is None or value < below:
+                return plan
+        return self.plans[-1][1]
+
+    def addons_cost(self, addons: Optional[List[str]]) -> float:
+        if not addons:
+            return 0.0
+        cost = 0.0
+        for a in addons:
+            cost += self.addon_prices.get(a, 0.0)
+        return cost
+
+
+def load_tariff(path: str) -> Tariff:
+    """Lee y compila un archivo de tarifa YAML (o JSON, que también es YAML válido)"""
+    with open(path, "rb") as f:
+        raw = f.read()
+    data = yaml.safe_load(raw)
+    if not isinstance(data, dict):
+        raise ValueError(f"Tarifa inválida: {path}")
+    # Sin versión explícita se usa un hash del contenido
+    version = str(data.get("version") or hashlib.sha256(raw).hexdigest()[:12])
+    return Tariff(data, version)
+
+
+class TariffService:
+    """Tarifa vigente del proceso, con recarga en caliente cuando cambia el archivo.
+
+    La recarga compila la tarifa nueva aparte y la publica reemplazando una sola referencia:
+    las cotizaciones en curso terminan con la tarifa que tomaron y nadie espera un lock.
+    """
+
+    _tariff: Optional[Tariff] = None
+    _path: str = DEFAULT_TARIFF_PATH
+    # (mtime_ns, tamaño) del archivo cargado, para detectar cambios
+    _signature: Optional[Tuple[int, int]] = None
+    _reload_lock = threading.Lock()
+
+    @classmethod
+    def current(cls) -> Tariff:
+        tariff = cls._tariff
+        if tariff is None:
+            with cls._reload_lock:
+                if cls._tariff is None:
+                    cls._load(cls._path)
+            tariff = cls._tariff
+        return tariff
+
+    @classmethod
+    def configure(cls, path: str) -> Tariff:
+        """Carga la tarifa de `path` y la usa en adelante"""
+        with cls._reload_lock:
+            cls._path = path
+            cls._load(path)
+        return cls._tariff
+
+    @classmethod
+    def use(cls, tariff: Tariff) -> None:
+        """Fija una tarifa ya compilada (p. ej. en tests)"""
+        cls._tariff = tariff
+        cls._signature = None
+
+    @classmethod
+    def _load(cls, path: str) -> None:
+        signature = cls._stat(path)
+        cls._tariff = load_tariff(path)
+        cls._signature = signature
+
+    @staticmethod
+    def _stat(path: str) -> Tuple[int, int]:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+
+    @classmethod
+    def reload_if_changed(cls) -> bool:
+        """Recarga la tarifa si el archivo cambió; si la nueva es inválida se conserva la vigente"""
+        with cls._reload_lock:
+            try:
+                signature = cls._stat(cls._path)
+            except OSError as e:
+                logger.warning("No se pudo leer la tarifa %s: %s", cls._path, e)
+                return False
+            if signature == cls._signature:
+                return False
+            try:
+                tariff = load_tariff(cls._path)
+            except (OSError, ValueError, yaml.YAMLError) as e:
+                logger.warning("Tarifa %s no recargada: %s", cls._path, e)
+                cls._signature = signature
+                return False
+            cls._tariff = tariff
+            cls._signature = signature
+        logger.info("Tarifa recargada: versión %s", tariff.version)
+        return True
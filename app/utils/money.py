@@ -0,0 +1,16 @@
+import numpy as np
+
+
+def round_cents(x: np.ndarray) -> np.ndarray:
+    """
+    Redondear a centavos igual que round(x, 2) de Python, elemento a elemento.
+
+    rint(x*100)/100 coincide salvo cuando x*100 cae casi en .5, donde el error de la
+    multiplicación puede cambiar el sentido: esos pocos casos se redondean con round().
+    """
+    scaled = x * 100.0
+    out = np.rint(scaled) / 100.0
+    near_half = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    for idx in zip(*np.nonzero(near_half)):
+        out[idx] = round(float(x[idx]), 2)
+    return out
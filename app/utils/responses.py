@@ -0,0 +1,28 @@
+from typing import Any
+
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+from pydantic_core import to_json
+
+from app.services.metrics import STAGE_LATENCY
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse serializado con pydantic-core en lugar de json.dumps (respuesta por defecto de la app)
+    """
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
+
+
+def json_response(model: BaseModel) -> Response:
+    """
+    Serializar el modelo a JSON midiendo la etapa de serialización.
+
+    Devolver un Response evita que FastAPI vuelva a validar el modelo contra response_model y lo
+    pase por jsonable_encoder y json.dumps; pydantic-core escribe los bytes directamente.
+    """
+    with STAGE_LATENCY.time("serialization"):
+        body = model.__pydantic_serializer__.to_json(model)
+    return Response(content=body, media_type="application/json")
@@ -1,6 +1,12 @@
+import base64
+import hashlib
+import os
+import time
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import List, Optional
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from jose import JWTError, jwt
 from app.core.config import settings
 
@@ -42,3 +48,62 @@ def verify_token(token: str) -> Optional[dict]:
         return payload
     except JWTError:
         return None
+
+
+def session_token_keys() -> List[str]:
+    """
+    Claves para tokens de sesión: la actual primero, luego las anteriores aún válidas
+    """
+    return [settings.SECRET_KEY] + [k for k in settings.SESSION_TOKEN_PREVIOUS_KEYS.split(",") if k]
+
+
+def _key_id(key: str) -> str:
+    return hashlib.sha256(key.encode()).hexdigest()[:8]
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _aesgcm(key: str) -> AESGCM:
+    return AESGCM(hashlib.sha256(b"session-token:" + key.encode()).digest())
+
+
+def create_session_token(payload: bytes, expires_at: float, encrypt: bool = False,
+                         keys: Optional[List[str]] = None) -> str:
+    """
+    Crear un token JWT firmado que transporta `payload`, opcionalmente cifrado con AES-GCM
+    """
+    key = (keys or session_token_keys())[0]
+    if encrypt:
+        nonce = os.urandom(12)
+        claims = {"e": _b64encode(nonce + _aesgcm(key).encrypt(nonce, payload, None))}
+    else:
+        claims = {"s": _b64encode(payload)}
+    claims["exp"] = int(expires_at)
+    return jwt.encode(claims, key, algorithm=settings.ALGORITHM, headers={"kid": _key_id(key)})
+
+
+def verify_session_token(token: str, now: Optional[float] = None,
+                         keys: Optional[List[str]] = None) -> Optional[bytes]:
+    """
+    Verificar un token de sesión y devolver su payload; None si es inválido o expiró
+    """
+    by_kid = {_key_id(k): k for k in (keys or session_token_keys())}
+    try:
+        key = by_kid.get(jwt.get_unverified_header(token).get("kid"))
+        if key is None:
+            return None
+        claims = jwt.decode(token, key, algorithms=[settings.ALGORITHM], options={"verify_exp": False})
+        if claims.get("exp", 0) <= (time.time() if now is None else now):
+            return None
+        if "e" in claims:
+            raw = _b64decode(claims["e"])
+            return _aesgcm(key).decrypt(raw[:12], raw[12:], None)
+        return _b64decode(claims["s"])
+    except (JWTError, InvalidTag, KeyError, ValueError):
+        return None
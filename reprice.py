@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Script para recotizar carteras de pólizas (CSV o JSONL) sin pasar por la API
+"""
+import argparse
+import sys
+
+from app.core.config import settings
+from app.services.repricing_service import RepricingService
+
+
+def report(stats):
+    print(
+        f"filas {stats['rows']} | cotizadas {stats['priced']} | rechazadas {stats['rejected']} | "
+        f"{stats['rows_per_second']} filas/s | {stats['seconds']} s",
+        file=sys.stderr,
+        flush=True,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recotización masiva de pólizas con la tarifa vigente")
+    parser.add_argument("input", help="archivo de pólizas (.csv con encabezado o .jsonl)")
+    parser.add_argument("output", help="archivo de ofertas (.csv: una fila por oferta; otro: JSONL por póliza)")
+    parser.add_argument("--rejects", help="archivo JSONL con las filas rechazadas y el motivo")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="formato de entrada (por defecto, según la extensión)")
+    parser.add_argument("--workers", type=int, default=None, help="procesos (por defecto todos los núcleos; 0 = sin pool)")
+    parser.add_argument("--chunk-size", type=int, default=2000, help="filas por bloque")
+    parser.add_argument("--tariff", default=settings.TARIFF_PATH or None, help="archivo de tarifa (por defecto TARIFF_PATH)")
+    args = parser.parse_args(argv)
+
+    stats = RepricingService.run(
+        args.input,
+        args.output,
+        rejects_path=args.rejects,
+        workers=args.workers,
+        chunk_size=max(args.chunk_size, 1),
+        input_format=args.format,
+        tariff_path=args.tariff,
+        progress=report,
+    )
+    return 0 if stats["priced"] or not stats["rows"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import gc
+import json
+import os
+import time
+import tracemalloc
+
+import pytest
+
+# Micro-benchmarks opcionales: BENCHMARK=1 los ejecuta, BENCHMARK_SAVE=1 reescribe la línea base,
+# BENCHMARK_SAVE=new solo agrega las etapas que aún no tienen línea base, y BENCHMARK_MAX_SLOWDOWN
+# es la caída de ops/s tolerada respecto de la línea base (0.3 = 30 %)
+ENABLED = os.getenv("BENCHMARK", "") not in ("", "0")
+SAVE = os.getenv("BENCHMARK_SAVE", "") not in ("", "0")
+SAVE_NEW_ONLY = os.getenv("BENCHMARK_SAVE", "") == "new"
+# Al reescribir toda la línea base no se compara contra la anterior
+OVERWRITE = SAVE and not SAVE_NEW_ONLY
+MAX_SLOWDOWN = float(os.getenv("BENCHMARK_MAX_SLOWDOWN", "0.3"))
+BASELINE_PATH = os.getenv("BENCHMARK_BASELINE", os.path.join(os.path.dirname(__file__), "baseline.json"))
+
+ROUNDS = 5
+MIN_ROUND_SECONDS = 0.05
+
+
+class Bench:
+    """Mide ops/s (mejor de ROUNDS rondas) y la memoria asignada por operación con tracemalloc"""
+
+    def __init__(self, baseline):
+        self.baseline = baseline
+        self.results = {}
+
+    @staticmethod
+    def _calibrate(fn) -> int:
+        number = 1
+        while True:
+            start = time.perf_counter()
+            for _ in range(number):
+                fn()
+            if time.perf_counter() - start >= MIN_ROUND_SECONDS:
+                return number
+            number *= 2
+
+    @staticmethod
+    def _allocated_per_op(fn, number: int) -> int:
+        """Pico de memoria asignada por una operación (bytes)"""
+        gc.collect()
+        tracemalloc.start()
+        try:
+            peak = 0
+            for _ in range(min(number, 50)):
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                fn()
+                peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+            return peak
+        finally:
+            tracemalloc.stop()
+
+    def __call__(self, name: str, fn) -> dict:
+        fn()  # calentamiento (cachés, imports diferidos)
+        number = self._calibrate(fn)
+        best = float("inf")
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for _ in range(ROUNDS):
+                start = time.perf_counter()
+                for _ in range(number):
+                    fn()
+                best = min(best, (time.perf_counter() - start) / number)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+        result = {
+            "ops_per_second": round(1.0 / best, 1),
+            "alloc_bytes_per_op": self._allocated_per_op(fn, number),
+        }
+        self.results[name] = result
+
+        reference = self.baseline.get(name)
+        if reference and not OVERWRITE:
+            floor = reference["ops_per_second"] * (1.0 - MAX_SLOWDOWN)
+            assert result["ops_per_second"] >= floor, (
+                f"{name}: {result['ops_per_second']} ops/s, línea base {reference['ops_per_second']} "
+                f"(mínimo tolerado {floor:.1f})"
+            )
+        return result
+
+
+_RESULTS = {}
+
+
+@pytest.fixture(scope="session")
+def bench():
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, encoding="utf-8") as f:
+            baseline = json.load(f)
+    runner = Bench(baseline)
+    yield runner
+    _RESULTS.update(runner.results)
+    if SAVE and runner.results:
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            merged = {**baseline, **runner.results} if OVERWRITE else {**runner.results, **baseline}
+            json.dump(dict(sorted(merged.items())), f, indent=2)
+            f.write("\n")
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not _RESULTS:
+        return
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, encoding="utf-8") as f:
+            baseline = json.load(f)
+    terminalreporter.write_sep("-", "micro-benchmarks")
+    for name, result in _RESULTS.items():
+        reference = baseline.get(name, {}).get("ops_per_second")
+        ratio = f"{result['ops_per_second'] / reference:6.2f}x" if reference and not OVERWRITE else "     -"
+        terminalreporter.write_line(
+            f"{name:<32} {result['ops_per_second']:>14,.1f} ops/s {ratio}  "
+            f"{result['alloc_bytes_per_op']:>10,} B/op"
+        )
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+from app.schemas.quote import QuoteState
+from app.services.conversation_service import ConversationService
+from app.services.question_service import QuestionService
+from app.services.quote_service import QuoteService
+from app.services.session_service import SessionService
+from app.services.tariff import TariffService
+from app.utils.responses import json_response
+
+from .conftest import ENABLED
+
+pytestmark = pytest.mark.skipif(not ENABLED, reason="micro-benchmarks deshabilitados (BENCHMARK=1 para ejecutarlos)")
+
+
+FULL_PROFILE = {
+    "vehicle_year": 2018, "vehicle_make": "Kia", "vehicle_model": "Rio",
+    "vehicle_value_usd": 12000.0, "usage": "particular", "city": "Guayaquil",
+    "driver_age": 28, "claims_last3y": 0, "anti_theft": True, "garage_overnight": False,
+    "deductible_pct": 10, "addons": ["asistencia_vial"],
+}
+STATE = QuoteState(**FULL_PROFILE)
+PARTIAL = QuoteState(vehicle_year=2018, vehicle_make="Kia", vehicle_model="Rio")
+
+
+class FakeGeminiService:
+    """Sustituto de GeminiService que responde sin ir a la red"""
+
+    def __init__(self, responses):
+        self.responses = responses
+
+    async def extract_slots(self, user_text: str, expected_field=None):
+        return dict(self.responses.get(user_text, {}))
+
+
+def test_bench_quote_service(bench):
+    """
+    Test para medir la tarificación: fórmula, ofertas del catálogo y cotización con y sin caché
+    """
+    tariff = TariffService.current()
+    bias = tariff.carriers["Equinoccial"][0]
+    bench("quote.price_formula", lambda: QuoteService.price_formula(STATE, bias, tariff))
+    bench("quote.aggregate_offers", lambda: QuoteService.aggregate_offers(STATE, tariff))
+    bench("quote.build_uncached", lambda: QuoteService.build_result(
+        STATE, QuoteService.aggregate_offers(STATE, tariff), tariff
+    ))
+    bench("quote.generate_cached", lambda: QuoteService.generate_quote(STATE))
+
+
+def test_bench_quote_state(bench):
+    """
+    Test para medir la validación de QuoteState y missing_fields
+    """
+    bench("state.validate", lambda: QuoteState.model_validate(FULL_PROFILE))
+    bench("state.missing_fields_partial", PARTIAL.missing_fields)
+    bench("state.missing_fields_complete", STATE.missing_fields)
+
+
+def test_bench_questions(bench):
+    """
+    Test para medir la elección de la siguiente pregunta
+    """
+    bench("question.next_partial", lambda: QuestionService.next_question(PARTIAL))
+    bench("question.next_complete", lambda: QuestionService.next_question(STATE))
+
+
+def test_bench_reply_merge_path(bench):
+    """
+    Test para medir el camino de /advice/reply: mezcla con coalesce y turno completo con Gemini simulado
+    """
+    extracted = {"driver_age": 35, "city": "Quito"}
+    bench("reply.merge_state", lambda: ConversationService.merge_state(STATE, extracted))
+
+    session_service = SessionService()
+    gemini = FakeGeminiService({"perfil completo": FULL_PROFILE, "tengo 35": {"driver_age": 35}})
+    loop = asyncio.new_event_loop()
+    try:
+        sid = session_service.create_session(session_service.new_session_id(), QuoteState())
+        sid = loop.run_until_complete(
+            ConversationService.handle_turn(session_service, gemini, sid, "perfil completo")
+        ).session_id
+
+        def turn():
+            return loop.run_until_complete(
+                ConversationService.handle_turn(session_service, gemini, sid, "tengo 35")
+            )
+
+        bench("reply.turn_with_quote", turn)
+        response = turn()
+        bench("reply.serialize", lambda: json_response(response))
+    finally:
+        loop.close()
+        session_service.store.delete(sid)
@@ -0,0 +1,407 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from main import app
+from app.routers.advice import get_gemini_service
+from app.services.metrics import TURNS_TO_QUOTE
+
+
+class FakeGeminiService:
+    """Sustituto de GeminiService que responde sin ir a la red"""
+
+    def __init__(self, responses=None):
+        self.responses = responses or {}
+        self.calls = []
+
+    async def extract_slots(self, user_text: str, expected_field=None):
+        self.calls.append(user_text)
+        if user_text == "falla":
+            raise RuntimeError("error de extracción")
+        return dict(self.responses.get(user_text, {}))
+
+    async def stream_extract_slots(self, user_text: str, expected_field=None):
+        extracted = await self.extract_slots(user_text, expected_field)
+        for key, value in extracted.items():
+            yield "partial", {key: value}
+        yield "final", extracted
+
+
+FULL_PROFILE = {
+    "vehicle_year": 2018, "vehicle_make": "Kia", "vehicle_model": "Rio",
+    "vehicle_value_usd": 12000.0, "usage": "particular", "city": "Guayaquil",
+    "driver_age": 28, "claims_last3y": 0, "anti_theft": True, "garage_overnight": False,
+    "deductible_pct": 10, "addons": ["asistencia_vial"],
+}
+
+fake_gemini = FakeGeminiService({
+    "perfil completo": FULL_PROFILE,
+    "kia rio": {"vehicle_make": "Kia", "vehicle_model": "Rio"},
+    "2018": {"vehicle_year": 2018},
+})
+client = TestClient(app)
+
+
+@pytest.fixture(autouse=True, scope="module")
+def override_gemini():
+    """Usa fake_gemini solo mientras corren los tests de este módulo"""
+    app.dependency_overrides[get_gemini_service] = lambda: fake_gemini
+    yield
+    app.dependency_overrides.pop(get_gemini_service, None)
+
+
+def test_start_returns_session():
+    """
+    Test para iniciar una sesión de asesoría
+    """
+    response = client.post("/advice/start")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["session_id"]
+    assert "asesor virtual" in data["message"]
+
+
+def test_reply_asks_for_missing_field():
+    """
+    Test para una respuesta sin datos: se pregunta el primer campo faltante
+    """
+    sid = client.post("/advice/start").json()["session_id"]
+    response = client.post("/advice/reply", json={"session_id": sid, "user_text": "hola"})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["session_id"] == sid
+    assert data["quote"] is None
+    assert "año" in data["message"]
+
+
+def test_reply_rejects_oversized_text():
+    """
+    Test para un mensaje más largo que el máximo: 422 en lugar de romper el guardado de la sesión
+    """
+    sid = client.post("/advice/start").json()["session_id"]
+    for text in ("2018", "Kia"):
+        client.post("/advice/reply", json={"session_id": sid, "user_text": text})
+    response = client.post("/advice/reply", json={"session_id": sid, "user_text": "x" * 70_000})
+    assert response.status_code == 422
+    response = client.post("/advice/reply", json={"session_id": sid, "user_text": "Rio"})
+    assert response.status_code == 200
+
+
+def test_reply_generates_quote():
+    """
+    Test para una respuesta con el perfil completo: se genera la cotización
+    """
+    sid = client.post("/advice/start").json()["session_id"]
+    response = client.post("/advice/reply", json={"session_id": sid, "user_text": "perfil completo"})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["state"]["vehicle_make"] == "Kia"
+    assert len(data["quote"]["offers"]) == 3
+    premiums = [o["annual_premium_usd"] for o in data["quote"]["offers"]]
+    assert premiums == sorted(premiums)
+
+
+def test_reply_without_gemini_returns_503():
+    """
+    Test para verificar que sin cliente de Gemini configurado se responde 503
+    """
+    app.dependency_overrides.pop(get_gemini_service)
+    try:
+        app.state.gemini_service = None
+        sid = client.post("/advice/start").json()["session_id"]
+        response = client.post("/advice/reply", json={"session_id": sid, "user_text": "hola"})
+        assert response.status_code == 503
+    finally:
+        app.dependency_overrides[get_gemini_service] = lambda: fake_gemini
+
+
+def test_reply_batch_keeps_order_per_session_and_isolates_errors():
+    """
+    Test para el endpoint por lotes: orden por sesión y errores aislados por mensaje
+    """
+    sid_a = client.post("/advice/start").json()["session_id"]
+    sid_b = client.post("/advice/start").json()["session_id"]
+    items = [
+        {"session_id": sid_a, "user_text": "kia rio"},
+        {"session_id": sid_b, "user_text": "falla"},
+        {"session_id": sid_a, "user_text": "2018"},
+        {"session_id": sid_b, "user_text": "perfil completo"},
+    ]
+    response = client.post("/advice/reply/batch", json={"items": items})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["index"] for r in results] == [0, 1, 2, 3]
+
+    assert results[1]["response"] is None
+    # El cliente recibe un código fijo, no el texto de la excepción
+    assert results[1]["error"] == "error"
+
+    # El segundo mensaje de la sesión A ve el estado que dejó el primero
+    state_a = results[2]["response"]["state"]
+    assert state_a["vehicle_make"] == "Kia"
+    assert state_a["vehicle_year"] == 2018
+    assert results[3]["response"]["quote"] is not None
+
+
+def test_reply_batch_rejects_oversized_batches():
+    """
+    Test para el límite de mensajes por lote
+    """
+    items = [{"session_id": "x", "user_text": "hola"}] * 501
+    response = client.post("/advice/reply/batch", json={"items": items})
+    assert response.status_code == 413
+
+
+def parse_sse(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_reply_stream_emits_partials_offers_and_final():
+    """
+    Test para el endpoint SSE: ack, extracción parcial, una oferta por evento y respuesta final
+    """
+    sid = client.post("/advice/start").json()["session_id"]
+    response = client.post("/advice/reply/stream", json={"session_id": sid, "user_text": "perfil completo"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(response.text)
+    names = [name for name, _ in events]
+    assert names[0] == "ack"
+    assert events[0][1] == {"session_id": sid}
+    assert names.count("partial") == len(FULL_PROFILE)
+    assert names.count("offer") == 3
+    assert names[-1] == "final"
+    assert events[-1][1]["quote"]["offers"][0] == events[names.index("offer")][1]
+
+
+def test_reply_stream_emits_next_question():
+    """
+    Test para el endpoint SSE cuando todavía faltan datos
+    """
+    sid = client.post("/advice/start").json()["session_id"]
+    response = client.post("/advice/reply/stream", json={"session_id": sid, "user_text": "kia rio"})
+    events = parse_sse(response.text)
+    assert [name for name, _ in events] == ["ack", "partial", "partial", "question", "final"]
+    assert "año" in events[3][1]["message"]
+
+
+def test_stateless_token_sessions_carry_state_between_turns():
+    """
+    Test para el backend sin estado: el session_id es un token que lleva el estado
+    """
+    from app.services.session_service import SessionService
+    from app.services.session_store import ShardedSessionStore, TokenSessionStore
+
+    SessionService.use_store(TokenSessionStore(ttl_seconds=3600, encrypt=True))
+    try:
+        token = client.post("/advice/start").json()["session_id"]
+        data = client.post("/advice/reply", json={"session_id": token, "user_text": "2018"}).json()
+        assert data["session_id"] != token
+        data = client.post("/advice/reply", json={"session_id": data["session_id"], "user_text": "kia rio"}).json()
+        assert data["state"]["vehicle_year"] == 2018
+        assert data["state"]["vehicle_make"] == "Kia"
+        assert len(SessionService().store) == 0
+    finally:
+        SessionService.use_store(ShardedSessionStore(ttl_seconds=3600))
+
+
+def test_metrics_expose_stage_latencies_and_turns_to_quote():
+    """
+    Test para /metrics: histogramas por etapa, turnos hasta cotizar y latencia por ruta
+    """
+    sid = client.post("/advice/start").json()["session_id"]
+    sid = client.post("/advice/reply", json={"session_id": sid, "user_text": "2018"}).json()["session_id"]
+    data = client.post("/advice/reply", json={"session_id": sid, "user_text": "perfil completo"}).json()
+    # Los turnos son metadato de la sesión, no parte del perfil que ve el cliente
+    assert data["quote"] is not None and "turns" not in data["state"]
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    for stage in ("session_lookup", "extraction", "state_merge", "quote", "serialization"):
+        assert f'advice_stage_seconds_count{{stage="{stage}"}}' in body
+    assert 'advice_turns_to_quote_bucket{le="2"}' in body
+
+    # Seguir conversando después de cotizar no vuelve a contar la sesión en turnos hasta cotizar
+    quoted = TURNS_TO_QUOTE.count()
+    data = client.post("/advice/reply", json={"session_id": data["session_id"], "user_text": "2018"}).json()
+    assert data["quote"] is not None
+    assert TURNS_TO_QUOTE.count() == quoted
+    assert 'http_request_duration_seconds_count{route="/advice/reply",method="POST"}' in body
+    assert "advice_sessions_count" in body
+
+
+def test_metrics_count_sql_sessions_off_the_event_loop(tmp_path):
+    """
+    Test para /metrics con el backend SQL: el conteo de sesiones corre en un hilo, no en el event loop
+    """
+    import asyncio
+
+    from app.services.session_service import SessionService
+    from app.services.session_store import ShardedSessionStore, SQLSessionStore
+
+    def in_event_loop():
+        try:
+            asyncio.get_running_loop()
+            return True
+        except RuntimeError:
+            return False
+
+    store = SQLSessionStore(ttl_seconds=3600, url=f"sqlite:///{tmp_path / 'sessions.db'}")
+    stats, calls = store.stats, []
+    store.stats = lambda: calls.append(in_event_loop()) or stats()
+    SessionService.use_store(store)
+    try:
+        client.post("/advice/start")
+        assert "advice_sessions_count 1" in client.get("/metrics").text
+        assert calls and not any(calls)
+    finally:
+        SessionService.use_store(ShardedSessionStore(ttl_seconds=3600))
+
+
+def test_quote_batch_matches_scalar_pricing():
+    """
+    Test para /quotes/batch: primas vectorizadas iguales a QuoteService.price_formula
+    """
+    from app.schemas.quote import QuoteState
+    from app.services.quote_service import QuoteService
+    from app.services.tariff import TariffService
+
+    profiles = [
+        dict(FULL_PROFILE),
+        dict(FULL_PROFILE, city="Quito", driver_age=22, claims_last3y=2, usage="comercial",
+             anti_theft=None, deductible_pct=None, addons=None, vehicle_value_usd=31999.99),
+        dict(FULL_PROFILE, city="Loja", driver_age=65, claims_last3y=1, garage_overnight=True,
+             deductible_pct=5, addons=["auto_reemplazo", "cobertura_lunas"], vehicle_value_usd=8000),
+        {"vehicle_year": 2018},
+    ]
+    response = client.post("/quotes/batch", json={"profiles": profiles})
+    assert response.status_code == 200
+    data = response.json()
+    carriers = TariffService.current().carriers
+    assert data["carriers"] == list(carriers)
+    assert data["tariff_version"] == TariffService.current().version
+
+    for item, profile in zip(data["results"][:3], profiles):
+        state = QuoteState(**profile)
+        expected = [QuoteService.price_formula(state, carriers[c][0]) for c in data["carriers"]]
+        assert item["premiums"] == expected
+        assert item["plan"] == QuoteService.plan_for_value(state.vehicle_value_usd)
+        assert item["best_carrier"] == QuoteService.aggregate_offers(state)[0].carrier
+    assert data["results"][3]["premiums"] is None
+    assert "vehicle_make" in data["results"][3]["error"]
+
+
+def test_sensitivity_grid_matches_price_formula():
+    """
+    Test para la grilla de sensibilidad: cada celda igual a price_formula con ese deducible y add-ons
+    """
+    from app.schemas.quote import QuoteState
+    from app.services.quote_service import QuoteService
+    from app.services.tariff import TariffService
+
+    sid = client.post("/advice/start").json()["session_id"]
+    sid = client.post("/advice/reply", json={"session_id": sid, "user_text": "perfil completo"}).json()["session_id"]
+    response = client.get(f"/quotes/grid/{sid}")
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["cells"]) == 4 * 8
+
+    carriers = TariffService.current().carriers
+    for cell in data["cells"]:
+        state = QuoteState(**dict(FULL_PROFILE, deductible_pct=cell["deductible_pct"], addons=cell["addons"]))
+        assert cell["premiums"] == [QuoteService.price_formula(state, carriers[c][0]) for c in data["carriers"]]
+
+    incomplete = client.post("/advice/start").json()["session_id"]
+    assert client.get(f"/quotes/grid/{incomplete}").status_code == 422
+    assert client.get("/quotes/grid/desconocida").status_code == 404
+
+
+def test_quote_batch_and_grid_match_generate_quote_with_products():
+    """
+    Test para /quotes/batch y la grilla con catálogo de productos: mismas primas que generate_quote
+    """
+    import yaml
+
+    from app.schemas.quote import QuoteState
+    from app.services.quote_service import QuoteService
+    from app.services.tariff import DEFAULT_TARIFF_PATH, Tariff, TariffService
+
+    with open(DEFAULT_TARIFF_PATH, encoding="utf-8") as f:
+        data = yaml.safe_load(f)
+    data["products"] = [
+        {"carrier": "Equinoccial", "plan": "Media", "name": "Equinoccial Urbano Quito", "min_value": 8000,
+         "max_value": 30000, "usages": ["particular"], "cities": ["Quito"], "deductible_pct": 15,
+         "addons": ["asistencia_vial"], "factor": 0.97},
+        {"carrier": "Aseguradora Andes", "plan": "Básica", "name": "Andes Básica", "max_value": 20000, "factor": 0.9},
+        {"carrier": "Aseguradora Andes", "plan": "Full", "name": "Andes Full"},
+        {"carrier": "Pacífica Seguros", "plan": "Media", "name": "Pacífica Costa", "cities": ["Guayaquil"],
+         "factor": 0.95},
+    ]
+    tariff = Tariff(data, "productos")
+    profiles = [
+        dict(FULL_PROFILE),
+        dict(FULL_PROFILE, city="Quito", deductible_pct=5, addons=["cobertura_lunas"]),
+        dict(FULL_PROFILE, city="Loja", usage="comercial", vehicle_value_usd=50000),
+    ]
+
+    def cheapest(state, carrier):
+        offers, _ = tariff.catalog.top_offers(state, tariff, limit=1, carrier=carrier)
+        return offers[0].annual_premium_usd if offers else None
+
+    TariffService.use(tariff)
+    try:
+        data = client.post("/quotes/batch", json={"profiles": profiles}).json()
+        for item, profile in zip(data["results"], profiles):
+            state = QuoteState(**profile)
+            assert item["premiums"] == [cheapest(state, c) for c in data["carriers"]]
+            best = QuoteService.generate_quote(state).offers[0]
+            assert item["best_carrier"] == best.carrier
+            assert item["plan"] == best.plan
+        assert None in data["results"][2]["premiums"]
+
+        sid = client.post("/advice/start").json()["session_id"]
+        sid = client.post("/advice/reply", json={"session_id": sid, "user_text": "perfil completo"}).json()["session_id"]
+        grid = client.get(f"/quotes/grid/{sid}").json()
+        for cell in grid["cells"]:
+            state = QuoteState(**dict(FULL_PROFILE, deductible_pct=cell["deductible_pct"], addons=cell["addons"]))
+            assert cell["premiums"] == [cheapest(state, c) for c in grid["carriers"]]
+    finally:
+        TariffService.configure(DEFAULT_TARIFF_PATH)
+
+
+def test_offers_page_is_paginated_and_sorted():
+    """
+    Test para las ofertas paginadas de una sesión: ordenadas por prima y con el total de elegibles
+    """
+    sid = client.post("/advice/start").json()["session_id"]
+    sid = client.post("/advice/reply", json={"session_id": sid, "user_text": "perfil completo"}).json()["session_id"]
+    first = client.get(f"/quotes/offers/{sid}", params={"page_size": 2}).json()
+    assert first["total"] == 3 and first["page"] == 1
+    second = client.get(f"/quotes/offers/{sid}", params={"page": 2, "page_size": 2}).json()
+    premiums = [o["annual_premium_usd"] for o in first["offers"] + second["offers"]]
+    assert len(premiums) == 3 and premiums == sorted(premiums)
+    assert client.get(f"/quotes/offers/{sid}", params={"page_size": 500}).status_code == 422
+    assert client.get("/quotes/offers/desconocida").status_code == 404
+
+
+def test_responses_are_serialized_with_pydantic_core():
+    """
+    Test para la serialización rápida: mismos bytes que model_dump_json y respuesta JSON por defecto en la app
+    """
+    from app.schemas.quote import QuoteState, ReplyResponse
+    from app.services.quote_service import QuoteService
+    from app.utils.responses import FastJSONResponse, json_response
+
+    state = QuoteState(**FULL_PROFILE)
+    model = ReplyResponse(session_id="s", message="ñandú", state=state, quote=QuoteService.generate_quote(state))
+    assert json_response(model).body == model.model_dump_json().encode()
+    assert app.router.default_response_class is FastJSONResponse
+
+    data = client.post("/advice/start").json()
+    assert data["session_id"] and "asesor virtual" in data["message"]
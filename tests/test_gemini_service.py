@@ -0,0 +1,395 @@
+import asyncio
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from app.core.config import get_settings
+from app.services import gemini_service as gemini_module
+from app.services.extraction_cache import ExtractionCache, SQLiteCacheBackend, normalize_text
+from app.services.gemini_service import FIELD_PROMPTS, SYSTEM_PROMPT, GeminiService
+from app.services.local_extractor import LocalSlotExtractor
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeStream:
+    """Respuesta en streaming: entrega el texto en trozos de pocos caracteres"""
+
+    def __init__(self, text, size=7):
+        self.chunks = [FakeResponse(text[i:i + size]) for i in range(0, len(text), size)]
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+class FakeModel:
+    """Modelo falso que cuenta las llamadas a generate_content_async"""
+
+    def __init__(self, text='{"usage": "particular"}'):
+        self.text = text
+        self.calls = 0
+
+    async def generate_content_async(self, parts, stream=False, **kwargs):
+        self.calls += 1
+        return FakeStream(self.text) if stream else FakeResponse(self.text)
+
+
+@pytest.fixture
+def gemini_service(monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    get_settings.cache_clear()
+    service = GeminiService()
+    service.model = FakeModel()
+    yield service
+    get_settings.cache_clear()
+
+
+def test_normalize_text_folds_case_accents_and_numbers():
+    """
+    Test para la forma canónica usada como clave de caché
+    """
+    assert normalize_text("  Sí. ") == normalize_text("si")
+    assert normalize_text("Diez por ciento") == normalize_text("10 %") == "10%"
+    assert normalize_text("doce mil dólares") == normalize_text("12.000 dolares")
+    assert normalize_text("28k") == normalize_text("28 mil") == "28000"
+
+
+def test_extract_slots_uses_cache_for_repeated_answers(gemini_service):
+    """
+    Test para verificar que respuestas equivalentes no vuelven a llamar a Gemini
+    """
+    first = asyncio.run(gemini_service.extract_slots("Particular"))
+    second = asyncio.run(gemini_service.extract_slots("  particular. "))
+    assert first == second
+    assert first["usage"] == "particular"
+    assert gemini_service.model.calls == 1
+    stats = gemini_service.cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_extract_slots_does_not_cache_errors(gemini_service):
+    """
+    Test para verificar que una respuesta inválida no queda en caché
+    """
+    gemini_service.model.text = "no es json"
+    assert asyncio.run(gemini_service.extract_slots("hola")) == LocalSlotExtractor.empty()
+    assert asyncio.run(gemini_service.extract_slots("hola")) == LocalSlotExtractor.empty()
+    assert gemini_service.model.calls == 2
+
+
+def test_cache_counts_evictions():
+    """
+    Test para el contador de desalojos por tamaño
+    """
+    cache = ExtractionCache(maxsize=2, ttl_seconds=60)
+
+    async def fill():
+        for text in ("a", "b", "c"):
+            await cache.set(cache.key(text), {"city": text})
+        return await cache.get(cache.key("a"))
+
+    assert asyncio.run(fill()) is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_shared_backend_is_reused_across_caches(tmp_path):
+    """
+    Test para el backend compartido: una entrada escrita por un worker la lee otro
+    """
+    path = str(tmp_path / "cache.db")
+    writer = ExtractionCache(backend=SQLiteCacheBackend(path))
+    reader = ExtractionCache(backend=SQLiteCacheBackend(path))
+
+    async def run():
+        await writer.set(writer.key("Quito"), {"city": "Quito"})
+        return await reader.get(reader.key("quito"))
+
+    assert asyncio.run(run()) == {"city": "Quito"}
+    assert reader.stats()["shared_hits"] == 1
+
+
+def test_sqlite_backend_prunes_expired_rows(tmp_path):
+    """
+    Test para el backend SQLite: las filas expiradas se borran periódicamente
+    """
+    backend = SQLiteCacheBackend(str(tmp_path / "cache.db"), prune_every=3)
+    backend.set("vieja-1", {"usage": "particular"}, ttl_seconds=-1)
+    backend.set("vieja-2", {"usage": "particular"}, ttl_seconds=-1)
+    backend.set("nueva", {"usage": "comercial"}, ttl_seconds=60)
+
+    rows = backend._conn().execute("SELECT key FROM extraction_cache").fetchall()
+    assert rows == [("nueva",)]
+    assert backend.get("nueva") == {"usage": "comercial"}
+
+
+@pytest.mark.parametrize("text, field, value", [
+    ("2018", "vehicle_year", 2018),
+    ("12 mil dólares", "vehicle_value_usd", 12000.0),
+    ("28k", "vehicle_value_usd", 28000.0),
+    ("tengo 45 años", "driver_age", 45),
+    ("ninguno", "claims_last3y", 0),
+    ("un choque", "claims_last3y", 1),
+    ("sí", "anti_theft", True),
+    ("no", "garage_overnight", False),
+    ("10 %", "deductible_pct", 10),
+    ("grúa y parabrisas", "addons", ["asistencia_vial", "cobertura_lunas"]),
+    ("ninguno", "addons", []),
+    ("Particular", "usage", "particular"),
+    ("Quito", "city", "Quito"),
+    ("vivo en gye", "city", "Guayaquil"),
+    ("Riobanba", "city", "Riobamba"),
+    ("Playas", "city", "Playas"),
+])
+def test_local_extractor_parses_short_answers(text, field, value):
+    """
+    Test para el extractor por reglas con respuestas cortas a la pregunta pendiente
+    """
+    extracted = LocalSlotExtractor.extract(text, expected_field=field)
+    assert set(extracted) == set(LocalSlotExtractor.empty())
+    assert extracted[field] == value
+    assert LocalSlotExtractor.resolves(extracted, text, field)
+
+
+@pytest.mark.parametrize("text, field, expected", [
+    ("sí tengo alarma, no tengo garaje", "anti_theft", {"anti_theft": True, "garage_overnight": False}),
+    ("sin choques, con alarma", "anti_theft", {"anti_theft": True, "claims_last3y": 0}),
+    ("no tiene alarma pero duerme en garaje", "garage_overnight", {"anti_theft": False, "garage_overnight": True}),
+    ("tengo un toyota", "claims_last3y", {"claims_last3y": None, "vehicle_make": "Toyota"}),
+    ("es una camioneta de la sierra", "claims_last3y", {"claims_last3y": None}),
+    ("uso particular", "vehicle_model", {"vehicle_model": None, "usage": "particular"}),
+    ("Gol", "vehicle_model", {"vehicle_model": "Gol"}),
+    ("un choque en 2021", "claims_last3y", {"claims_last3y": 1, "vehicle_year": None}),
+    ("nací en 1990", "driver_age", {"vehicle_year": None}),
+    ("desde 2019 en Quito", "city", {"city": "Quito", "vehicle_year": None}),
+    ("un Kia Rio 2018", "vehicle_make", {"vehicle_make": "Kia", "vehicle_year": 2018}),
+    ("no sé", "anti_theft", {"anti_theft": None}),
+    ("no estoy seguro", "garage_overnight", {"garage_overnight": None}),
+    ("no sé, creo que sí", "garage_overnight", {"garage_overnight": None}),
+    ("no sé si tiene alarma", "anti_theft", {"anti_theft": None}),
+    ("no tiene", "anti_theft", {"anti_theft": False}),
+])
+def test_local_extractor_does_not_misread_mixed_answers(text, field, expected):
+    """
+    Test para negaciones y números sueltos que no corresponden al campo preguntado
+    """
+    extracted = LocalSlotExtractor.extract(text, expected_field=field)
+    assert {k: extracted[k] for k in expected} == expected
+
+
+def test_gemini_nulls_are_filled_locally_only_for_the_expected_field(gemini_service):
+    """
+    Test para la mezcla con lo local: un null de Gemini solo se completa en el campo preguntado
+    """
+    gemini_service.model = FakeModel('{"claims_last3y": null, "vehicle_year": null, "usage": null}')
+    text = "tuve un choque en 2021 con el carro particular, nada grave la verdad"
+    extracted = asyncio.run(gemini_service.extract_slots(text, expected_field="claims_last3y"))
+    assert gemini_service.model.calls == 1
+    assert extracted["claims_last3y"] == 1
+    assert extracted["vehicle_year"] is None
+    assert extracted["usage"] is None
+
+
+def test_extract_slots_skips_gemini_when_local_parser_resolves(gemini_service):
+    """
+    Test para verificar que una respuesta corta resuelta localmente no llama a Gemini
+    """
+    extracted = asyncio.run(gemini_service.extract_slots("32 años", expected_field="driver_age"))
+    assert extracted["driver_age"] == 32
+    assert gemini_service.model.calls == 0
+    assert gemini_service.local_hits == 1
+
+
+def test_extract_slots_uses_gemini_for_free_form_text(gemini_service):
+    """
+    Test para verificar que el texto libre sigue yendo a Gemini y se combina con lo local
+    """
+    text = "Tengo una Hilux 2021 que uso para trabajar, tiene alarma y todo"
+    extracted = asyncio.run(gemini_service.extract_slots(text, expected_field="vehicle_year"))
+    assert gemini_service.model.calls == 1
+    assert extracted["usage"] == "particular"
+    assert extracted["vehicle_year"] == 2021
+    assert extracted["vehicle_make"] == "Toyota"
+
+
+def test_single_pending_field_uses_compact_prompt(gemini_service):
+    """
+    Test para verificar que una respuesta corta a un campo pendiente usa el prompt de ese campo
+    """
+    field_model = FakeModel('{"vehicle_make": "Chevrolet", "city": "Quito"}')
+    gemini_service.field_models["vehicle_make"] = field_model
+    extracted = asyncio.run(gemini_service.extract_slots("un chevy", expected_field="vehicle_make"))
+    assert extracted["vehicle_make"] == "Chevrolet"
+    assert extracted["city"] is None
+    assert field_model.calls == 1
+    assert gemini_service.model.calls == 0
+    assert len(FIELD_PROMPTS["vehicle_make"]) < len(SYSTEM_PROMPT) / 3
+
+
+class SlowModel(FakeModel):
+    """Modelo falso que tarda en responder, para forzar llamadas concurrentes"""
+
+    async def generate_content_async(self, parts, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return FakeResponse(self.text)
+
+
+def test_concurrent_identical_calls_are_coalesced(gemini_service):
+    """
+    Test para verificar que llamadas concurrentes idénticas comparten una sola petición
+    """
+    gemini_service.model = SlowModel('{"vehicle_make": "Kia", "vehicle_model": "Rio"}')
+    text = "Hola, quiero cotizar mi Kia Rio con el descuento de la campaña de hoy"
+
+    async def burst():
+        return await asyncio.gather(*(gemini_service.extract_slots(text) for _ in range(20)))
+
+    results = asyncio.run(burst())
+    assert gemini_service.model.calls == 1
+    assert all(r == results[0] for r in results)
+    assert results[0]["vehicle_model"] == "Rio"
+    assert gemini_service.single_flight.stats() == {"calls": 20, "coalesced": 19, "in_flight": 0}
+
+
+class FailingModel(FakeModel):
+    """Modelo falso que siempre falla"""
+
+    async def generate_content_async(self, parts, **kwargs):
+        self.calls += 1
+        raise ConnectionError("upstream caído")
+
+
+def test_slow_upstream_times_out_and_falls_back_to_local(gemini_service):
+    """
+    Test para el deadline por intento: Gemini lento se corta y se usa la extracción local
+    """
+    gemini_service.model = SlowModel()
+    gemini_service.timeout_seconds = 0.01
+    gemini_service.retry_backoff_seconds = 0
+    text = "Es un Kia Rio que uso para el taxi en Quito y quiero cotizar"
+    extracted = asyncio.run(gemini_service.extract_slots(text))
+    assert extracted["city"] == "Quito"
+    assert extracted["usage"] == "comercial"
+    assert gemini_service.model.calls == gemini_service.max_retries + 1
+    upstream = gemini_service.stats()["upstream"]
+    assert upstream["timeouts"] == gemini_service.max_retries + 1
+    assert upstream["degraded"] == 1
+
+
+def test_circuit_breaker_opens_and_fails_fast(gemini_service):
+    """
+    Test para el circuit breaker: tras superar la tasa de error deja de llamar a Gemini
+    """
+    gemini_service.model = FailingModel()
+    gemini_service.retry_backoff_seconds = 0
+    gemini_service.max_retries = 0
+
+    async def run():
+        for i in range(gemini_service.breaker.min_calls + 5):
+            await gemini_service.extract_slots(f"mensaje largo número {i} sobre mi auto y su seguro")
+
+    asyncio.run(run())
+    assert gemini_service.model.calls == gemini_service.breaker.min_calls
+    assert gemini_service.breaker.state == "open"
+    assert gemini_service.stats()["upstream"]["errors"] == gemini_service.breaker.min_calls
+
+
+def test_hedged_request_after_p95(gemini_service):
+    """
+    Test para el hedging: si la primera petición supera el p95, responde la segunda
+    """
+    class FirstSlowModel(FakeModel):
+        async def generate_content_async(self, parts, **kwargs):
+            self.calls += 1
+            await asyncio.sleep(1.0 if self.calls == 1 else 0)
+            return FakeResponse(self.text)
+
+    gemini_service.model = FirstSlowModel()
+    gemini_service.hedge_enabled = True
+    gemini_service.hedge_min_samples = 5
+    for _ in range(5):
+        gemini_service.latency.record(0.01)
+
+    async def run():
+        started = asyncio.get_running_loop().time()
+        await gemini_service.extract_slots("un texto libre cualquiera para extraer datos del auto")
+        return asyncio.get_running_loop().time() - started
+
+    assert asyncio.run(run()) < 0.5
+    assert gemini_service.model.calls == 2
+    assert gemini_service.hedges == 1
+
+
+def test_stream_extract_slots_yields_fields_as_they_complete(gemini_service):
+    """
+    Test para la extracción en streaming: cada campo se emite en cuanto su valor está completo
+    """
+    gemini_service.model = FakeModel(
+        '{"vehicle_year": 2021, "vehicle_make": "Toyota", "vehicle_model": "Hilux", "city": null}'
+    )
+    text = "Trabajo con una camioneta del 2021 en la capital, es de las grandes"
+
+    async def run():
+        return [event async for event in gemini_service.stream_extract_slots(text)]
+
+    events = asyncio.run(run())
+    partials = [data for kind, data in events if kind == "partial"]
+    # Sin marca ni modelo, el año lo aporta Gemini y no las reglas locales
+    assert partials[0] == {"usage": "comercial"}
+    assert {"vehicle_year": 2021} in partials
+    assert {"vehicle_make": "Toyota"} in partials
+    assert {"vehicle_model": "Hilux"} in partials
+    kind, final = events[-1]
+    assert kind == "final"
+    assert final["vehicle_model"] == "Hilux"
+    assert final["usage"] == "comercial"
+    assert gemini_service.cache.stats()["size"] == 1
+
+
+class ExpiredCacheModel(FakeModel):
+    """Modelo falso ligado a una caché de contexto que ya expiró"""
+
+    async def generate_content_async(self, parts, **kwargs):
+        self.calls += 1
+        raise google_exceptions.NotFound("CachedContent not found")
+
+
+class ExpiredCachedContent:
+    def update(self, ttl=None):
+        raise google_exceptions.NotFound("CachedContent not found")
+
+
+def test_expired_context_cache_falls_back_to_full_prefix(gemini_service, monkeypatch):
+    """
+    Test para la caché de contexto: si expira se reintenta con el prefijo completo y se intenta recrear
+    """
+    full_model = FakeModel('{"vehicle_make": "Kia"}')
+    gemini_service._full_model = full_model
+    gemini_service.model = ExpiredCacheModel()
+    gemini_service._context_cache = ExpiredCachedContent()
+    gemini_service._prefix_parts = []
+    gemini_service.max_retries = 0
+
+    text = "Quiero cotizar el carro de mi esposa, es de los coreanos pequeños"
+    extracted = asyncio.run(gemini_service.extract_slots(text))
+    assert extracted["vehicle_make"] == "Kia"
+    assert full_model.calls == 1
+    assert gemini_service.model is full_model
+    assert gemini_service._prefix_parts == gemini_module.FEW_SHOT_PARTS
+    assert gemini_service.errors == 0
+    assert gemini_service.breaker.stats()["window_failures"] == 0
+
+    # La renovación periódica recrea la caché; si no se puede, sigue con el prefijo completo
+    def fail_create(**kwargs):
+        raise google_exceptions.PermissionDenied("sin permiso")
+
+    monkeypatch.setattr(gemini_module.caching.CachedContent, "create", fail_create)
+    gemini_service._context_cache = ExpiredCachedContent()
+    gemini_service.refresh_context_cache()
+    assert gemini_service._context_cache is None
+    assert gemini_service.model is full_model
@@ -0,0 +1,319 @@
+import os
+import time
+
+import pytest
+import yaml
+
+from app.schemas.quote import QuoteState
+from app.services.gazetteer import Gazetteer
+from app.services.quote_service import QuoteService
+from app.services.tariff import DEFAULT_TARIFF_PATH, Tariff, TariffService
+
+
+PROFILE = QuoteState(
+    vehicle_year=2018, vehicle_make="Kia", vehicle_model="Rio", vehicle_value_usd=12000.0,
+    usage="particular", city="Guayaquil", driver_age=28, claims_last3y=0,
+    anti_theft=True, garage_overnight=False, deductible_pct=10, addons=["asistencia_vial"],
+)
+
+
+def test_quote_records_tariff_version_and_hot_reloads(tmp_path):
+    """
+    Test para la tarifa en archivo: versión en la cotización y recarga en caliente
+    """
+    with open(DEFAULT_TARIFF_PATH, encoding="utf-8") as f:
+        data = yaml.safe_load(f)
+    path = tmp_path / "tariff.yaml"
+    path.write_text(yaml.safe_dump(data, allow_unicode=True), encoding="utf-8")
+
+    try:
+        TariffService.configure(str(path))
+        before = QuoteService.generate_quote(PROFILE)
+        assert before.tariff_version == data["version"]
+        assert not TariffService.reload_if_changed()
+
+        data["version"] = "2099.1"
+        data["carriers"][0]["bias"] = 2.0
+        path.write_text(yaml.safe_dump(data, allow_unicode=True), encoding="utf-8")
+        assert TariffService.reload_if_changed()
+        after = QuoteService.generate_quote(PROFILE)
+        assert after.tariff_version == "2099.1"
+        andes = {o.carrier: o.annual_premium_usd for o in after.offers}["Aseguradora Andes"]
+        assert andes > {o.carrier: o.annual_premium_usd for o in before.offers}["Aseguradora Andes"]
+
+        # Contenido nuevo con la misma versión declarada: la caché no sirve la prima anterior
+        data["carriers"][0]["bias"] = 3.0
+        path.write_text(yaml.safe_dump(data, allow_unicode=True), encoding="utf-8")
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 1_000_000_000))
+        assert TariffService.reload_if_changed()
+        same_version = QuoteService.generate_quote(PROFILE)
+        assert same_version.tariff_version == "2099.1"
+        assert {o.carrier: o.annual_premium_usd for o in same_version.offers}["Aseguradora Andes"] > andes
+
+        # Una tarifa inválida no reemplaza a la vigente
+        path.write_text("version: roto\ncarriers: []\n", encoding="utf-8")
+        assert not TariffService.reload_if_changed()
+        assert QuoteService.generate_quote(PROFILE).tariff_version == "2099.1"
+    finally:
+        TariffService.configure(DEFAULT_TARIFF_PATH)
+
+
+def test_compiled_tariff_matches_original_factors():
+    """
+    Test para las tablas compiladas: mismos factores que las reglas originales
+    """
+    tariff = TariffService.current()
+    assert [tariff.age_factor(a) for a in (16, 24, 25, 60, 61, 90)] == [1.20, 1.20, 1.00, 1.00, 1.10, 1.10]
+    assert [tariff.claims_factor(n) for n in (0, 1, 2, 7)] == [0.90, 1.10, 1.25, 1.25]
+    assert tariff.security_factor(True, True) == 1.0 * 0.95 * 0.95
+    assert tariff.location_factor("Guayaquil norte") == 1.12
+    assert tariff.location_factor(None) == 0.98
+    assert [tariff.plan_for_value(v) for v in (11999, 12000, 25000)] == ["Básica", "Media", "Full"]
+    assert tariff.deductible_factor(None) == tariff.deductible_factor(10) == 1.00
+
+
+def test_gazetteer_resolves_aliases_typos_and_province_rules():
+    """
+    Test para el nomenclátor: alias, typos y nombres compuestos resuelven a la ciudad canónica
+    """
+    gazetteer = Gazetteer.default()
+    resolved = {text: gazetteer.canonical(text) for text in (
+        "Gye", "Guayaquil, Samborondón", "Cuenca del Azuay", "Guayaqil", "Portovejo", "Nueva Loja", "Lago Agrio",
+    )}
+    assert resolved == {
+        "Gye": "Guayaquil", "Guayaquil, Samborondón": "Guayaquil", "Cuenca del Azuay": "Cuenca",
+        "Guayaqil": "Guayaquil", "Portovejo": "Portoviejo", "Nueva Loja": "Nueva Loja", "Lago Agrio": "Nueva Loja",
+    }
+    assert gazetteer.resolve("hola") is None
+    # Una palabra de un nombre más largo no se corrige hacia otra ciudad ("santa" -> "manta")
+    assert [gazetteer.canonical(t) for t in ("vivo en Santa Cruz", "Santa Lucía", "Galápagos, Santa Cruz")] == [
+        "Puerto Ayora", "Santa Lucía", "Puerto Ayora",
+    ]
+    assert gazetteer.resolve("vivo en Santa Prisca") is None
+    assert gazetteer.canonical("vivo en Riobanba") == "Riobamba"
+    assert gazetteer.find("voy a la playa", strict=True) is None
+
+    with open(DEFAULT_TARIFF_PATH, encoding="utf-8") as f:
+        data = yaml.safe_load(f)
+    data["location"]["provinces"] = [{"match": "Guayas", "factor": 1.05}]
+    tariff = Tariff(data, "provincias", gazetteer)
+    assert tariff.location_factor("Gye") == tariff.location_factor("guayaqil") == 1.12
+    assert tariff.location_factor("Samborondón") == 1.05
+    assert tariff.location_factor("Loja") == tariff.location_factor("Villa Desconocida") == 0.98
+    # Texto fuera del nomenclátor: reglas por subcadena, como antes
+    assert tariff.location_factor("Urbanización guayaquileña") == 1.12
+
+
+def test_city_memos_count_every_lookup_and_evict_least_recent():
+    """
+    Test para las memoizaciones de ciudad: cada resolución cuenta en la métrica y al llenarse se
+    descartan las grafías menos recientes en lugar de dejar de memoizar
+    """
+    from app.services.gazetteer import CITY_LOOKUPS
+
+    gazetteer = Gazetteer.default()
+    before = CITY_LOOKUPS.value("resolved")
+    for _ in range(3):
+        gazetteer.resolve("Gye")
+    assert CITY_LOOKUPS.value("resolved") == before + 3
+
+    tariff = TariffService.current()
+    for cached, lookup in (
+        (gazetteer._resolve_cached, gazetteer.resolve),
+        (tariff._location_cached, tariff.location_factor),
+        (tariff.catalog._city_scope_cached, tariff.catalog.city_scope),
+    ):
+        maxsize = cached.cache_info().maxsize
+        for i in range(maxsize + 10):
+            lookup(f"barrio {i}")
+        # Una grafía nueva se memoiza aunque la caché esté llena; la más vieja sale
+        lookup("Guayaquil norte")
+        hits = cached.cache_info().hits
+        lookup("Guayaquil norte")
+        assert cached.cache_info().hits == hits + 1
+        assert cached.cache_info().currsize == maxsize
+        lookup("barrio 0")
+        assert cached.cache_info().hits == hits + 1
+
+
+def test_carrier_fan_out_returns_offers_within_budget():
+    """
+    Test para el fan-out a aseguradoras: latencia acotada y aseguradoras tardías o caídas reportadas
+    """
+    import asyncio
+    import time
+
+    from app.services.carrier_adapters import CarrierRegistry, LocalCarrierAdapter
+    from app.services.quote_service import QUOTE_CACHE
+
+    QUOTE_CACHE.clear()
+    CarrierRegistry.register(LocalCarrierAdapter("Aseguradora Andes", timeout_seconds=5, latency_seconds=1.0))
+    CarrierRegistry.register(LocalCarrierAdapter("Pacífica Seguros", latency_seconds=0.05, failure_rate=1.0))
+    CarrierRegistry.register(LocalCarrierAdapter("Equinoccial", latency_seconds=0.1))
+    try:
+        start = time.perf_counter()
+        result = asyncio.run(QuoteService.generate_quote_async(PROFILE, budget_seconds=0.3))
+        elapsed = time.perf_counter() - start
+    finally:
+        for name in ("Aseguradora Andes", "Pacífica Seguros", "Equinoccial"):
+            CarrierRegistry.unregister(name)
+
+    assert elapsed < 0.6
+    assert [o.carrier for o in result.offers] == ["Equinoccial"]
+    failures = {f.carrier: f.error for f in result.failed_carriers}
+    assert failures == {"Aseguradora Andes": "timeout", "Pacífica Seguros": "error"}
+    assert "Equinoccial" in result.recommendation
+
+
+def test_quote_cache_reuses_equivalent_profiles():
+    """
+    Test para la caché de cotizaciones: perfiles con los mismos factores comparten resultado
+    """
+    import asyncio
+
+    from app.services.quote_service import QUOTE_CACHE
+
+    QUOTE_CACHE.clear()
+    hits = QUOTE_CACHE.hits
+    first = QuoteService.generate_quote(PROFILE)
+    # Otro modelo, otra ciudad con el mismo factor y otra edad de la misma banda: mismo precio
+    same = PROFILE.model_copy(update={"vehicle_model": "Picanto", "city": "guayaquil centro", "driver_age": 45})
+    assert QuoteService.generate_quote(same) is first
+    assert asyncio.run(QuoteService.generate_quote_async(same)) is first
+    assert QUOTE_CACHE.hits == hits + 2
+
+    other = PROFILE.model_copy(update={"driver_age": 22})
+    assert QuoteService.generate_quote(other) is not first
+    assert QUOTE_CACHE.stats()["size"] == 2
+
+    # Con un adaptador remoto registrado, el fan-out no reutiliza la cotización local (ni al revés)
+    from app.services.carrier_adapters import CarrierRegistry, LocalCarrierAdapter
+
+    CarrierRegistry.register(LocalCarrierAdapter("Aseguradora Remota"))
+    try:
+        remote = asyncio.run(QuoteService.generate_quote_async(same))
+    finally:
+        CarrierRegistry.unregister("Aseguradora Remota")
+    assert remote is not first
+    assert QuoteService.generate_quote(same) is first
+
+
+def test_product_catalog_prices_only_eligible_products_and_paginates():
+    """
+    Test para el catálogo de productos: solo elegibles, top-k igual al orden completo y paginación
+    """
+    import random
+
+    with open(DEFAULT_TARIFF_PATH, encoding="utf-8") as f:
+        data = yaml.safe_load(f)
+    rng = random.Random(7)
+    carriers = [c["name"] for c in data["carriers"]]
+    data["products"] = [
+        {
+            "carrier": rng.choice(carriers), "plan": rng.choice(["Básica", "Media", "Full"]),
+            "name": f"P{i}", "min_value": rng.choice([0, 5000, 10000]),
+            "max_value": rng.choice([None, 15000, 40000]),
+            "usages": rng.choice([None, ["particular"], ["comercial"]]),
+            "cities": rng.choice([None, None, ["Quito"], ["Guayaquil", "Cuenca"]]),
+            "deductible_pct": rng.choice([None, 5, 20]), "factor": rng.uniform(0.8, 1.2),
+        }
+        for i in range(3000)
+    ]
+    tariff = Tariff(data, "catalogo")
+    catalog = tariff.catalog
+    products = {p.name: p for p in catalog.products}
+
+    offers, total = catalog.top_offers(PROFILE, tariff, limit=5)
+    eligible = [
+        p for p in catalog.products
+        if p.min_value <= 12000 and (p.max_value is None or 12000 < p.max_value)
+        and "particular" in p.usages and (p.cities is None or "guayaquil" in p.cities)
+    ]
+    assert total == len(eligible)
+    assert all(products[o.product] in eligible for o in offers)
+
+    everything, _ = catalog.top_offers(PROFILE, tariff)
+    premiums = [o.annual_premium_usd for o in everything]
+    assert premiums == sorted(premiums) and len(everything) == total
+    assert offers == everything[:5]
+    page, _ = catalog.top_offers(PROFILE, tariff, offset=10, limit=10)
+    assert page == everything[10:20]
+    assert catalog.top_offers(PROFILE, tariff, offset=total)[0] == []
+
+
+def test_default_catalog_matches_carrier_formula():
+    """
+    Test para el catálogo por defecto: una oferta por aseguradora, igual a carrier_offer
+    """
+    tariff = TariffService.current()
+    for value in (8000.0, 12000.0, 30000.0):
+        state = PROFILE.model_copy(update={"vehicle_value_usd": value})
+        expected = sorted(
+            (QuoteService.carrier_offer(state, c, tariff) for c in tariff.carriers),
+            key=lambda o: o.annual_premium_usd
+        )
+        offers = QuoteService.aggregate_offers(state, tariff)
+        assert [o.model_dump(exclude={"product"}) for o in offers] == [o.model_dump(exclude={"product"}) for o in expected]
+
+
+def test_recommendation_hint_follows_tariff_carriers():
+    """
+    Test para la sugerencia de add-ons: sale de la tarifa y sigue a las aseguradoras renombradas
+    """
+    with open(DEFAULT_TARIFF_PATH, encoding="utf-8") as f:
+        data = yaml.safe_load(f)
+    state = PROFILE.model_copy(update={"addons": ["cobertura_lunas"]})
+    tariff = Tariff(data, "test")
+    offers = QuoteService.aggregate_offers(state, tariff)
+    assert offers[0].carrier != "Pacífica Seguros"
+    assert "considera Pacífica Seguros si priorizas lunas" in QuoteService.recommend_text(state, offers, tariff)
+    assert "considera" not in QuoteService.recommend_text(PROFILE, offers, tariff)
+
+    for carrier in data["carriers"]:
+        carrier["name"] = carrier["name"].replace("Pacífica Seguros", "Pacífica Seguros S.A.")
+    renamed = Tariff(data, "renombrada")
+    offers = QuoteService.aggregate_offers(state, renamed)
+    assert "considera Pacífica Seguros S.A. si priorizas" in QuoteService.recommend_text(state, offers, renamed)
+
+    data["carriers"][0]["strengths"] = ["polarizado"]
+    with pytest.raises(ValueError):
+        Tariff(data, "rota")
+
+
+def test_bulk_repricing_streams_offers_and_reports_rejects(tmp_path):
+    """
+    Test para la recotización masiva: mismas ofertas que generate_quote, en orden y con filas rechazadas
+    """
+    import csv
+    import json
+
+    from app.services.repricing_service import RepricingService
+
+    columns = ["vehicle_year", "vehicle_make", "vehicle_model", "vehicle_value_usd", "usage", "city",
+               "driver_age", "claims_last3y", "anti_theft", "garage_overnight", "deductible_pct", "addons"]
+    profiles = [
+        PROFILE.model_copy(update={"vehicle_value_usd": 5000.0 + 1000 * i, "driver_age": 20 + i})
+        for i in range(7)
+    ]
+    source = tmp_path / "cartera.csv"
+    with open(source, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for i, p in enumerate(profiles):
+            writer.writerow([getattr(p, c) if c != "addons" else ";".join(p.addons) for c in columns])
+            if i == 2:
+                writer.writerow(["2018", "Kia", "Rio", "9000", "particular", "Quito", "12", "0", "", "", "", ""])
+                writer.writerow(["2018", "Kia", "", "9000", "particular", "Quito", "30", "0", "", "", "", ""])
+
+    for workers in (0, 1):
+        output = tmp_path / f"ofertas{workers}.jsonl"
+        rejects = tmp_path / f"rechazadas{workers}.jsonl"
+        stats = RepricingService.run(str(source), str(output), str(rejects), workers=workers, chunk_size=3)
+        assert (stats["rows"], stats["priced"], stats["rejected"]) == (9, 7, 2)
+
+        lines = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+        assert [line["row"] for line in lines] == [1, 2, 3, 6, 7, 8, 9]
+        for line, profile in zip(lines, profiles):
+            assert line["offers"] == [o.model_dump() for o in QuoteService.generate_quote(profile).offers]
+        errors = {r["row"]: r["error"] for r in map(json.loads, rejects.read_text(encoding="utf-8").splitlines())}
+        assert "driver_age" in errors[4] and errors[5] == "Faltan campos: vehicle_model"
@@ -0,0 +1,304 @@
+import os
+import threading
+import time
+
+import pytest
+
+from app.schemas.quote import MAX_FIELD_LENGTH, QuoteState
+from app.services.session_store import InMemorySessionStore, SQLSessionStore, ShardedSessionStore
+from app.services.state_codec import pack_state, unpack_session, unpack_state
+
+
+@pytest.fixture(params=["memory", "sharded", "sql"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return InMemorySessionStore(ttl_seconds=60)
+    if request.param == "sharded":
+        return ShardedSessionStore(ttl_seconds=60, shards=4)
+    return SQLSessionStore(ttl_seconds=60, url=f"sqlite:///{tmp_path / 'sessions.db'}", batch_size=3)
+
+
+def test_store_put_get_and_expiry(store):
+    """
+    Test para guardar, leer y expirar sesiones en cada backend
+    """
+    store.put("a", QuoteState(city="Quito"), now=1000.0)
+    assert store.get("a", now=1010.0)["state"].city == "Quito"
+    assert store.get("a", now=1061.0) is None
+    assert store.get("desconocida", now=1010.0) is None
+
+
+def test_store_prune_removes_only_expired(store):
+    """
+    Test para la limpieza de sesiones expiradas
+    """
+    store.put("vieja", QuoteState(), now=1000.0)
+    store.put("nueva", QuoteState(), now=1050.0)
+    store.flush()
+    assert store.prune(now=1080.0) == 1
+    assert store.get("vieja", now=1080.0) is None
+    assert store.get("nueva", now=1080.0) is not None
+
+
+def test_sql_store_batches_writes_and_shares_across_processes(tmp_path):
+    """
+    Test para el backend SQL: escrituras en lote visibles para otro worker tras el flush
+    """
+    url = f"sqlite:///{tmp_path / 'sessions.db'}"
+    worker_a = SQLSessionStore(ttl_seconds=3600, url=url, batch_size=100, flush_interval=3600)
+    worker_b = SQLSessionStore(ttl_seconds=3600, url=url, batch_size=100, flush_interval=3600)
+    now = time.time()
+
+    worker_a.put("s1", QuoteState(vehicle_make="Kia", addons=["cobertura_lunas"]), now=now)
+    # Pendiente: visible en el mismo proceso, todavía no en la base
+    assert worker_a.get("s1", now=now)["state"].vehicle_make == "Kia"
+    assert worker_b.get("s1", now=now) is None
+
+    worker_a.flush()
+    state = worker_b.get("s1", now=now)["state"]
+    assert state.vehicle_make == "Kia"
+    assert state.addons == ["cobertura_lunas"]
+    assert len(worker_b) == 1
+
+    with worker_a.engine.connect() as conn:
+        mode = conn.exec_driver_sql("PRAGMA journal_mode").scalar()
+    assert mode == "wal"
+
+
+def test_sql_store_flush_under_concurrent_writes(tmp_path):
+    """
+    Test para escrituras concurrentes desde varios hilos sobre el backend SQL
+    """
+    store = SQLSessionStore(ttl_seconds=3600, url=f"sqlite:///{tmp_path / 'sessions.db'}", batch_size=10)
+
+    def write(prefix):
+        for i in range(50):
+            store.put(f"{prefix}-{i}", QuoteState(driver_age=30), now=1e12)
+
+    threads = [threading.Thread(target=write, args=(p,)) for p in "abcd"]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    store.flush()
+    assert all(store.get(f"{p}-{i}", now=1e12) for p in "abcd" for i in range(50))
+
+
+def test_sql_store_failed_flush_does_not_break_requests(tmp_path):
+    """
+    Test para un lote fallido: la request no falla y la escritura queda pendiente para reintentar
+    """
+    store = SQLSessionStore(ttl_seconds=3600, url=f"sqlite:///{tmp_path / 'sessions.db'}", batch_size=1)
+    with store.engine.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE advice_sessions")
+
+    store.put("s1", QuoteState(city="Quito"), now=1e12)
+    assert store.get("s1", now=1e12)["state"].city == "Quito"
+    with pytest.raises(Exception):
+        store.flush()
+    assert store.blocking_io
+
+
+def test_memory_prune_only_visits_expired_sessions():
+    """
+    Test para la limpieza O(expiradas): una sesión actualizada pasa al final y no se elimina
+    """
+    store = InMemorySessionStore(ttl_seconds=60, prune_batch=2)
+    for i in range(5):
+        store.put(f"s{i}", QuoteState(), now=1000.0 + i)
+    # s0 se vuelve a usar: deja de ser la más antigua
+    store.put("s0", QuoteState(), now=1050.0)
+
+    assert store.prune(now=1063.5) == 2
+    assert store.prune(now=1063.5) == 1
+    assert store.prune(now=1063.5) == 0
+    assert list(store.sessions) == ["s4", "s0"]
+
+
+def test_state_codec_round_trip():
+    """
+    Test para la codificación compacta de QuoteState
+    """
+    full = QuoteState(
+        vehicle_year=2018, vehicle_make="Kia", vehicle_model="Río", vehicle_value_usd=12000.5,
+        usage="comercial", city="Guayaquil", driver_age=28, claims_last3y=0, anti_theft=False,
+        garage_overnight=True, deductible_pct=15, addons=["asistencia_vial", "cobertura_lunas"],
+    )
+    for state in (full, QuoteState(), QuoteState(addons=[], claims_last3y=0)):
+        packed = pack_state(state)
+        assert unpack_state(packed) == state
+    assert len(pack_state(full)) < 64
+
+    # Los textos del perfil se acotan al validar; uno sin validar y demasiado largo se rechaza explícitamente
+    assert len(QuoteState(vehicle_model="x" * 70_000).vehicle_model) == MAX_FIELD_LENGTH
+    with pytest.raises(ValueError):
+        pack_state(QuoteState.model_construct(vehicle_model="x" * 70_000))
+
+
+def test_memory_store_caps_sessions_with_lru_eviction():
+    """
+    Test para el tope de sesiones: se desaloja la menos usada y se reporta la memoria
+    """
+    store = InMemorySessionStore(ttl_seconds=60, max_sessions=3)
+    for i in range(3):
+        store.put(f"s{i}", QuoteState(city="Quito"), now=1000.0 + i)
+    store.put("s0", QuoteState(city="Cuenca"), now=1010.0)
+    store.put("s3", QuoteState(), now=1011.0)
+
+    assert len(store) == 3
+    assert store.get("s1", now=1011.0) is None
+    assert store.get("s0", now=1011.0)["state"].city == "Cuenca"
+    stats = store.stats()
+    assert stats["evictions"] == 1
+    assert stats["memory_bytes"] == sum(r.nbytes for r in store.sessions.values())
+
+    by_bytes = InMemorySessionStore(ttl_seconds=60, max_bytes=stats["memory_bytes"])
+    for i in range(5):
+        by_bytes.put(f"s{i}", QuoteState(city="Quito"), now=1000.0 + i)
+    assert by_bytes.memory_bytes <= stats["memory_bytes"]
+    assert by_bytes.evictions > 0
+
+
+def test_store_compare_and_set_rejects_stale_version(store):
+    """
+    Test para compare-and-set: una versión vieja no sobrescribe la escritura de otro
+    """
+    data, created = store.get_or_create("s", QuoteState(), now=1000.0)
+    assert created
+    assert store.get_or_create("s", QuoteState(city="Loja"), now=1000.0)[1] is False
+
+    assert store.compare_and_set("s", QuoteState(city="Quito"), data["version"], now=1001.0)
+    assert not store.compare_and_set("s", QuoteState(city="Cuenca"), data["version"], now=1002.0)
+    store.flush()
+    latest = store.get("s", now=1003.0)
+    assert latest["state"].city == "Quito"
+    # Tras el flush la versión se conserva y el CAS se resuelve contra la base
+    assert store.compare_and_set("s", QuoteState(city="Ambato"), latest["version"], now=1004.0)
+    assert store.get("s", now=1005.0)["state"].city == "Ambato"
+
+
+def test_concurrent_turns_on_same_session_lose_no_fields(tmp_path):
+    """
+    Test para turnos concurrentes sobre la misma sesión: cada campo sobrevive al CAS
+    """
+    from app.services.conversation_service import ConversationService
+    from app.services.session_service import SessionService
+
+    session_service = SessionService()
+    previous = session_service.store
+    SessionService.use_store(ShardedSessionStore(ttl_seconds=3600, shards=4))
+    try:
+        sid, _, _, _ = ConversationService.load_state(session_service, "desconocida")
+        fields = [
+            {"city": "Quito"}, {"driver_age": 30}, {"claims_last3y": 0}, {"vehicle_year": 2018},
+            {"vehicle_make": "Kia"}, {"vehicle_model": "Rio"}, {"usage": "particular"}, {"deductible_pct": 10},
+        ]
+
+        def turn(extracted):
+            _, state, version, turns = ConversationService.load_state(session_service, sid)
+            ConversationService.save_state(session_service, sid, state, version, extracted, None, turns)
+
+        threads = [threading.Thread(target=turn, args=(f,)) for f in fields]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        session = session_service.get_session(sid)
+        assert session["turns"] == len(fields)
+        state = session["state"]
+        for extracted in fields:
+            for key, value in extracted.items():
+                assert getattr(state, key) == value
+    finally:
+        SessionService.use_store(previous)
+
+
+def test_sql_store_compare_and_set_is_not_overwritten_by_a_later_flush(tmp_path):
+    """
+    Test para CAS entre workers: un lote pendiente no pisa lo que otro worker escribió con CAS
+    """
+    url = f"sqlite:///{tmp_path / 'sessions.db'}"
+    worker_a = SQLSessionStore(ttl_seconds=3600, url=url, batch_size=100, flush_interval=3600)
+    worker_b = SQLSessionStore(ttl_seconds=3600, url=url, batch_size=100, flush_interval=3600)
+    now = time.time()
+
+    data, _ = worker_a.get_or_create("s", QuoteState(), now=now)
+    # Sesión aún en el buffer de A: el CAS la escribe de inmediato y B la ve
+    assert worker_a.compare_and_set("s", QuoteState(city="Quito"), data["version"], now=now)
+    seen = worker_b.get("s", now=now)
+    assert seen["state"].city == "Quito"
+
+    assert worker_b.compare_and_set("s", QuoteState(city="Quito", driver_age=30), seen["version"], now=now)
+    assert not worker_a.compare_and_set("s", QuoteState(city="Cuenca"), seen["version"], now=now)
+    worker_a.flush()
+    assert worker_a.get("s", now=now)["state"].driver_age == 30
+
+
+def test_sharded_store_splits_caps_and_aggregates_stats():
+    """
+    Test para el backend por shards: límite repartido y estadísticas sumadas
+    """
+    store = ShardedSessionStore(ttl_seconds=3600, shards=4, max_sessions=40)
+    for i in range(100):
+        store.put(f"s{i}", QuoteState(), now=1000.0 + i)
+    stats = store.stats()
+    assert stats["shards"] == 4
+    assert stats["count"] == len(store) <= 40
+    assert stats["evictions"] == 100 - stats["count"]
+    assert store.get("s99", now=1100.0) is not None
+
+
+def test_token_store_validates_signature_expiry_and_rotated_keys():
+    """
+    Test para tokens de sesión: firma, expiración y rotación de claves
+    """
+    from app.services.session_store import TokenSessionStore
+
+    old = TokenSessionStore(ttl_seconds=60, keys=["clave-vieja"])
+    token = old.client_session_id("x", QuoteState(city="Quito", addons=[]), now=1000.0)
+    assert old.get(token, now=1030.0)["state"].city == "Quito"
+    assert old.get(token, now=1061.0) is None
+    assert old.get(token[:-2] + "xx", now=1030.0) is None
+
+    rotated = TokenSessionStore(ttl_seconds=60, keys=["clave-nueva", "clave-vieja"])
+    assert rotated.get(token, now=1030.0)["state"].city == "Quito"
+    assert TokenSessionStore(ttl_seconds=60, keys=["clave-nueva"]).get(token, now=1030.0) is None
+
+    encrypted = TokenSessionStore(ttl_seconds=60, encrypt=True, keys=["clave-nueva"])
+    secret = encrypted.client_session_id("x", QuoteState(city="Quito"), now=1000.0)
+    assert "Quito" not in secret
+    assert rotated.get(secret, now=1030.0)["state"].city == "Quito"
+
+
+def test_snapshot_restores_live_sessions_in_expiry_order(tmp_path):
+    """
+    Test para snapshot y restauración: solo sesiones vigentes, con el orden de expiración intacto
+    """
+    from app.services.session_snapshot import read_snapshot, write_snapshot
+
+    now = time.time()
+    before = ShardedSessionStore(ttl_seconds=60, shards=4)
+    for i in range(50):
+        before.put(f"s{i}", QuoteState(city="Quito", driver_age=20 + i % 50), now=now - 100 + i * 2)
+    path = str(tmp_path / "sessions.snap")
+    assert write_snapshot(path, before.snapshot_items()) == 50
+
+    after = ShardedSessionStore(ttl_seconds=60, shards=3)
+    # Las sesiones con updated_at anterior a now - 60 ya expiraron
+    assert after.restore(read_snapshot(path), now=now) == 30
+    assert after.get("s49", now=now)["state"].driver_age == 69
+    assert after.get("s10", now=now) is None
+    assert after.prune(now=now + 10) == 5
+
+    with open(path, "r+b") as f:
+        f.truncate(200)
+    assert len(list(read_snapshot(path))) < 50
+
+    # Último registro cortado a mitad del estado: no se entrega un estado incompleto
+    write_snapshot(path, before.snapshot_items())
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 3)
+    items = list(read_snapshot(path))
+    assert len(items) == 49
+    assert all(unpack_session(packed)[0].city == "Quito" for _, packed, _ in items)